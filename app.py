@@ -1,11 +1,27 @@
 ## app.py — чек-лист + саморегистрация с модерацией + подписки TOM/RD + TZ + (опц.) уведомления + мастер выбора роли
 import os
+import copy
+import signal
+import atexit
+import time
 import json
+import hmac
+import base64
+import struct
+import fcntl
+import hashlib
+import importlib.util
 import threading
 import asyncio
 import warnings
+import weakref
+import functools
+import logging
+import concurrent.futures
 from datetime import datetime, timezone, timedelta
+from collections import deque
 from pathlib import Path
+from contextvars import ContextVar
 import html
 from zoneinfo import ZoneInfo
 
@@ -17,14 +33,30 @@ from telegram import (
     BotCommand, BotCommandScopeChat
 )
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler,
-    ContextTypes
+    Application, CommandHandler, CallbackQueryHandler, MessageHandler,
+    ContextTypes, CallbackContext, TypeHandler, filters
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter, NetworkError
+from telegram.request import HTTPXRequest
 from telegram.warnings import PTBUserWarning
 import httpx
 from psycopg_pool import ConnectionPool  # DB pool (Neon)
 
+from statestore import StateStore, empty_state, read_legacy
+from profile_model import Profile
+from runlog import RunLog, read_legacy as read_legacy_runs
+from pgmigrate import Migrator, MigrationBusy
+from evidence import TransferPool, make_storage
+from media import MediaRegistry
+from cltemplates import Template, TemplateRegistry
+from loopwatch import LoopWatchdog
+from tenants import Tenant, TenantRegistry, DEFAULT as DEFAULT_TENANT
+from subsbits import StoreIndex, Subscriptions
+import dbschema
+import logsetup
+
+
+_T_IMPORT = time.monotonic()
 
 # 🔇 Спрячем предупреждение PTB про JobQueue, если его нет
 warnings.filterwarnings("ignore", category=PTBUserWarning)
@@ -50,12 +82,20 @@ app = Flask(__name__)
 DB_URL = os.getenv("DATABASE_URL", "").strip()
 assert DB_URL, "DATABASE_URL is required"
 
-# Pooled connection for serverless Postgres
-pool = ConnectionPool(conninfo=DB_URL, min_size=1, max_size=5, kwargs={"sslmode": "require"})
+# Pooled connection for serverless Postgres (открывается при первом обращении, не на импорте)
+pool = ConnectionPool(conninfo=DB_URL, min_size=1, max_size=5, kwargs={"sslmode": "require"}, open=False)
+_pool_lock = threading.Lock()
+
+def db_pool() -> ConnectionPool:
+    if pool.closed:
+        with _pool_lock:
+            if pool.closed:
+                pool.open(wait=False)
+    return pool
 
 def exec_sql(sql: str, params: tuple | None = None, fetch: bool = False):
     """Helper for simple SQL execution."""
-    with pool.connection() as conn:
+    with db_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params or ())
             if fetch:
@@ -67,18 +107,216 @@ _loop: asyncio.AbstractEventLoop | None = None
 _app: Application | None = None
 _loop_alive = False
 _ptb_ready = False
-BOT_USERNAME = None
 
-def log(msg: str):
-    print(f"[{datetime.utcnow().isoformat(timespec='seconds')}Z] {msg}", flush=True)
+# Логи: запись кладётся в очередь, пишет отдельный поток (logsetup); к каждой записи цепляются
+# update_id/chat_id/user_id/handler текущего апдейта. Частые события (event=…) прореживаются по LOG_SAMPLE.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                                   # json | text
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING,apscheduler=WARNING")      # компонент=уровень,…
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "update=0.01")                            # event=доля,…
+logsetup.setup(LOG_FORMAT, LOG_LEVEL, LOG_LEVELS, LOG_SAMPLE)
+_loggers: dict[str, logging.Logger] = {}
+
+def log(msg: str, *, level: int = logging.INFO, component: str = "app", event: str | None = None,
+        exc_info=None, **fields):
+    lg = _loggers.get(component)
+    if lg is None:
+        lg = _loggers[component] = logging.getLogger(f"{logsetup.ROOT}.{component}")
+    if not lg.isEnabledFor(level):
+        return
+    if event:
+        k = logsetup.sample(event, level)
+        if not k:
+            return
+        fields["event"] = event; fields["_sampled"] = True
+        if k > 1:
+            fields["sampled"] = k  # одна запись представляет столько событий
+    lg.log(level, msg, extra=fields or None, exc_info=exc_info)
+
+def _component_log(component: str):
+    """log для модулей (evidence, media, …): тот же конвейер, свой компонент."""
+    return functools.partial(log, component=component)
+
+# Часы бота: окна напоминаний, журнал и «прогоны за N дней» берут время только отсюда —
+# tools/simulate_reminders.py подставляет виртуальное время через set_clock().
+_clock = lambda: datetime.now(timezone.utc)
+
+def set_clock(fn=None):
+    """fn() → aware datetime; None — системные часы."""
+    global _clock
+    _clock = fn or (lambda: datetime.now(timezone.utc))
+
+def _now(tz=timezone.utc) -> datetime:
+    return _clock().astimezone(tz)
 
 def iso_now():
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+    return _now().isoformat(timespec="seconds")
+
+# ──────────────────────────────────────────────────────────────────────────────
+# HTTP-клиенты Telegram Bot API (пулы keep-alive, таймауты по типам вызовов)
+# ──────────────────────────────────────────────────────────────────────────────
+TG_API_BASE = os.getenv("TG_API_BASE", "https://api.telegram.org").rstrip("/")
+TG_POOL_SIZE = int(os.getenv("TG_POOL_SIZE", "32") or 32)                  # исходящие: send/edit/answer
+TG_UPDATES_POOL_SIZE = int(os.getenv("TG_UPDATES_POOL_SIZE", "2") or 2)    # getUpdates (если без вебхука)
+TG_ADMIN_POOL_SIZE = int(os.getenv("TG_ADMIN_POOL_SIZE", "4") or 4)        # служебные Flask-роуты
+TG_HTTP2 = os.getenv("TG_HTTP2", "0") == "1"
+
+def _env_timeouts(name: str, default: tuple[float, float, float, float]) -> tuple[float, float, float, float]:
+    """TG_TIMEOUT_<KIND>="connect,read,write,pool" в секундах."""
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        c, r, w, p = (float(x) for x in raw.split(","))
+        return c, r, w, p
+    except Exception:
+        log(f"{name}: ожидалось 4 числа через запятую, взяты значения по умолчанию", level=logging.WARNING)
+        return default
+
+# (connect, read, write, pool)
+TG_TIMEOUTS = {
+    "send":    _env_timeouts("TG_TIMEOUT_SEND",    (5.0, 10.0, 10.0, 3.0)),
+    "updates": _env_timeouts("TG_TIMEOUT_UPDATES", (5.0, 35.0, 5.0, 1.0)),
+    "admin":   _env_timeouts("TG_TIMEOUT_ADMIN",   (5.0, 15.0, 15.0, 5.0)),
+}
+TG_MEDIA_WRITE_TIMEOUT = float(os.getenv("TG_MEDIA_WRITE_TIMEOUT", "30") or 30)
+
+def _tg_http2_enabled() -> bool:
+    if TG_HTTP2 and importlib.util.find_spec("h2") is None:
+        log("TG_HTTP2=1, но пакет h2 не установлен — используем HTTP/1.1", level=logging.WARNING)
+        return False
+    return TG_HTTP2
+
+# ── Приоритеты исходящих вызовов: interactive (ответы/правки на нажатия) → notify → bulk ──
+# Класс задаётся контекстом (ContextVar): по умолчанию interactive, рассылки помечены @_outbound_class.
+# bulk/notify идут не более чем в OUTBOUND_BULK_CONCURRENCY потоков и ждут, пока интерактивные вызовы
+# медленнее OUTBOUND_SHED_MS (EWMA) или их в полёте много; bulk, прождавший OUTBOUND_MAX_DEFER_S,
+# отбрасывается (OutboundShed) — напоминания при этом не помечаются отправленными, а задание прерывается до
+# следующего тика (иначе каждый следующий получатель снова ждал бы OUTBOUND_MAX_DEFER_S). Эскалации — notify.
+# Отброшенные смены меню команд возвращаются в очередь CommandMenuSync и повторяются.
+OUTBOUND_BULK_CONCURRENCY = int(os.getenv("OUTBOUND_BULK_CONCURRENCY", "4") or 4)
+OUTBOUND_SHED_MS = float(os.getenv("OUTBOUND_SHED_MS", "800") or 800)
+OUTBOUND_MAX_DEFER_S = float(os.getenv("OUTBOUND_MAX_DEFER_S", "30") or 30)
+OUTBOUND_CLASSES = ("interactive", "notify", "bulk")
+_send_class: ContextVar[str] = ContextVar("send_class", default="interactive")
+
+class OutboundShed(NetworkError):
+    pass
+
+class OutboundScheduler:
+    IDLE_S = 3.0       # нет интерактивных вызовов дольше — защищать некого, EWMA не учитываем
+    ALPHA = 0.2
+    POLL_S = 0.25
+
+    def __init__(self, bulk_limit: int, shed_ms: float, max_defer: float, busy: int):
+        self.bulk_limit, self.shed_s, self.max_defer, self.busy = bulk_limit, shed_ms / 1000, max_defer, busy
+        self.ewma = 0.0
+        self.last_interactive = 0.0
+        self.inflight = dict.fromkeys(OUTBOUND_CLASSES, 0)
+        self.sent = dict.fromkeys(OUTBOUND_CLASSES, 0)
+        self.deferred = 0
+        self.shed = 0
+        self._sem: asyncio.Semaphore | None = None
+        self._sem_loop = None
+
+    def _gate(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._sem_loop is not loop:  # семафор привязан к циклу PTB
+            self._sem, self._sem_loop = asyncio.Semaphore(self.bulk_limit), loop
+        return self._sem
+
+    def congested(self) -> bool:
+        if self.inflight["interactive"] >= self.busy:
+            return True
+        return self.ewma > self.shed_s and time.monotonic() - self.last_interactive < self.IDLE_S
+
+    async def run(self, cls: str, send):
+        if cls == "interactive":
+            self.inflight[cls] += 1; t0 = time.monotonic()
+            try:
+                return await send()
+            finally:
+                self.inflight[cls] -= 1; self.sent[cls] += 1
+                now = time.monotonic()
+                self.ewma += self.ALPHA * ((now - t0) - self.ewma); self.last_interactive = now
+        async with self._gate():
+            waited = 0.0
+            while self.congested():
+                if cls == "bulk" and waited >= self.max_defer:
+                    self.shed += 1
+                    raise OutboundShed(f"bulk send shed after {waited:.0f}s (interactive ewma {self.ewma * 1000:.0f} ms)")
+                if not waited:
+                    self.deferred += 1
+                await asyncio.sleep(self.POLL_S); waited += self.POLL_S
+            self.inflight[cls] += 1
+            try:
+                return await send()
+            finally:
+                self.inflight[cls] -= 1; self.sent[cls] += 1
+
+    def stats(self) -> dict:
+        return {"interactive_ewma_ms": round(self.ewma * 1000, 1), "inflight": dict(self.inflight),
+                "sent": dict(self.sent), "deferred": self.deferred, "shed": self.shed}
+
+_outbound = OutboundScheduler(OUTBOUND_BULK_CONCURRENCY, OUTBOUND_SHED_MS, OUTBOUND_MAX_DEFER_S,
+                              busy=max(1, TG_POOL_SIZE - OUTBOUND_BULK_CONCURRENCY))
+
+def _outbound_class(cls: str):
+    """Все вызовы Bot API внутри корутины (и созданных из неё задач) идут с приоритетом cls."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            token = _send_class.set(cls)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _send_class.reset(token)
+        return wrapper
+    return deco
+
+class PrioritizedRequest(HTTPXRequest):
+    __slots__ = ()
+
+    async def do_request(self, *args, **kwargs):
+        return await _outbound.run(_send_class.get(),
+                                   lambda: super(PrioritizedRequest, self).do_request(*args, **kwargs))
+
+def _tg_request(kind: str) -> HTTPXRequest:
+    """Request-объект PTB для вызовов типа kind ('send' | 'updates')."""
+    c, r, w, p = TG_TIMEOUTS[kind]
+    return (HTTPXRequest if kind == "updates" else PrioritizedRequest)(
+        connection_pool_size=TG_UPDATES_POOL_SIZE if kind == "updates" else TG_POOL_SIZE,
+        connect_timeout=c, read_timeout=r, write_timeout=w, pool_timeout=p,
+        media_write_timeout=TG_MEDIA_WRITE_TIMEOUT,
+        http_version="2" if _tg_http2_enabled() else "1.1",
+    )
+
+_tg_sync_client: httpx.Client | None = None
+_tg_sync_lock = threading.Lock()
+
+def _tg_sync() -> httpx.Client:
+    """Общий синхронный клиент для Flask-роутов (getWebhookInfo, setWebhook…)."""
+    global _tg_sync_client
+    if _tg_sync_client is None or _tg_sync_client.is_closed:
+        with _tg_sync_lock:
+            if _tg_sync_client is None or _tg_sync_client.is_closed:
+                c, r, w, p = TG_TIMEOUTS["admin"]
+                _tg_sync_client = httpx.Client(
+                    base_url=f"{TG_API_BASE}/",
+                    timeout=httpx.Timeout(connect=c, read=r, write=w, pool=p),
+                    limits=httpx.Limits(max_connections=TG_ADMIN_POOL_SIZE,
+                                        max_keepalive_connections=TG_ADMIN_POOL_SIZE),
+                    http2=_tg_http2_enabled(),
+                )
+    return _tg_sync_client
+
+def tg_api_get(method: str, params: dict | None = None, token: str | None = None) -> httpx.Response:
+    return _tg_sync().get(f"bot{token or BOT_TOKEN}/{method}", params=params)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Справочники магазинов (сокращён из твоего списка + добавлены недостающие)
 # ──────────────────────────────────────────────────────────────────────────────
-STORE_CATALOG: dict[str, str] = {
+_BASE_CATALOG: dict[str, str] = {
     "C00X":"RU_ABAKAN_Ametist_SPORT","C0RG":"RU_ARKHANGELSK_TitanArena_SPORT","C082":"RU_GELENDZHIK_Lenina_SPORT",
     "C0JP":"RU_IRKUTSK_ModnyKvartal_SPORT","C03F":"RU_IZHEVSK_Pushkinskaya_SPORT","C09Z":"RU_KALUGA_RIO_SPORT",
     "C0JN":"RU_KRASNODAR_Galereya_SPORT","C0BW":"RU_KRASNОДАР_OzMoll_SPORT",
@@ -101,55 +339,102 @@ STAFF_FILE = DATA_DIR / "staff.json"
 PENDING_FILE = DATA_DIR / "pending.json"
 SUBS_FILE = DATA_DIR / "subs.json"
 TOM_FILE = DATA_DIR / "tom_groups.json"
-RUNS_FILE = DATA_DIR / "check_runs.jsonl"
+RUNS_FILE = DATA_DIR / "check_runs.jsonl"  # старый единый лог — переносится в RUNS_DIR при старте
+RUNS_DIR = DATA_DIR / "runs"
+REMINDERS_FILE = DATA_DIR / "reminders.json"
+MENUS_FILE = DATA_DIR / "menus.json"
+
+# ── Арендаторы (tenants.py): основной бот + боты из TENANTS_FILE в одном процессе ──
+# Файлы выше — у основного бота; у остальных те же имена в их data_dir (см. _tfile). Состояние ниже
+# (STAFF, журнал, подписки, меню, лог прогонов, …) — _tenants.local(): объект текущего арендатора.
+TENANTS_FILE = os.getenv("TENANTS_FILE", "").strip()
+_tenants = TenantRegistry(Tenant(DEFAULT_TENANT, BOT_TOKEN, ADMIN_ID, DATA_DIR, AUDITOR_SECRET, VIEWER_SECRET))
+if TENANTS_FILE:
+    for _extra in TenantRegistry.read_file(TENANTS_FILE, DATA_DIR / "tenants"):
+        _tenants.add(_extra)
+
+def _t() -> Tenant:
+    return _tenants.current()
+
+def _tfile_of(t: Tenant, path: Path) -> Path:
+    return path if t.is_default else t.data_dir / path.relative_to(DATA_DIR)
+
+def _tfile(path: Path) -> Path:
+    """Файл данных текущего арендатора: path основного бота, перенесённый в его data_dir."""
+    return _tfile_of(_tenants.current(), path)
+
+STORE_CATALOG: dict[str, str] = _tenants.local("catalog", lambda t: t.catalog if t.catalog is not None else _BASE_CATALOG)
 
 def _read_json(path: Path, default):
     try:
         if path.exists():
             return json.loads(path.read_text(encoding="utf-8"))
     except Exception as e:
-        log(f"read {path.name} error: {e}")
+        log(f"read {path.name} error: {e}", level=logging.WARNING)
     return default
 
 def _write_json(path: Path, data):
     try:
         path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp = path.with_name(path.name + ".tmp")  # читатель (другой процесс) не видит недописанный файл
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
     except Exception as e:
-        log(f"write {path.name} error: {e}")
-
-def _append_jsonl(path: Path, obj: dict):
+        log(f"write {path.name} error: {e}", level=logging.WARNING)
+
+# staff: {user_id: Profile} — role, stores, current_store, username, name, tz, intended_role?, флаги
+# inactive/approved/awaiting_approval (см. profile_model; доступ как к старому dict сохранён)
+# заполняются в _load_state() (PTB-поток, параллельно с initialize())
+STAFF: dict[int, Profile] = _tenants.local("staff", lambda t: {})
+PENDING: dict[str, dict] = _tenants.local("pending", lambda t: {})
+LAST_RUNS: dict[str, str] = _tenants.local("last_runs", lambda t: {})  # store -> iso ts последнего прогона (индекс)
+
+# ── Персист: append-only журнал изменений (statestore) + снапшот каждые N событий ──
+# staff.json / pending.json / subs.json читаются только один раз — при переезде на журнал.
+STATE_SNAPSHOT_EVERY = int(os.getenv("STATE_SNAPSHOT_EVERY", "500") or 500)
+STATE_SNAPSHOT_FORMAT = os.getenv("STATE_SNAPSHOT_FORMAT", "bin")   # bin (statefile) | json
+# сколько новый процесс ждёт flock писателя DATA_DIR (statestore), пока старый дренируется; дольше — StateLocked
+STATE_LOCK_WAIT_S = float(os.getenv("STATE_LOCK_WAIT_S", "60") or 60)
+_store: StateStore = _tenants.local("store", lambda t: StateStore(t.data_dir, snapshot_every=STATE_SNAPSHOT_EVERY,
+                                                                  fmt=STATE_SNAPSHOT_FORMAT, profile_cls=Profile))
+_actor: ContextVar[int | None] = ContextVar("actor", default=None)  # кто инициировал изменение (аудит)
+
+def _state_view() -> dict:
+    return {"staff": {uid: p.to_dict() for uid, p in STAFF.items()}, "pending": dict(PENDING), "subs": _subs.as_lists(),
+            "runs": dict(LAST_RUNS)}
+
+def _persist(op: str, key, value=None):
     try:
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        _store.append(op, key, value, actor=_actor.get())
+        if _store.should_compact():
+            _store.compact(_state_view())
     except Exception as e:
-        log(f"append {path.name} error: {e}")
+        log(f"state {op} {key} error: {e}", level=logging.WARNING)
 
-# staff: {user_id: {role, stores, current_store, username, name, tz?, inactive?, intended_role?, awaiting_approval?, approved?}}
-STAFF: dict[int, dict] = {int(k): v for k, v in _read_json(STAFF_FILE, {}).items()}
-PENDING: dict[str, dict] = _read_json(PENDING_FILE, {})
+def _save_profile(uid: int):
+    if uid in STAFF: _persist("staff.put", uid, STAFF[uid].to_dict())
+    else: _persist("staff.del", uid)
 
-def _save_staff(): _write_json(STAFF_FILE, {str(k): v for k, v in STAFF.items()})
-def _save_pending(): _write_json(PENDING_FILE, PENDING)
+def _save_pending(req_id: str):
+    if req_id in PENDING: _persist("pending.put", req_id, PENDING[req_id])
+    else: _persist("pending.del", req_id)
 
-def is_admin(uid: int) -> bool: return ADMIN_ID and uid == ADMIN_ID
+def is_admin(uid: int) -> bool:
+    admin = _tenants.current().admin_id
+    return admin and uid == admin
 
-def get_profile(uid: int) -> dict:
+def get_profile(uid: int) -> Profile:
     prof = STAFF.get(uid)
-    if not prof:
-        prof = {"role": "viewer", "stores": [], "current_store": None, "username": "", "name": "", "tz": "Europe/Moscow"}
-        STAFF[uid] = prof
-        _save_staff()
-    if "tz" not in prof:
-        prof["tz"] = "Europe/Moscow"
+    if prof is None:
+        prof = STAFF[uid] = Profile()
+        _save_profile(uid)
     return prof
 
 def _upd_from_user(user, prof):
     prof["username"] = user.username or ""
     prof["name"] = f"{user.first_name or ''} {user.last_name or ''}".strip()
 
-def must_have_store(update: Update, prof: dict) -> str | None:
+def must_have_store(update: Update, prof: Profile) -> str | None:
     if not prof.get("current_store"):
         return "Сначала выбери магазин: /stores → /setstore &lt;КОД&gt; или /register &lt;КОД&gt; &lt;СЕКРЕТ&gt;"
     cur = prof["current_store"]
@@ -160,29 +445,23 @@ def must_have_store(update: Update, prof: dict) -> str | None:
 # ──────────────────────────────────────────────────────────────────────────────
 # Подписки (персист + индексы)
 # ──────────────────────────────────────────────────────────────────────────────
-def _load_subs():
-    raw = _read_json(SUBS_FILE, {"USER_SUBS": {}, "STORE_SUBS": {}})
-    user_subs = {}
-    for k, v in raw.get("USER_SUBS", {}).items():
-        uid = int(k)
-        if v == "*" or (isinstance(v, list) and "*" in v):
-            user_subs[uid] = {"*"}
-        else:
-            user_subs[uid] = set(v or [])
-    store_subs = {code: set(map(int, lst)) for code, lst in raw.get("STORE_SUBS", {}).items()}
-    return user_subs, store_subs
-
-def _save_subs():
-    USER_SUBS_JSON = {}
-    for uid, subs in USER_SUBS.items():
-        if "*" in subs:
-            USER_SUBS_JSON[str(uid)] = "*"
-        else:
-            USER_SUBS_JSON[str(uid)] = sorted(list(subs))
-    STORE_SUBS_JSON = {code: sorted(list(uids)) for code, uids in STORE_SUBS.items()}
-    _write_json(SUBS_FILE, {"USER_SUBS": USER_SUBS_JSON, "STORE_SUBS": STORE_SUBS_JSON})
+# _subs (subsbits): uid -> маска магазинов (бит "*" = все магазины, точечные коды при этом сохраняются)
+# и обратный индекс магазин -> маска пользователей; наружу (журнал, снапшот, тексты) — отсортированные коды.
+def _legacy_state() -> dict:
+    try:
+        return read_legacy(_t().data_dir)
+    except Exception as e:
+        log(f"legacy state import error: {e}", level=logging.WARNING); return empty_state()
+
+def _save_subs(uid: int):
+    if uid in _subs: _persist("subs.put", uid, _subs.codes(uid))
+    else: _persist("subs.del", uid)
 
-USER_SUBS, STORE_SUBS = _load_subs()
+def _new_subs(t: Tenant) -> Subscriptions:
+    catalog = STORE_CATALOG.of(t)
+    return Subscriptions(StoreIndex(sorted(catalog)), catalog=catalog)
+
+_subs: Subscriptions = _tenants.local("subs", _new_subs)
 
 def _is_valid_store(code: str) -> bool:
     return code in STORE_CATALOG
@@ -196,56 +475,29 @@ def _normalize_codes(codes):
     return norm, invalid
 
 def _subscribe_codes(uid: int, codes: list[str]) -> tuple[int, list[str]]:
-    if uid not in USER_SUBS:
-        USER_SUBS[uid] = set()
-    if "*" in USER_SUBS[uid]:
+    if _subs.follows_all(uid):
         return 0, []
-    added, ignored = 0, []
-    for code in codes:
-        if code in USER_SUBS[uid]:
-            ignored.append(code); continue
-        USER_SUBS[uid].add(code)
-        STORE_SUBS.setdefault(code, set()).add(uid)
-        added += 1
-    _save_subs()
+    added, ignored = _subs.subscribe(uid, codes)
+    _save_subs(uid)
     return added, ignored
 
 def _unsubscribe_codes(uid: int, codes: list[str]) -> int:
-    removed = 0
-    subs = USER_SUBS.get(uid, set())
-    for code in codes:
-        if code in subs:
-            subs.remove(code); removed += 1
-        if code in STORE_SUBS:
-            STORE_SUBS[code].discard(uid)
-            if not STORE_SUBS[code]:
-                del STORE_SUBS[code]
-    USER_SUBS[uid] = subs
-    _save_subs()
+    removed = _subs.unsubscribe(uid, codes)
+    _save_subs(uid)
     return removed
 
 def _subscribe_all(uid: int):
-    USER_SUBS[uid] = {"*"}; _save_subs()
+    _subs.set_all(uid, True); _save_subs(uid)
 
 def _unsubscribe_all(uid: int):
-    subs = USER_SUBS.get(uid, set())
-    subs.discard("*")
-    USER_SUBS[uid] = subs; _save_subs()
+    _subs.set_all(uid, False); _save_subs(uid)
 
 def _recipients_for_store(code: str) -> set[int]:
-    direct = set(STORE_SUBS.get(code, set()))
-    all_followers = {uid for uid, subs in USER_SUBS.items() if subs and "*" in subs}
-    return direct | all_followers
+    return _subs.recipients(code)
 
 def _clear_all_subs_for_user(uid: int):
-    subs = USER_SUBS.pop(uid, set())
-    subs.discard("*")
-    for code in list(subs):
-        if code in STORE_SUBS:
-            STORE_SUBS[code].discard(uid)
-            if not STORE_SUBS[code]:
-                del STORE_SUBS[code]
-    _save_subs()
+    _subs.remove(uid)
+    _save_subs(uid)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # ТОМ-группы + RD (все магазины)
@@ -261,14 +513,13 @@ DEFAULT_TOM_GROUPS = {
     "Косинова Алина": ["C09Z","C0IZ","C0DY","C0SM"],
 }
 
-TOM_GROUPS: dict[str, dict] = {}  # slug -> {"title": str, "codes": [str]}
+TOM_GROUPS: dict[str, dict] = _tenants.local("tom_groups", lambda t: {})  # slug -> {"title": str, "codes": [str]}
 
 def _slugify(title: str) -> str:
     return "tom_" + "".join(ch if ch.isalnum() else "_" for ch in title).strip("_").lower()
 
 def _load_tom_groups():
-    global TOM_GROUPS
-    cfg = _read_json(TOM_FILE, {"groups": DEFAULT_TOM_GROUPS})
+    cfg = _read_json(_tfile(TOM_FILE), {"groups": DEFAULT_TOM_GROUPS})
     src = cfg.get("groups") or DEFAULT_TOM_GROUPS
     groups = {}
     for title, codes in src.items():
@@ -276,12 +527,10 @@ def _load_tom_groups():
         if not codes_norm:
             continue
         slug = _slugify(title)
-        groups[slug] = {"title": title, "codes": sorted(set(codes_norm))}
-    TOM_GROUPS = groups
+        groups[slug] = {"title": title, "codes": sorted(set(codes_norm)), "mask": _subs.index.mask(codes_norm)}
+    TOM_GROUPS.clear(); TOM_GROUPS.update(groups)
     log(f"TOM groups loaded: {len(TOM_GROUPS)}")
 
-_load_tom_groups()
-
 # ──────────────────────────────────────────────────────────────────────────────
 # Команды/меню
 # ──────────────────────────────────────────────────────────────────────────────
@@ -326,21 +575,141 @@ ROLE_COMMANDS: dict[str, list[BotCommand]] = {
         BotCommand("deactivate", "деактивировать пользователя"),
         BotCommand("tom", "подписка по ТОМ / RD"),
         BotCommand("reload_tom", "перечитать группы ТОМ"),
+        BotCommand("reload_examples", "перечитать примеры фото"),
+        BotCommand("reload_templates", "перечитать шаблоны чек-листа"),
+        BotCommand("audit", "журнал изменений по юзеру"),
         BotCommand("settz", "установить часовой пояс"),
     ],
 }
 
-def _role_for_display(uid: int, prof: dict) -> str:
+def _role_for_display(uid: int, prof: Profile) -> str:
     return "admin" if is_admin(uid) else prof.get("role", "viewer")
 
+def _menu_hash(commands: list[BotCommand]) -> str:
+    raw = "\n".join(f"{c.command}\t{c.description}" for c in commands)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def _menus_catalog_hash() -> str:
+    return hashlib.sha1("|".join(f"{r}:{_menu_hash(c)}" for r, c in sorted(ROLE_COMMANDS.items())).encode()).hexdigest()[:16]
+
+MENU_SYNC_BATCH_DELAY = float(os.getenv("MENU_SYNC_BATCH_DELAY", "2") or 2)   # сек, окно пакета смен ролей
+MENU_SYNC_RATE = float(os.getenv("MENU_SYNC_RATE", "5") or 5)                 # вызовов/сек при реконсиляции
+
+class CommandMenuSync:
+    """Помнит хэш меню, применённого в каждом чате, и не зовёт set_my_commands впустую.
+
+    schedule() копит смены ролей и применяет их пачкой в фоне; reconcile_all() при старте
+    пересинхронизирует все чаты в темпе MENU_SYNC_RATE, если ROLE_COMMANDS изменились.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.applied: dict[int, str] = {}
+        self.catalog: str | None = None
+        self._queue: dict[int, int] = {}  # chat_id -> user_id
+        self._drainer: asyncio.Task | None = None
+
+    def load(self):
+        raw = _read_json(self.path, {})
+        self.applied = {int(k): v for k, v in raw.get("chats", {}).items()}
+        self.catalog = raw.get("catalog")
+
+    def _save(self):
+        _write_json(self.path, {"catalog": self.catalog, "chats": {str(k): v for k, v in self.applied.items()}})
+
+    @staticmethod
+    def _desired(user_id: int) -> list[BotCommand]:
+        role = _role_for_display(user_id, get_profile(user_id))
+        return ROLE_COMMANDS.get(role, ROLE_COMMANDS["viewer"])
+
+    async def ensure(self, bot, chat_id: int, user_id: int, force: bool = False, save: bool = True) -> bool | None:
+        """True — меню применено, False — уже было актуальным, None — ошибка Bot API.
+
+        OutboundShed пробрасывается: вызов не сделан, и решать, когда повторить, должен вызывающий.
+        """
+        commands = self._desired(user_id); h = _menu_hash(commands)
+        if not force and self.applied.get(chat_id) == h:
+            return False
+        try:
+            await bot.set_my_commands(commands=commands, scope=BotCommandScopeChat(chat_id))
+        except OutboundShed:
+            raise
+        except Exception as e:
+            log(f"set_my_commands error for chat {chat_id}: {e}", level=logging.WARNING); return None
+        self.applied[chat_id] = h
+        if save: self._save()
+        return True
+
+    def schedule(self, bot, chat_id: int, user_id: int):
+        self._queue[chat_id] = user_id
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.get_running_loop().create_task(self._drain(bot))
+
+    def _requeue(self, pending: dict[int, int]):
+        """Вернуть несделанное в очередь; более свежие смены ролей из очереди важнее."""
+        self._queue = {**pending, **self._queue}
+
+    @_outbound_class("bulk")
+    async def _drain(self, bot):
+        await asyncio.sleep(MENU_SYNC_BATCH_DELAY)
+        while self._queue:
+            batch, self._queue = self._queue, {}
+            items = list(batch.items())
+            for i, (chat_id, user_id) in enumerate(items):
+                try:
+                    await self.ensure(bot, chat_id, user_id, save=False)
+                except OutboundShed:
+                    # канал занят интерактивом — остаток пачки ждёт следующего круга, а не теряется
+                    self._requeue(dict(items[i:]))
+                    log(f"menus: отложено {len(items) - i} чатов (исходящие перегружены)", level=logging.WARNING)
+                    await asyncio.sleep(MENU_SYNC_BATCH_DELAY)
+                    break
+                await asyncio.sleep(1 / MENU_SYNC_RATE)
+            self._save()
+
+    async def flush(self, bot):
+        """Досинхронизировать очередь сразу, без пауз (остановка)."""
+        if self._drainer is not None and not self._drainer.done():
+            self._drainer.cancel()
+        batch, self._queue = self._queue, {}
+        for chat_id, user_id in batch.items():
+            await self.ensure(bot, chat_id, user_id, save=False)
+        if batch:
+            self._save()
+
+    @_outbound_class("bulk")
+    async def reconcile_all(self, bot):
+        """catalog сохраняется, только когда все чаты получили новое меню: иначе следующий старт повторит
+        не получившиеся (уже применённые ensure пропустит без вызова)."""
+        current = _menus_catalog_hash()
+        if self.catalog == current:
+            return
+        log(f"menus: ROLE_COMMANDS изменились — пересинхронизация {len(STAFF)} чатов")
+        changed = failed = 0
+        uids = list(STAFF.keys())
+        for i, uid in enumerate(uids):
+            try:
+                res = await self.ensure(bot, uid, uid, save=False)
+            except OutboundShed:
+                # остаток — фоновой очередью, она повторяет после сброса
+                failed += len(uids) - i
+                self._requeue({u: u for u in uids[i:]})
+                self.schedule(bot, uids[i], uids[i])
+                break
+            if res is None:
+                failed += 1
+            elif res:
+                changed += 1
+                await asyncio.sleep(1 / MENU_SYNC_RATE)
+        if not failed:
+            self.catalog = current
+        self._save()
+        log(f"menus: обновлено {changed}, не удалось/отложено {failed}")
+
+_menus: CommandMenuSync = _tenants.local("menus", lambda t: CommandMenuSync(_tfile_of(t, MENUS_FILE)))
+
 async def refresh_chat_commands(bot, chat_id: int, user_id: int):
-    prof = get_profile(user_id)
-    role = _role_for_display(user_id, prof)
-    commands = ROLE_COMMANDS.get(role, ROLE_COMMANDS["viewer"])
-    try:
-        await bot.set_my_commands(commands=commands, scope=BotCommandScopeChat(chat_id))
-    except Exception as e:
-        log(f"set_my_commands error for chat {chat_id}: {e}")
+    await _menus.ensure(bot, chat_id, user_id)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Чек-лист (данные/рендер)
@@ -391,6 +760,34 @@ CHECKLIST = [
     ]},
 ]
 
+# Шаблоны: CHECKLIST — встроенный default@1; файлы CHECKLIST_TEMPLATES_DIR/*.json (и таблица
+# checklist_templates при CHECKLIST_TEMPLATES_DB=1) добавляют шаблоны по магазинам/форматам и новые
+# версии. Прогон запоминает свой id@version (st["tpl"]) и доходит до конца на нём даже после /reload_templates.
+CHECKLIST_TEMPLATES_DIR = Path(os.getenv("CHECKLIST_TEMPLATES_DIR", "checklist_templates"))
+CHECKLIST_TEMPLATES_DB = os.getenv("CHECKLIST_TEMPLATES_DB", "0") == "1"
+_templates = TemplateRegistry(Template("default", 1, CHECKLIST, title="Стандарт"),
+                              log=_component_log("templates"))
+
+def _db_templates() -> list[Template]:
+    rows = exec_sql("""SELECT DISTINCT ON (id) id, version, body FROM checklist_templates
+                       WHERE active ORDER BY id, version DESC""", fetch=True) or []
+    return [Template.from_dict({**body, "id": tid, "version": ver}, source="db") for tid, ver, body in rows]
+
+def _load_templates() -> dict:
+    templates, errors = TemplateRegistry.read_dir(CHECKLIST_TEMPLATES_DIR)
+    if CHECKLIST_TEMPLATES_DB:
+        try:
+            templates += _db_templates()
+        except Exception as e:
+            errors.append(f"db: {e}")
+    return _templates.reload(templates, errors)
+
+def _cl_select(store_code: str | None) -> Template:
+    return _templates.for_store(store_code, STORE_CATALOG.get(store_code or "", ""))
+
+def _cl_tpl(st) -> Template:
+    return _templates.get(st.get("tpl"))
+
 EXAMPLE_PHOTOS = {
     0: ["AgACAgIAAxkBAAN-aPc9fUdYqxNInDdLrh01UHckFW0AApL-MRvGH7hLzIOseULYaQ0BAAMCAAN4AAM2BA"],
     1: ["AgACAgIAAxkBAAN7aPc9WeexQm229VrzIW07tL18TccAAo3-MRvGH7hLuY3p8Zmreq8BAAMCAAN4AAM2BA"],
@@ -400,37 +797,113 @@ EXAMPLE_PHOTOS = {
     6: ["AgACAgIAAxkBAAN_aPc9hXcYmK--YdH5wyJGthZp7kIAApP-MRvGH7hLalo9O7bUB34BAAMCAAN4AAM2BA"],
 }
 
-_cl_state = {}  # chat_id -> {"sec": int, "marks": {sec: {item: bool|None}}}
+# Примеры: картинки из EXAMPLES_DIR/<номер раздела>/ загружаются один раз, file_id кэшируются в
+# MEDIA_CACHE_FILE; EXAMPLE_PHOTOS — уже загруженные file_id (seeds), уходят вместе с файлами одним альбомом.
+EXAMPLES_DIR = Path(os.getenv("EXAMPLES_DIR", "examples"))
+MEDIA_CACHE_FILE = DATA_DIR / "media_cache.json"
+# file_id действительны только для своего бота: кэш — у каждого арендатора, seeds — только у основного
+_media: MediaRegistry = _tenants.local("media", lambda t: MediaRegistry(
+    EXAMPLES_DIR, _tfile_of(t, MEDIA_CACHE_FILE), seeds=EXAMPLE_PHOTOS if t.is_default else None,
+    log=_component_log("media")))
+
+_cl_state = _tenants.local("cl_state", lambda t: {})  # chat_id -> {"sec": int, "marks": {sec: {item: bool|None}}, "rev": int, "cid": int, "tpl": "id@ver"}
 FINISHED_KEYS = set()
 
-def _cl_get(cid: int):
+def _cl_get(cid: int, store_code: str | None = None):
     st = _cl_state.get(cid)
     if not st:
-        st = {"sec": 0, "marks": {}}
+        st = {"sec": 0, "marks": {}, "rev": 0, "cid": cid, "tpl": _cl_select(store_code).key}
         _cl_state[cid] = st
     return st
 
-def _human_sec_progress(st) -> tuple[int, int]:
-    done = 0
-    total = 0
-    for si, sec in enumerate(CHECKLIST):
-        total += len(sec["items"])
+def _cl_touch(st):
+    st["rev"] = (st.get("rev", 0) + 1) & 0xFFFF
+
+# ── Stateless-режим: состояние чек-листа едет в callback_data (подписанный токен) ──
+# Токен = base64url(ver | sec | rev | fp шаблона | marks в base-3 | HMAC[:8]); MAC покрывает chat_id,
+# id@version шаблона и его раскладку, так что чужой или устаревший (после смены чек-листа) токен не примется.
+# Если кнопка с токеном не влезает в 64 байта — остаётся серверное состояние _cl_state.
+CL_STATELESS = os.getenv("CL_STATELESS", "0") == "1"
+_CL_TOKEN_VER = 2
+_CL_HEAD = struct.Struct(">BBHH")
+_CL_MAC_LEN = 8
+_CL_STATE_KEY = (os.getenv("CL_STATE_SECRET", "").strip()
+                 or hashlib.sha256(("cl-state:" + BOT_TOKEN).encode()).hexdigest()).encode()
+CALLBACK_DATA_LIMIT = 64
+
+def _cl_mac(cid: int, tpl: Template, payload: bytes) -> bytes:
+    msg = struct.pack(">q", cid) + tpl.key.encode() + bytes(tpl.layout) + payload
+    return hmac.new(_CL_STATE_KEY, msg, hashlib.sha256).digest()[:_CL_MAC_LEN]
+
+def _cl_encode(st) -> str:
+    tpl = _cl_tpl(st); layout = tpl.layout; n = tpl.total
+    v = 0
+    for si, cnt in enumerate(layout):
         sec_marks = st["marks"].get(si, {})
-        for ii in range(len(sec["items"])):
-            if sec_marks.get(ii) is True:
-                done += 1
-    return done, total
+        for ii in range(cnt):
+            m = sec_marks.get(ii)
+            v = v * 3 + (0 if m is None else (1 if m else 2))
+    nbytes = max(1, ((3 ** n - 1).bit_length() + 7) // 8)
+    payload = _CL_HEAD.pack(_CL_TOKEN_VER, st["sec"], st.get("rev", 0), tpl.fp) + v.to_bytes(nbytes, "big")
+    raw = payload + _cl_mac(st["cid"], tpl, payload)
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _cl_decode(cid: int, token: str) -> dict | None:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except Exception:
+        return None
+    payload, mac = raw[:-_CL_MAC_LEN], raw[-_CL_MAC_LEN:]
+    if len(payload) < _CL_HEAD.size + 1:
+        return None
+    ver, sec, rev, fp = _CL_HEAD.unpack(payload[:_CL_HEAD.size])
+    tpl = next((t for t in _templates.by_fp(fp) if hmac.compare_digest(mac, _cl_mac(cid, t, payload))), None)
+    if tpl is None or ver != _CL_TOKEN_VER or sec >= len(tpl.layout):
+        return None
+    layout = tpl.layout
+    v = int.from_bytes(payload[_CL_HEAD.size:], "big")
+    digits = []
+    for _ in range(tpl.total):
+        v, d = divmod(v, 3); digits.append(d)
+    digits.reverse()
+    marks, pos = {}, 0
+    for si, cnt in enumerate(layout):
+        sec_marks = {ii: digits[pos + ii] == 1 for ii in range(cnt) if digits[pos + ii]}
+        if sec_marks:
+            marks[si] = sec_marks
+        pos += cnt
+    return {"sec": sec, "marks": marks, "rev": rev, "cid": cid, "tpl": tpl.key}
+
+def _cl_cb(data: str, st) -> str:
+    """callback_data для кнопки чек-листа: в stateless-режиме — с токеном, если влезает."""
+    if not CL_STATELESS or "cid" not in st:
+        return data
+    cb = f"{data}~{_cl_encode(st)}"
+    return cb if len(cb.encode()) <= CALLBACK_DATA_LIMIT else data
+
+def _cl_resolve(cid: int, token: str, store_code: str | None = None):
+    """Выбираем более свежее из локального состояния и токена (по rev с учётом переполнения)."""
+    local = _cl_state.get(cid)
+    tok = _cl_decode(cid, token) if (CL_STATELESS and token) else None
+    if tok is None:
+        return local or _cl_get(cid, store_code)
+    if local is None or (0 < ((tok["rev"] - local.get("rev", 0)) & 0xFFFF) < 0x8000):
+        _cl_state[cid] = tok
+        return tok
+    return local
+
+_MARK_SYM = {True: "✅", False: "❌", None: "⬜️"}
+
+def _human_sec_progress(st) -> tuple[int, int]:
+    return _cl_tpl(st).progress(st["marks"])
 
 
 def _fmt_section_text(si: int, st) -> str:
-    sec = CHECKLIST[si]
+    tpl = _cl_tpl(st); sec = tpl.sections[si]
     sec_marks = st["marks"].get(si, {})
-    lines = [f"*{sec['title']}*"]
-    for ii, text in enumerate(sec["items"]):
-        mark = sec_marks.get(ii)
-        sym = "✅" if mark is True else ("❌" if mark is False else "⬜️")
-        lines.append(f"{ii+1}. {sym} {text}")
-    done, total = _human_sec_progress(st)
+    lines = [sec.header]
+    lines += [head + _MARK_SYM[sec_marks.get(ii)] + tail for ii, (head, tail) in enumerate(zip(sec.item_heads, sec.item_tails))]
+    done, total = tpl.progress(st["marks"])
     pct = int(round(100*done/total)) if total else 0
     lines += ["", f"Прогресс: *{done}/{total}* ({pct}%)", "_Отмечай каждый пункт как ✅ или ❌. Без пропусков._"]
     return "\n".join(lines)
@@ -439,13 +912,14 @@ def _fmt_section_text(si: int, st) -> str:
 def _fmt_progress_text(st) -> str:
     """Format overall progress across all sections for Markdown."""
     lines = ["*Прогресс по чек-листу*"]
-    done, total = _human_sec_progress(st)
+    tpl = _cl_tpl(st)
+    done, total = tpl.progress(st["marks"])
     pct = int(round(100 * done / total)) if total else 0
     lines.append(f"Всего: *{done}/{total}* ({pct}%)")
-    for i, sec in enumerate(CHECKLIST):
+    for i, sec in enumerate(tpl.sections):
         sec_marks = st["marks"].get(i, {}) or {}
         d = sum(1 for v in sec_marks.values() if v is True)
-        t = len(sec["items"])
+        t = sec.n
         if t == 0:
             sym = "⬜️"
         elif d == 0:
@@ -454,30 +928,27 @@ def _fmt_progress_text(st) -> str:
             sym = "✅"
         else:
             sym = "🟡"
-        lines.append(f"{i+1}. {sym} {sec['title']} — {d}/{t}")
+        lines.append(f"{i+1}. {sym} {sec.title} — {d}/{t}")
     lines.append("_Отмечай каждый пункт как ✅ или ❌. Без пропусков._")
     return "\n".join(lines)
 
 def _kb_section(si: int, st):
-    sec = CHECKLIST[si]
+    tpl = _cl_tpl(st); sec = tpl.sections[si]
     sec_marks = st["marks"].get(si, {})
-    rows = []
-    for ii in range(len(sec["items"])):
-        v = sec_marks.get(ii)
-        sym = "✅" if v is True else ("❌" if v is False else "⬜️")
-        rows.append([InlineKeyboardButton(f"{ii+1} {sym}", callback_data=f"cl:toggle:{ii}")])
+    rows = [[InlineKeyboardButton(label + _MARK_SYM[sec_marks.get(ii)], callback_data=_cl_cb(cb, st))]
+            for ii, (label, cb) in enumerate(zip(sec.labels, sec.toggle_cb))]
     # Навигация
     rows.append([
-        InlineKeyboardButton("⬅ Назад", callback_data="cl:prev"),
-        InlineKeyboardButton("➡ Далее", callback_data="cl:next"),
+        InlineKeyboardButton("⬅ Назад", callback_data=_cl_cb("cl:prev", st)),
+        InlineKeyboardButton("➡ Далее", callback_data=_cl_cb("cl:next", st)),
     ])
     # Экстры
-    extras = [InlineKeyboardButton("📋 Прогресс", callback_data="cl:progress")]
-    if si in EXAMPLE_PHOTOS:
-        extras.insert(0, InlineKeyboardButton("📷 Пример", callback_data="cl:photo"))
+    extras = [InlineKeyboardButton("📋 Прогресс", callback_data=_cl_cb("cl:progress", st))]
+    if _media.has(si, tpl.id):
+        extras.insert(0, InlineKeyboardButton("📷 Пример", callback_data=_cl_cb("cl:photo", st)))
     rows.append(extras)
-    rows.append([InlineKeyboardButton("📑 Перейти к разделу", callback_data="cl:goto")])
-    rows.append([InlineKeyboardButton("♻️ Сброс секции", callback_data="cl:resetsec")])
+    rows.append([InlineKeyboardButton("📑 Перейти к разделу", callback_data=_cl_cb("cl:goto", st))])
+    rows.append([InlineKeyboardButton("♻️ Сброс секции", callback_data=_cl_cb("cl:resetsec", st))])
     return InlineKeyboardMarkup(rows)
 
 
@@ -491,6 +962,113 @@ async def _safe_edit(q, text: str, reply_markup=None, parse_mode: str | None = "
         else:
             raise
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Склейка правок: быстрые тапы по одному сообщению → одна итоговая правка
+# ──────────────────────────────────────────────────────────────────────────────
+EDIT_COALESCE_WINDOW = float(os.getenv("EDIT_COALESCE_MS", "350") or 350) / 1000
+
+class EditCoalescer:
+    """Держит последнюю версию текста/клавиатуры по (chat_id, message_id).
+
+    Отложенная правка уходит через window секунд; если за это время пришли новые
+    версии — отправляется только последняя. Правки одного чата выполняются строго
+    по очереди (per-chat lock), поэтому более старая версия не перезатрёт новую.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._pending: dict[tuple[int, int], dict] = {}
+        self._timers: dict[tuple[int, int], asyncio.Task] = {}
+        self._chat_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    def _lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock(); self._chat_locks[chat_id] = lock
+        return lock
+
+    async def submit(self, bot, chat_id: int, message_id: int, text: str,
+                     reply_markup=None, parse_mode: str | None = "Markdown", delay: float | None = None):
+        key = (chat_id, message_id)
+        self._pending[key] = {"text": text, "reply_markup": reply_markup, "parse_mode": parse_mode}
+        delay = self.window if delay is None else delay
+        if delay <= 0:
+            timer = self._timers.pop(key, None)
+            if timer: timer.cancel()
+            await self._flush(bot, key); return
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._delayed(bot, key, delay))
+
+    async def _delayed(self, bot, key: tuple[int, int], delay: float):
+        await asyncio.sleep(delay)
+        self._timers.pop(key, None)  # дальше — уже не отменяем, правка в полёте
+        await self._flush(bot, key)
+
+    async def _flush(self, bot, key: tuple[int, int]):
+        async with self._lock(key[0]):
+            payload = self._pending.pop(key, None)
+            for _ in range(3):
+                if payload is None: return
+                try:
+                    await bot.edit_message_text(chat_id=key[0], message_id=key[1], **payload); return
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    payload = self._pending.pop(key, payload)  # за время паузы могла прийти версия новее
+                except BadRequest as e:
+                    if "Message is not modified" not in str(e):
+                        log(f"edit {key} error: {e}", level=logging.WARNING)
+                    return
+                except Exception as e:
+                    log(f"edit {key} error: {e}", level=logging.WARNING); return
+
+    def reset(self):
+        """Таймеры и замки принадлежали старому циклу; несброшенные версии остаются в _pending."""
+        self._timers = {}
+        self._chat_locks = weakref.WeakValueDictionary()
+
+    async def flush_all(self, bot):
+        for key in list(self._pending):
+            timer = self._timers.pop(key, None)
+            if timer: timer.cancel()
+            await self._flush(bot, key)
+
+_edits: EditCoalescer = _tenants.local("edits", lambda t: EditCoalescer(EDIT_COALESCE_WINDOW))
+
+async def _cl_edit(q, text: str, reply_markup=None, coalesce: bool = False):
+    """Правка сообщения чек-листа через общий конвейер (сохраняет порядок с отложенными правками)."""
+    await _edits.submit(q.get_bot(), q.message.chat_id, q.message.message_id, text,
+                        reply_markup=reply_markup, delay=None if coalesce else 0)
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Конкурентная обработка апдейтов: блокировки по чату/пользователю
+# ──────────────────────────────────────────────────────────────────────────────
+# PTB_CONCURRENCY > 1 включает параллельную обработку апдейтов (не больше N одновременно).
+# Изменения профиля/подписок идут под замком пользователя, чек-лист — под замком чата;
+# чтение (whoami, stores, bindings…) без замков.
+PTB_CONCURRENCY = max(1, int(os.getenv("PTB_CONCURRENCY", "1") or 1))
+
+_locks: weakref.WeakValueDictionary[tuple[str, int], asyncio.Lock] = weakref.WeakValueDictionary()
+
+def _key_lock(scope: str, key: int) -> asyncio.Lock:
+    lock = _locks.get((scope, key))
+    if lock is None:
+        lock = asyncio.Lock(); _locks[(scope, key)] = lock
+    return lock
+
+def _user_lock(uid: int) -> asyncio.Lock:
+    return _key_lock("user", uid)
+
+def _locked(scope: str = "user"):
+    """Хэндлер выполняется под замком effective_user (scope='user') или effective_chat (scope='chat')."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            ent = update.effective_chat if scope == "chat" else update.effective_user
+            async with _key_lock(scope, ent.id if ent else 0):
+                return await fn(update, context)
+        return wrapper
+    return deco
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Мастер выбора роли (новое)
 # ──────────────────────────────────────────────────────────────────────────────
@@ -500,6 +1078,7 @@ def _kb_role_picker():
         [InlineKeyboardButton("👀 Наблюдатель (VM, ТОМ, РД)", callback_data="role:pick:viewer")],
     ])
 
+@_locked("user")
 async def role_pick_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.data.startswith("role:"): return
@@ -510,7 +1089,7 @@ async def role_pick_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     uid = q.from_user.id
     prof = get_profile(uid)
     prof["intended_role"] = role  # ориентация до модерации
-    _save_staff()
+    _save_profile(uid)
 
     if role == "auditor":
         text = (
@@ -547,12 +1126,14 @@ def _gen_req_id(user_id: int) -> str:
     return f"R{ts}_{user_id}"
 
 def _role_from_secret(secret: str) -> str | None:
-    if AUDITOR_SECRET and secret == AUDITOR_SECRET: return "auditor"
-    if VIEWER_SECRET and secret == VIEWER_SECRET:   return "viewer"
+    t = _t()
+    if t.auditor_secret and secret == t.auditor_secret: return "auditor"
+    if t.viewer_secret and secret == t.viewer_secret:   return "viewer"
     return None
 
 async def _notify_admin_new(context: ContextTypes.DEFAULT_TYPE, req_id: str):
-    if not ADMIN_ID: return
+    admin_id = _t().admin_id
+    if not admin_id: return
     r = PENDING[req_id]
     esc = lambda s: html.escape(str(s or ""))
     text = (
@@ -565,8 +1146,9 @@ async def _notify_admin_new(context: ContextTypes.DEFAULT_TYPE, req_id: str):
     )
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Одобрить", callback_data=f"reg:approve:{req_id}"),
                                 InlineKeyboardButton("❌ Отклонить", callback_data=f"reg:reject:{req_id}")]])
-    await context.bot.send_message(chat_id=ADMIN_ID, text=text, parse_mode="HTML", reply_markup=kb)
+    await context.bot.send_message(chat_id=admin_id, text=text, parse_mode="HTML", reply_markup=kb)
 
+@_locked("user")
 async def cmd_register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if len(context.args) < 2:
@@ -589,7 +1171,7 @@ async def cmd_register(update: Update, context: ContextTypes.DEFAULT_TYPE):
             prof["stores"] = [store]
         prof["approved"] = True
         prof.pop("awaiting_approval", None)
-        _upd_from_user(u, prof); _save_staff()
+        _upd_from_user(u, prof); _save_profile(u.id)
         await refresh_chat_commands(context.bot, update.effective_chat.id, u.id)
         await update.effective_chat.send_message(
             f"Админ подтверждён сразу. Роль: <b>{html.escape(role)}</b>. Магазин: <b>{html.escape(store)}</b>.",
@@ -599,11 +1181,11 @@ async def cmd_register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     PENDING[req_id] = {"user_id": u.id, "store": store, "role": role,
                        "username": u.username or "", "name": f"{u.first_name or ''} {u.last_name or ''}".strip(),
                        "ts": datetime.utcnow().isoformat(timespec="seconds") + "Z"}
-    _save_pending()
+    _save_pending(req_id)
     # пометим, что ждём модерации → мастер роли больше не показываем
     prof = get_profile(u.id)
     prof["awaiting_approval"] = True
-    _save_staff()
+    _save_profile(u.id)
     await update.effective_chat.send_message(
         f"Заявка отправлена админу. Номер: <code>{html.escape(req_id)}</code>.\nПосле одобрения придёт уведомление.",
         parse_mode="HTML"
@@ -635,15 +1217,16 @@ async def reg_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     user_id = int(r["user_id"])
     if action == "approve":
-        prof = get_profile(user_id)
-        prof["role"] = r["role"]
-        prof["current_store"] = r["store"]
-        if r["role"] == "auditor":
-            prof["stores"] = [r["store"]]  # ← фиксируем магазин для аудитора
-        prof["approved"] = True
-        prof.pop("awaiting_approval", None)
-        _save_staff()
-        del PENDING[req_id]; _save_pending()
+        async with _user_lock(user_id):
+            prof = get_profile(user_id)
+            prof["role"] = r["role"]
+            prof["current_store"] = r["store"]
+            if r["role"] == "auditor":
+                prof["stores"] = [r["store"]]  # ← фиксируем магазин для аудитора
+            prof["approved"] = True
+            prof.pop("awaiting_approval", None)
+            _save_profile(user_id)
+        PENDING.pop(req_id, None); _save_pending(req_id)
         await q.answer("Одобрено ✅")
         try: await q.edit_message_text(q.message.text + "\n\n<b>🔔 Статус: одобрено.</b>", parse_mode="HTML")
         except Exception: pass
@@ -652,22 +1235,23 @@ async def reg_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 chat_id=user_id,
                 text=f"✅ Доступ одобрен администратором.\nРоль: <b>{html.escape(prof['role'])}</b>, магазин: <b>{html.escape(prof['current_store'])}</b>.",
                 parse_mode="HTML")
-            await refresh_chat_commands(context.bot, user_id, user_id)
-        except Exception as e: log(f"notify user approve error: {e}")
+            _menus.schedule(context.bot, user_id, user_id)
+        except Exception as e: log(f"notify user approve error: {e}", level=logging.WARNING)
         return
     if action == "reject":
-        del PENDING[req_id]; _save_pending()
-        try:
-            prof = get_profile(user_id)
-            prof.pop("awaiting_approval", None)
-            _save_staff()
-        except Exception:
-            pass
+        PENDING.pop(req_id, None); _save_pending(req_id)
+        async with _user_lock(user_id):
+            try:
+                prof = get_profile(user_id)
+                prof.pop("awaiting_approval", None)
+                _save_profile(user_id)
+            except Exception:
+                pass
         await q.answer("Отклонено ❌")
         try: await q.edit_message_text(q.message.text + "\n\n<b>🔔 Статус: отклонено.</b>", parse_mode="HTML")
         except Exception: pass
         try: await context.bot.send_message(chat_id=user_id, text="❌ Заявка отклонена администратором.")
-        except Exception as e: log(f"notify user reject error: {e}")
+        except Exception as e: log(f"notify user reject error: {e}", level=logging.WARNING)
         return
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -675,7 +1259,7 @@ async def reg_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ──────────────────────────────────────────────────────────────────────────────
 async def cmd_subs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    subs = USER_SUBS.get(uid, set())
+    subs = _subs.codes(uid)
     if subs and "*" in subs:
         await update.effective_chat.send_message("Ты подписан на <b>ВСЕ</b> магазины.", parse_mode="HTML"); return
     if not subs:
@@ -683,6 +1267,7 @@ async def cmd_subs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     rows = " ".join(sorted(subs))
     await update.effective_chat.send_message(f"Твои подписки: <b>{html.escape(rows)}</b>", parse_mode="HTML")
 
+@_locked("user")
 async def cmd_follow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     if not context.args:
@@ -696,6 +1281,7 @@ async def cmd_follow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not parts: parts.append("ничего не изменилось")
     await update.effective_chat.send_message("Подписка: " + "; ".join(parts), parse_mode="HTML")
 
+@_locked("user")
 async def cmd_unfollow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     if not context.args:
@@ -706,10 +1292,12 @@ async def cmd_unfollow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if invalid: parts.append(f"не найдены: {html.escape(' '.join(invalid))}")
     await update.effective_chat.send_message("Отписка: " + "; ".join(parts), parse_mode="HTML")
 
+@_locked("user")
 async def cmd_followall(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _subscribe_all(update.effective_user.id)
     await update.effective_chat.send_message("Готово. Теперь ты подписан на <b>ВСЕ</b> магазины.", parse_mode="HTML")
 
+@_locked("user")
 async def cmd_unfollowall(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _unsubscribe_all(update.effective_user.id)
     await update.effective_chat.send_message("Флаг «ВСЕ» снят. Точечные подписки сохранены.", parse_mode="HTML")
@@ -725,7 +1313,8 @@ async def cmd_admin_subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE
     try: target = int(context.args[0])
     except: await update.effective_chat.send_message("user_id должен быть числом."); return
     norm, invalid = _normalize_codes(context.args[1:])
-    added, ignored = _subscribe_codes(target, norm)
+    async with _user_lock(target):
+        added, ignored = _subscribe_codes(target, norm)
     parts = [f"добавлено: <b>{added}</b>"]
     if ignored: parts.append(f"уже были: {html.escape(' '.join(ignored))}")
     if invalid: parts.append(f"не найдены: {html.escape(' '.join(invalid))}")
@@ -739,7 +1328,8 @@ async def cmd_admin_unsubscribe(update: Update, context: ContextTypes.DEFAULT_TY
     try: target = int(context.args[0])
     except: await update.effective_chat.send_message("user_id должен быть числом."); return
     norm, invalid = _normalize_codes(context.args[1:])
-    removed = _unsubscribe_codes(target, norm)
+    async with _user_lock(target):
+        removed = _unsubscribe_codes(target, norm)
     parts = [f"снято: <b>{removed}</b>"]
     if invalid: parts.append(f"не найдены: {html.escape(' '.join(invalid))}")
     await update.effective_chat.send_message("Отписка пользователю: " + "; ".join(parts), parse_mode="HTML")
@@ -751,7 +1341,8 @@ async def cmd_admin_subscribeall(update: Update, context: ContextTypes.DEFAULT_T
         await update.effective_chat.send_message("Используй: <code>/subscribeall &lt;user_id&gt;</code>", parse_mode="HTML"); return
     try: target = int(context.args[0])
     except: await update.effective_chat.send_message("user_id должен быть числом."); return
-    _subscribe_all(target)
+    async with _user_lock(target):
+        _subscribe_all(target)
     await update.effective_chat.send_message(f"Пользователь {target} подписан на <b>ВСЕ</b> магазины.", parse_mode="HTML")
 
 async def cmd_admin_unsubscribeall(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -761,7 +1352,8 @@ async def cmd_admin_unsubscribeall(update: Update, context: ContextTypes.DEFAULT
         await update.effective_chat.send_message("Используй: <code>/unsubscribeall &lt;user_id&gt;</code>", parse_mode="HTML"); return
     try: target = int(context.args[0])
     except: await update.effective_chat.send_message("user_id должен быть числом."); return
-    _unsubscribe_all(target)
+    async with _user_lock(target):
+        _unsubscribe_all(target)
     await update.effective_chat.send_message(f"С пользователя {target} снят флаг «ВСЕ».", parse_mode="HTML")
 
 async def cmd_deactivate(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -771,34 +1363,32 @@ async def cmd_deactivate(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_chat.send_message("Используй: <code>/deactivate &lt;user_id&gt;</code>", parse_mode="HTML"); return
     try: target = int(context.args[0])
     except: await update.effective_chat.send_message("user_id должен быть числом."); return
-    prof = get_profile(target)
-    prof["role"] = "viewer"; prof["stores"] = []; prof["current_store"] = None; prof["inactive"] = True
-    prof.pop("approved", None); prof.pop("awaiting_approval", None)
-    _save_staff()
-    _clear_all_subs_for_user(target)
+    async with _user_lock(target):
+        prof = get_profile(target)
+        prof["role"] = "viewer"; prof["stores"] = []; prof["current_store"] = None; prof["inactive"] = True
+        prof.pop("approved", None); prof.pop("awaiting_approval", None)
+        _save_profile(target)
+        _clear_all_subs_for_user(target)
     await update.effective_chat.send_message(
         f"Пользователь {target} деактивирован: роль viewer, магазины очищены, подписки удалены.",
         parse_mode="HTML"
     )
-    await refresh_chat_commands(context.bot, target, target)
+    _menus.schedule(context.bot, target, target)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Экран ТОМ/RD (viewer/admin)
 # ──────────────────────────────────────────────────────────────────────────────
-def _is_group_fully_subscribed(uid: int, codes: list[str]) -> bool:
-    subs = USER_SUBS.get(uid, set())
-    if "*" in subs: return True
-    return all(code in subs for code in codes)
+def _is_group_fully_subscribed(uid: int, group: dict) -> bool:
+    return _subs.covers(uid, group["mask"])
 
 def _kb_tom(uid: int):
     rows = []
     for slug, g in sorted(TOM_GROUPS.items(), key=lambda kv: kv[1]["title"]):
-        title = g["title"]; codes = g["codes"]; n = len(codes)
-        on = _is_group_fully_subscribed(uid, codes)
+        title = g["title"]; n = len(g["codes"])
+        on = _is_group_fully_subscribed(uid, g)
         btn_text = f"{title} ({n}) — {'✅ Подписан' if on else 'Подписаться'}"
         rows.append([InlineKeyboardButton(btn_text, callback_data=f"tom:toggle:{slug}")])
-    subs = USER_SUBS.get(uid, set())
-    rd_on = ("*" in subs)
+    rd_on = _subs.follows_all(uid)
     rows.append([InlineKeyboardButton(f"RD — {'✅ ВСЕ' if rd_on else 'Подписаться на ВСЕ'}", callback_data="tom:rd:toggle")])
     rows.append([InlineKeyboardButton("Мои подписки", callback_data="tom:mine")])
     return InlineKeyboardMarkup(rows)
@@ -807,6 +1397,7 @@ async def cmd_tom(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     await update.effective_chat.send_message("Выбери группу:", reply_markup=_kb_tom(uid))
 
+@_locked("user")
 async def tom_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.data.startswith("tom:"): return
@@ -814,7 +1405,7 @@ async def tom_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _, action, payload = (q.data.split(":", 2) + ["", ""])[:3]
 
     if action == "mine":
-        subs = USER_SUBS.get(uid, set())
+        subs = _subs.codes(uid)
         if subs and "*" in subs:
             await q.answer("Подписан на ВСЕ")
             await _safe_edit(q, "Ты подписан на <b>ВСЕ</b> магазины.", parse_mode="HTML")
@@ -825,7 +1416,7 @@ async def tom_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if action == "rd" and payload == "toggle":
-        if "*" in USER_SUBS.get(uid, set()):
+        if _subs.follows_all(uid):
             _unsubscribe_all(uid)
             await q.answer("Снял флаг «ВСЕ»")
         else:
@@ -841,7 +1432,7 @@ async def tom_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not g:
             await q.answer("Группа не найдена", show_alert=True); return
         codes = g["codes"]
-        if _is_group_fully_subscribed(uid, codes):
+        if _is_group_fully_subscribed(uid, g):
             removed = _unsubscribe_codes(uid, codes)
             await q.answer(f"Снято: {removed}")
         else:
@@ -873,6 +1464,7 @@ async def cmd_stores(update: Update, context: ContextTypes.DEFAULT_TYPE):
         lines.append(f"{code} — {name}")
     await update.effective_chat.send_message("\n".join(lines))
 
+@_locked("user")
 async def cmd_setstore(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user; prof = get_profile(u.id)
     # блокируем аудитору смену магазина
@@ -886,7 +1478,7 @@ async def cmd_setstore(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_chat.send_message("Неизвестный код магазина. Список: /stores"); return
     if prof["stores"] and code not in prof["stores"]:
         await update.effective_chat.send_message("Этот магазин тебе не назначен. Обратись к администратору."); return
-    prof["current_store"] = code; _upd_from_user(u, prof); _save_staff()
+    prof["current_store"] = code; _upd_from_user(u, prof); _save_profile(u.id)
     await update.effective_chat.send_message(f"Ок! Текущий магазин: <b>{html.escape(code)}</b> — {html.escape(STORE_CATALOG[code])}", parse_mode="HTML")
 
 async def cmd_setrole(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -899,21 +1491,21 @@ async def cmd_setrole(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except: await update.effective_chat.send_message("user_id должен быть числом."); return
     if role not in ("auditor","viewer"):
         await update.effective_chat.send_message("Роль должна быть auditor или viewer."); return
-    prof = get_profile(target); prof["role"] = role
-    if len(context.args) >= 3:
-        store_code = context.args[2].strip().upper()
+    store_code = context.args[2].strip().upper() if len(context.args) >= 3 else None
+    async with _user_lock(target):
+        prof = get_profile(target); prof["role"] = role
         if store_code in STORE_CATALOG:
             prof["current_store"] = store_code
             if role == "auditor":
                 prof["stores"] = [store_code]  # ← фиксируем доступ аудитору к одному магазину
-        else:
-            await update.effective_chat.send_message(f"Внимание: код магазина не найден: <b>{html.escape(store_code)}</b>", parse_mode="HTML")
-    _save_staff()
+        _save_profile(target)
+    if store_code and store_code not in STORE_CATALOG:
+        await update.effective_chat.send_message(f"Внимание: код магазина не найден: <b>{html.escape(store_code)}</b>", parse_mode="HTML")
     await update.effective_chat.send_message(
         f"Роль пользователя {target} установлена: <b>{html.escape(role)}</b>"
         + (f"; магазин: <b>{html.escape(prof.get('current_store') or '—')}</b>" if len(context.args) >= 3 else ""),
         parse_mode="HTML")
-    await refresh_chat_commands(context.bot, target, target)
+    _menus.schedule(context.bot, target, target)
 
 async def cmd_viewer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = ("<b>Роль: Viewer</b>\n"
@@ -942,7 +1534,10 @@ async def cmd_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• Привязки: <code>/bindings</code>\n"
             "• Подписки юзеров: <code>/subscribe</code>/<code>/unsubscribe</code>/<code>/subscribeall</code>/<code>/unsubscribeall</code>\n"
             "• Деактивация: <code>/deactivate &lt;user_id&gt;</code>\n"
-            "• ТОМ: <code>/tom</code>, перезагрузка групп: <code>/reload_tom</code>")
+            "• ТОМ: <code>/tom</code>, перезагрузка групп: <code>/reload_tom</code>\n"
+            "• Примеры фото: <code>/reload_examples [reset]</code>\n"
+            "• Шаблоны чек-листа: <code>/reload_templates</code>\n"
+            "• Журнал изменений: <code>/audit [&lt;user_id&gt;]</code>")
     await update.effective_chat.send_message(text, parse_mode="HTML")
 
 async def cmd_bindings(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -959,10 +1554,11 @@ async def cmd_bindings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         cur = prof.get("current_store") or "—"
         cur_h = STORE_CATALOG.get(prof.get("current_store"), "—") if prof.get("current_store") else "—"
         stores_list = ", ".join(prof.get("stores") or []) or "не ограничено"
-        subs = USER_SUBS.get(uid, set()); subs_txt = "ВСЕ" if ("*" in subs) else (", ".join(sorted(subs)) or "—")
+        subs = _subs.codes(uid); subs_txt = "ВСЕ" if ("*" in subs) else (", ".join(subs) or "—")
         lines.append(f"• <code>{uid}</code> {esc(uname)} — {esc(name)}\n  Роль: <b>{esc(role)}</b>; Текущий: <b>{esc(cur)}</b> — {esc(cur_h)}\n  Магазины: {esc(stores_list)}\n  Подписки: {esc(subs_txt)}")
     await update.effective_chat.send_message("\n".join(lines), parse_mode="HTML")
 
+@_locked("user")
 async def cmd_settz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user; prof = get_profile(u.id)
     if not context.args:
@@ -972,15 +1568,52 @@ async def cmd_settz(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ZoneInfo(tz)
     except Exception:
         await update.effective_chat.send_message("Неизвестная таймзона. Пример: <code>Europe/Moscow</code>", parse_mode="HTML"); return
-    prof["tz"] = tz; _save_staff()
+    prof["tz"] = tz; _save_profile(u.id)
     await update.effective_chat.send_message(f"Часовой пояс установлен: <code>{html.escape(tz)}</code>", parse_mode="HTML")
 
+async def cmd_audit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.effective_chat.send_message("Команда только для администратора."); return
+    key = context.args[0] if context.args else None
+    events = _store.audit(limit=15, key=key)
+    if not events:
+        await update.effective_chat.send_message("Журнал пуст."); return
+    lines = ["<b>Журнал изменений:</b>"]
+    for ev in events:
+        v = ev.get("v")
+        brief = ""
+        if isinstance(v, dict):
+            brief = f" role={v.get('role')} store={v.get('current_store')}"
+        elif isinstance(v, list):
+            brief = " " + (" ".join(v) or "—")
+        lines.append(f"• #{ev['seq']} {html.escape(ev['ts'])} <code>{html.escape(ev['op'])}</code> "
+                     f"{html.escape(str(ev['k']))}{html.escape(brief)} — by <code>{html.escape(str(ev.get('by')))}</code>")
+    await update.effective_chat.send_message("\n".join(lines), parse_mode="HTML")
+
 async def cmd_reload_tom(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         await update.effective_chat.send_message("Команда только для администратора."); return
     _load_tom_groups()
     await update.effective_chat.send_message("Группы ТОМ перечитаны.")
 
+async def cmd_reload_templates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.effective_chat.send_message("Команда только для администратора."); return
+    res = await asyncio.to_thread(_load_templates)
+    text = "Шаблоны: " + ", ".join(res["current"])
+    if res["new"]: text += "\nНовые версии: " + ", ".join(res["new"])
+    if res["errors"]: text += "\nОшибки:\n" + "\n".join(res["errors"])
+    await update.effective_chat.send_message(text)
+
+async def cmd_reload_examples(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.effective_chat.send_message("Команда только для администратора."); return
+    n = _media.scan()
+    if context.args and context.args[0] == "reset":
+        _media.invalidate()  # следующие отправки загрузят все файлы заново
+    secs = "; ".join(f"{ns}: {', '.join(str(s + 1) for s in v)}" for ns, v in _media.sections().items())
+    await update.effective_chat.send_message(f"Примеры перечитаны: {n} файлов, разделы: {secs or '—'}.")
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Чек-лист: запуск/кнопки/финал + (уведомление подписчикам) и лог
 # ──────────────────────────────────────────────────────────────────────────────
@@ -990,9 +1623,10 @@ async def cmd_checklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_chat.send_message("Твоя роль — viewer. Для прохождения чек-листа нужна роль auditor."); return
     err = must_have_store(update, prof)
     if err: await update.effective_chat.send_message(err, parse_mode="HTML"); return
-    chat_id = update.effective_chat.id; st = _cl_get(chat_id); si = st["sec"]
+    chat_id = update.effective_chat.id; st = _cl_get(chat_id, prof["current_store"]); si = st["sec"]
     await update.effective_chat.send_message(_fmt_section_text(si, st), reply_markup=_kb_section(si, st), parse_mode="Markdown")
 
+@_outbound_class("notify")
 async def _notify_viewers_on_finish(context: ContextTypes.DEFAULT_TYPE, store_code: str, finished_by: int, st_obj):
     human = STORE_CATALOG.get(store_code, store_code)
     done, total = _human_sec_progress(st_obj); pct = int(round(100*done/total)) if total else 0
@@ -1002,11 +1636,126 @@ async def _notify_viewers_on_finish(context: ContextTypes.DEFAULT_TYPE, store_co
         try: await context.bot.send_message(uid, body, parse_mode="HTML")
         except Exception: pass
 
+# Лог прогонов: сегменты по дню (или по размеру), закрытые — сжаты, manifest.json с диапазонами ts и магазинами
+RUNS_ROTATE = os.getenv("RUNS_ROTATE", "daily")                        # daily | size
+RUNS_SEGMENT_MAX_MB = int(os.getenv("RUNS_SEGMENT_MAX_MB", "16") or 16)
+RUNS_COMPRESS = os.getenv("RUNS_COMPRESS", "auto")                      # auto (zstd→gzip) | zstd | gzip | none
+RUNS_RETENTION_DAYS = int(os.getenv("RUNS_RETENTION_DAYS", "365") or 0)  # 0 — хранить всё
+_runlog: RunLog = _tenants.local("runlog", lambda t: RunLog(_tfile_of(t, RUNS_DIR), rotate=RUNS_ROTATE,
+                                                            max_bytes=RUNS_SEGMENT_MAX_MB << 20, codec=RUNS_COMPRESS,
+                                                            retention_days=RUNS_RETENTION_DAYS))
+
+async def _compress_runs(compress):
+    try:
+        await asyncio.to_thread(compress)
+    except Exception as e:
+        log(f"runlog compress error: {e}", level=logging.WARNING)
+
 def _log_run(store_code: str, auditor_id: int, st_obj):
     done, total = _human_sec_progress(st_obj)
-    rec = {"ts": iso_now(), "store": store_code, "auditor": auditor_id, "done": done, "total": total}
-    _append_jsonl(RUNS_FILE, rec)
-
+    rec = {"ts": iso_now(), "store": store_code, "auditor": auditor_id, "done": done, "total": total,
+           "tpl": _cl_tpl(st_obj).key}
+    try:
+        _runlog.append(rec)
+        if _runlog.sealed:  # ротация: сжатие (до max_bytes, zstd) — в потоке, а не в цикле PTB
+            asyncio.get_running_loop().create_task(_compress_runs(_runlog.compress_sealed))
+    except Exception as e:
+        log(f"runlog append error: {e}", level=logging.WARNING)
+    LAST_RUNS[store_code] = rec["ts"]; _persist("runs.put", store_code, rec["ts"])
+
+# Фотофиксация: фото, присланное во время чек-листа, привязывается к текущему разделу. Хендлер только
+# ставит задание в spool (evidence.TransferPool) и сразу отвечает; скачивание из Telegram и загрузка
+# в хранилище — фоновые воркеры, с повторами и продолжением после рестарта. Манифест — на каждый прогон.
+EVIDENCE_STORAGE = os.getenv("EVIDENCE_STORAGE", "local")               # local | yadisk
+EVIDENCE_DIR = Path(os.getenv("EVIDENCE_DIR", str(DATA_DIR / "evidence")))  # корень для local
+YADISK_TOKEN = os.getenv("YADISK_TOKEN", "")
+EVIDENCE_WORKERS = int(os.getenv("EVIDENCE_WORKERS", "4") or 4)
+EVIDENCE_MAX_ATTEMPTS = int(os.getenv("EVIDENCE_MAX_ATTEMPTS", "8") or 8)
+# хранилище общее (папки арендаторов разведены в _run_folder), очередь и spool — у каждого свои
+_evidence_storage = make_storage(EVIDENCE_STORAGE, EVIDENCE_DIR, YADISK_TOKEN)
+_evidence: TransferPool = _tenants.local("evidence", lambda t: TransferPool(
+    _evidence_storage, _tfile_of(t, DATA_DIR / "evidence_spool"), workers=EVIDENCE_WORKERS,
+    max_attempts=EVIDENCE_MAX_ATTEMPTS, log=_component_log("evidence")))
+# chat_id -> {"run", "folder", "store", "photos": {sec: n}} — текущий прогон; после рестарта восстанавливается
+# из незакрытых манифестов spool (_cl_restore_runs), иначе следующее фото открыло бы второй прогон
+_cl_runs: dict[int, dict] = _tenants.local("cl_runs", lambda t: {})
+
+def _run_folder(store_code: str, ts: int | None = None) -> str:
+    ts = ts or int(time.time())
+    t = _tenants.current()
+    root = "/checklists" if t.is_default else f"/checklists/{t.slug}"
+    return f"{root}/{store_code}/{datetime.now(timezone.utc).strftime('%Y-%m-%d')}/{ts}/"
+
+def _cl_restore_runs() -> int:
+    """Незакрытые прогоны из spool → _cl_runs. Если у чата их несколько, текущий — последний, прежние закрываются."""
+    for man in _evidence.open_runs():
+        chat = man.get("chat")
+        if chat is None or not man.get("folder"):
+            continue
+        prev = _cl_runs.get(chat)
+        if prev is not None and prev["run"] != man["run"]:
+            _evidence.close_run(prev["run"], superseded_by=man["run"])
+        photos: dict[int, int] = {}
+        for ph in man["photos"]:
+            photos[ph["section"]] = photos.get(ph["section"], 0) + 1
+        _cl_runs[chat] = {"run": man["run"], "folder": man["folder"], "store": man.get("store"), "photos": photos}
+    return len(_cl_runs)
+
+def _cl_open_run(chat_id: int, store_code: str, auditor_id: int, tpl_key: str | None = None) -> dict:
+    prev = _cl_runs.get(chat_id)
+    if prev is not None:  # чек-лист начат заново или сменился магазин — прежний прогон больше не дополнится
+        _evidence.close_run(prev["run"], abandoned=True)
+    ts = int(time.time())
+    run = {"run": f"{store_code}-{ts}-{chat_id}", "folder": _run_folder(store_code, ts), "store": store_code, "photos": {}}
+    _cl_runs[chat_id] = run
+    _evidence.open_run(run["run"], run["folder"], store=store_code, auditor=auditor_id, chat=chat_id,
+                       template=tpl_key)
+    return run
+
+def _cl_close_run(chat_id: int, st_obj):
+    run = _cl_runs.pop(chat_id, None)
+    if run:
+        done, total = _human_sec_progress(st_obj)
+        _evidence.close_run(run["run"], done=done, total=total)
+
+@_outbound_class("notify")  # ждёт интерактив, но не отбрасывается: отброс считался бы неудачной попыткой
+async def _evidence_fetch(file_id: str) -> bytes:
+    f = await _t().app.bot.get_file(file_id)
+    return bytes(await f.download_as_bytearray())
+
+@_locked("chat")
+async def cl_photo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.effective_message; u = update.effective_user; prof = get_profile(u.id)
+    if not (prof["role"] == "auditor" or is_admin(u.id)):
+        return
+    chat_id = msg.chat_id
+    st = _cl_state.get(chat_id)
+    if st is None:
+        await msg.reply_text("Фото прикрепляются к разделу чек-листа. Открой /checklist и пришли фото в нужном разделе."); return
+    err = must_have_store(update, prof)
+    if err: await msg.reply_text(err, parse_mode="HTML"); return
+    store_code = prof["current_store"]
+    run = _cl_runs.get(chat_id)
+    if run is None or run["store"] != store_code:
+        run = _cl_open_run(chat_id, store_code, u.id, st.get("tpl"))
+    if msg.photo:
+        media, ext = msg.photo[-1], "jpg"  # самый крупный размер
+    else:
+        media = msg.document
+        ext = (media.file_name or "").rsplit(".", 1)[-1].lower() if "." in (media.file_name or "") else "jpg"
+    si = st["sec"]
+    try:
+        job = _evidence.submit(run["run"], run["folder"], media.file_id, media.file_unique_id, si, ext=ext,
+                               auditor=u.id, message_id=msg.message_id)
+    except Exception as e:
+        log(f"evidence submit error: {e}", level=logging.WARNING)
+        await msg.reply_text("Не удалось принять фото, пришли ещё раз."); return
+    if job is None:
+        await msg.reply_text("Это фото уже принято."); return
+    n = run["photos"][si] = run["photos"].get(si, 0) + 1
+    await msg.reply_text(f"📎 Фото принято: {_cl_tpl(st).sections[si].title} (в разделе: {n})")
+
+@_locked("chat")
 async def cl_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; u = q.from_user; prof = get_profile(u.id)
     if not (prof["role"] == "auditor" or is_admin(u.id)):
@@ -1014,21 +1763,25 @@ async def cl_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     err = must_have_store(update, prof)
     if err: await q.answer(err, show_alert=True); return
 
-    chat_id = q.message.chat_id; st = _cl_get(chat_id)
-    action = q.data.split(":", 1)[1]; si = st["sec"]
+    chat_id = q.message.chat_id
+    data, _, token = q.data.partition("~")
+    st = _cl_resolve(chat_id, token, prof["current_store"])
+    action = data.split(":", 1)[1]; si = st["sec"]
 
     if action == "start":
-        st["sec"] = 0; st["marks"] = {}; si = 0
+        # новый прогон — на текущей версии шаблона этого магазина
+        st["sec"] = 0; st["marks"] = {}; st["tpl"] = _cl_select(prof["current_store"]).key; si = 0; _cl_touch(st)
+        _cl_open_run(chat_id, prof["current_store"], u.id, st["tpl"])
         await q.answer(f"Поехали! Магазин: {prof.get('current_store')}")
-        await _safe_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st)); return
+        await _cl_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st)); return
 
+    tpl = _cl_tpl(st)
     if action == "photo":
-        files = EXAMPLE_PHOTOS.get(si)
-        if files:
-            try: await q.message.chat.send_photo(photo=files[0], caption=f"Пример: {CHECKLIST[si]['title']}")
-            except Exception as e: log(f"send_photo error: {e}"); await q.answer("Не удалось отправить фото", show_alert=True)
-            else: await q.answer("Пример отправлен")
-        else: await q.answer("Для этой секции пока нет примера", show_alert=True)
+        try: n = await _media.send(context.bot, chat_id, si, caption=f"Пример: {tpl.sections[si].title}", ns=tpl.id)
+        except Exception as e: log(f"send examples error: {e}", level=logging.WARNING); await q.answer("Не удалось отправить фото", show_alert=True)
+        else:
+            if n: await q.answer("Пример отправлен" if n == 1 else f"Примеров отправлено: {n}")
+            else: await q.answer("Для этой секции пока нет примера", show_alert=True)
         return
 
     if action.startswith("toggle:"):
@@ -1036,32 +1789,30 @@ async def cl_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         sec_marks = st["marks"].setdefault(si, {})
         cur = sec_marks.get(ii)
         nxt = (not cur) if cur is not None else True
-        sec_marks[ii] = nxt
+        sec_marks[ii] = nxt; _cl_touch(st)
         await q.answer("Обновлено")
-        await _safe_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st)); return
+        await _cl_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st), coalesce=True); return
 
     if action == "resetsec":
-        st["marks"][si] = {}; await q.answer("Секция сброшена")
-        await _safe_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st)); return
+        st["marks"][si] = {}; _cl_touch(st); await q.answer("Секция сброшена")
+        await _cl_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st)); return
 
     if action == "progress":
 
         await q.answer("Прогресс")
-        await _safe_edit(q, _fmt_progress_text(st) + "\n\nНажми «➡ Далее», чтобы продолжить.", reply_markup=_kb_section(si, st)); return
+        await _cl_edit(q, _fmt_progress_text(st) + "\n\nНажми «➡ Далее», чтобы продолжить.", reply_markup=_kb_section(si, st)); return
 
     if action == "prev":
         if si <= 0:
             await q.answer("Это первая секция", show_alert=True); return
-        st["sec"] -= 1; si = st["sec"]
-        await _safe_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st)); return
+        st["sec"] -= 1; si = st["sec"]; _cl_touch(st)
+        await _cl_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st)); return
 
     
     if action == "goto":
-        buttons = []
-        for i, sec in enumerate(CHECKLIST):
-            buttons.append([InlineKeyboardButton(f"{i+1}. {sec['title']}", callback_data=f"cl:goto_{i}")])
-        buttons.append([InlineKeyboardButton("↩ Назад", callback_data="cl:backtocur")])
-        await _safe_edit(q, "Выбери раздел для перехода:", reply_markup=InlineKeyboardMarkup(buttons))
+        buttons = [[InlineKeyboardButton(sec.goto_label, callback_data=_cl_cb(sec.goto_cb, st))] for sec in tpl.sections]
+        buttons.append([InlineKeyboardButton("↩ Назад", callback_data=_cl_cb("cl:backtocur", st))])
+        await _cl_edit(q, "Выбери раздел для перехода:", reply_markup=InlineKeyboardMarkup(buttons))
         return
 
     if action.startswith("goto_"):
@@ -1069,27 +1820,30 @@ async def cl_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             target = int(action.split("_")[1])
         except Exception:
             await q.answer("Ошибка номера секции", show_alert=True); return
-        if 0 <= target < len(CHECKLIST):
-            st["sec"] = target
-            await _safe_edit(q, _fmt_section_text(target, st), reply_markup=_kb_section(target, st))
+        if 0 <= target < len(tpl.sections):
+            st["sec"] = target; _cl_touch(st)
+            await _cl_edit(q, _fmt_section_text(target, st), reply_markup=_kb_section(target, st))
         return
 
     if action == "backtocur":
         si = st["sec"]
-        await _safe_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st))
+        await _cl_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st))
         return
 
     if action == "next":
-        if si >= len(CHECKLIST) - 1:
+        if si >= len(tpl.sections) - 1:
             store_code = prof.get("current_store")
             if store_code:
                 _log_run(store_code, u.id, st)
-                await _notify_viewers_on_finish(context, store_code, u.id, st)
+                # рассылка может быть долгой — не держим замок чата
+                context.application.create_task(
+                    _notify_viewers_on_finish(context, store_code, u.id, copy.deepcopy(st)), update=update)
+            _cl_close_run(chat_id, st)
             text = "🎉 Чек-лист завершён!\n\n" + _fmt_progress_text(st)
-            await _safe_edit(q, text); return
-        st["sec"] += 1; si = st["sec"]
+            await _cl_edit(q, text); return
+        st["sec"] += 1; si = st["sec"]; _cl_touch(st)
 
-    await _safe_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st))
+    await _cl_edit(q, _fmt_section_text(si, st), reply_markup=_kb_section(si, st))
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Планировщик (JobQueue) — безопасно: только если доступен
@@ -1098,83 +1852,208 @@ def _user_now_in_tz(uid: int) -> datetime:
     tz = get_profile(uid).get("tz", "Europe/Moscow")
     try: z = ZoneInfo(tz)
     except Exception: z = ZoneInfo("Europe/Moscow")
-    return datetime.now(z)
+    return _now(z)
 
-def _stores_for_user(uid: int) -> set[str]:
-    subs = USER_SUBS.get(uid, set())
-    if subs and "*" in subs:
-        return set(STORE_CATALOG.keys())
-    return set(subs or [])
+def _store_mask_for_user(uid: int) -> int:
+    """Магазины сводок пользователя маской _subs ("*" — весь справочник)."""
+    return _subs.stores(uid)
 
 def _recent_runs(days: int) -> dict[str, datetime]:
-    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    """Последний прогон по каждому магазину за days дней — из индекса LAST_RUNS, без чтения лога."""
+    cutoff = _now() - timedelta(days=days)
     last: dict[str, datetime] = {}
-    if RUNS_FILE.exists():
-        with RUNS_FILE.open("r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    r = json.loads(line)
-                    ts = datetime.fromisoformat(r["ts"]).astimezone(timezone.utc)
-                    if ts < cutoff: continue
-                    store = r["store"]
-                    if store not in last or ts > last[store]:
-                        last[store] = ts
-                except Exception:
-                    continue
+    for store, iso in LAST_RUNS.items():
+        ts = datetime.fromisoformat(iso).astimezone(timezone.utc)
+        if ts >= cutoff:
+            last[store] = ts
     return last
 
+def _scan_runs_file(days: int | None = None) -> dict[str, datetime]:
+    """Последний прогон по магазинам из лога (только сегменты, попадающие в окно)."""
+    since = _now() - timedelta(days=days) if days else None
+    return _runlog.last_by_store(since=since)
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Журнал напоминаний: (user, kind, period) → сколько раз и когда пинговали
+# ──────────────────────────────────────────────────────────────────────────────
+# repeat_h — минимальный интервал между повторами внутри периода (None = один раз за период);
+# escalate_after — после скольких пингов за период сообщить наблюдателям ТОМ магазина.
+REMINDER_POLICIES: dict[str, dict] = {
+    "viewer_weekly":   {"repeat_h": None},
+    "viewer_daily":    {"repeat_h": None},
+    "auditor_weekly":  {"repeat_h": None},
+    "auditor_overdue": {
+        "repeat_h": int(os.getenv("OVERDUE_REPEAT_H", "3") or 3),
+        "escalate_after": int(os.getenv("OVERDUE_ESCALATE_AFTER", "3") or 3),
+    },
+}
+REMINDER_DRIFT = timedelta(minutes=10)   # допуск на дрейф тиков JobQueue
+REMINDER_KEEP_DAYS = 14
+
+# "uid:kind:period" -> {"n": int, "last": iso UTC, "esc": bool}
+REMINDER_LEDGER: dict[str, dict] = _tenants.local("reminders", lambda t: {})
+
+def _period_day(local: datetime) -> str:
+    return local.date().isoformat()
+
+def _period_week(local: datetime) -> str:
+    y, w, _ = local.isocalendar()
+    return f"{y}-W{w:02d}"
+
+def _ledger_key(uid: int, kind: str, period: str) -> str:
+    return f"{uid}:{kind}:{period}"
+
+def _ledger_reload():
+    """Подтягиваем записи других воркеров/прошлого процесса (берём максимум по n)."""
+    disk = _read_json(_tfile(REMINDERS_FILE), {})
+    for key, rec in disk.items():
+        mine = REMINDER_LEDGER.get(key)
+        if not mine or rec.get("n", 0) > mine.get("n", 0) or (rec.get("esc") and not mine.get("esc")):
+            REMINDER_LEDGER[key] = rec
+
+def _ledger_flush():
+    cutoff = _now() - timedelta(days=REMINDER_KEEP_DAYS)
+    for key in [k for k, r in REMINDER_LEDGER.items() if datetime.fromisoformat(r["last"]) < cutoff]:
+        del REMINDER_LEDGER[key]
+    _write_json(_tfile(REMINDERS_FILE), dict(REMINDER_LEDGER))
+
+def _ledger_locked(fn):
+    """Задание напоминаний целиком — reload → рассылка → flush — под flock на reminders.json.lock: иначе два
+    процесса на одном DATA_DIR (воркеры, перекрытие при рестарте) оба сочтут напоминание должным и отправят.
+    Замок берётся без блокировки цикла: соседнее задание того же процесса ждёт через asyncio.sleep."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        path = _tfile(REMINDERS_FILE).with_name(REMINDERS_FILE.name + ".lock")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as fh:
+            while True:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB); break
+                except BlockingIOError:
+                    await asyncio.sleep(0.5)
+            try:
+                _ledger_reload()
+                return await fn(*args, **kwargs)
+            finally:
+                _ledger_flush()  # и после ошибки: уже отправленное не должно уйти повторно
+                fcntl.flock(fh, fcntl.LOCK_UN)
+    return wrapper
+
+def _reminder_due(uid: int, kind: str, period: str) -> bool:
+    rec = REMINDER_LEDGER.get(_ledger_key(uid, kind, period))
+    if not rec:
+        return True
+    repeat_h = REMINDER_POLICIES[kind].get("repeat_h")
+    if not repeat_h:
+        return False
+    last = datetime.fromisoformat(rec["last"])
+    return _now() - last >= timedelta(hours=repeat_h) - REMINDER_DRIFT
+
+def _reminder_sent(uid: int, kind: str, period: str) -> dict:
+    key = _ledger_key(uid, kind, period)
+    rec = REMINDER_LEDGER.setdefault(key, {"n": 0, "last": iso_now(), "esc": False})
+    rec["n"] += 1; rec["last"] = iso_now()
+    return rec
+
+def _reminder_needs_escalation(uid: int, kind: str, period: str) -> bool:
+    after = REMINDER_POLICIES[kind].get("escalate_after")
+    rec = REMINDER_LEDGER.get(_ledger_key(uid, kind, period))
+    return bool(after and rec and rec["n"] >= after and not rec.get("esc"))
+
+def _tom_viewers_for_store(code: str) -> set[int]:
+    """Подписчики ТОМ-группы, в которую входит магазин; если таких нет — все подписчики магазина."""
+    bit = _subs.index.mask((code,), add=False)
+    uids = set()
+    for g in TOM_GROUPS.values():
+        if g["mask"] & bit:
+            uids |= _subs.covering(g["mask"])
+    return uids or _recipients_for_store(code)
+
+@_outbound_class("notify")  # ждёт интерактив, но не отбрасывается: эскалация одна на период
+async def _escalate_overdue(context: ContextTypes.DEFAULT_TYPE, auditor_id: int, prof: Profile, store: str,
+                            pings: int) -> bool:
+    """False — ни одно сообщение не ушло (повторим на следующем тике)."""
+    who = ("@" + prof["username"]) if prof.get("username") else (prof.get("name") or str(auditor_id))
+    text = (f"⚠️ Магазин <b>{html.escape(store)}</b> — {html.escape(STORE_CATALOG.get(store, store))}: "
+            f"чек-лист просрочен, {html.escape(who)} не отреагировал на {pings} напоминания.")
+    targets = _tom_viewers_for_store(store) - {auditor_id}
+    sent = 0
+    for uid in targets:
+        try: await context.bot.send_message(uid, text, parse_mode="HTML"); sent += 1
+        except Exception: pass
+    return sent > 0 or not targets
+
+@_outbound_class("bulk")
+@_ledger_locked
 async def job_viewers_weekly(context: ContextTypes.DEFAULT_TYPE):
-    recent = _recent_runs(7)
-    for uid in list(USER_SUBS.keys()):
+    recent = _subs.index.mask(_recent_runs(7), add=False)
+    for uid in _subs:
         local = _user_now_in_tz(uid)
+        # окно — весь час: повтор внутри недели отсекает журнал
         if not (local.weekday() == 0 and local.hour == 10):
             continue
-        if not (0 <= local.minute <= 7):
-            continue
-        stores = _stores_for_user(uid)
+        period = _period_week(local)
+        if not _reminder_due(uid, "viewer_weekly", period): continue
+        stores = _store_mask_for_user(uid)
         if not stores: continue
-        not_done = sorted([s for s in stores if s not in recent])
+        not_done = _subs.index.decode(stores & ~recent)
         if not not_done:
             msg = "Еженедельный отчёт: по твоим подпискам всё ОК ✅ (за 7 дней есть прохождения)."
         else:
             pretty = " ".join(not_done)
             msg = f"Еженедельный отчёт: не пройдено за неделю — {pretty}"
         try: await context.bot.send_message(uid, msg)
-        except Exception: pass
+        except OutboundShed: break
+        except Exception: continue
+        _reminder_sent(uid, "viewer_weekly", period)
 
+@_outbound_class("bulk")
+@_ledger_locked
 async def job_viewers_daily(context: ContextTypes.DEFAULT_TYPE):
-    recent_today = _recent_runs(1)
-    for uid in list(USER_SUBS.keys()):
+    recent_today = _subs.index.mask(_recent_runs(1), add=False)
+    for uid in _subs:
         local = _user_now_in_tz(uid)
         if not (local.hour == 21):
             continue
-        stores = _stores_for_user(uid)
+        period = _period_day(local)
+        if not _reminder_due(uid, "viewer_daily", period): continue
+        stores = _store_mask_for_user(uid)
         if not stores: continue
-        done = sorted([s for s in stores if s in recent_today])
-        not_done = sorted([s for s in stores if s not in recent_today])
+        done = _subs.index.decode(stores & recent_today)
+        not_done = _subs.index.decode(stores & ~recent_today)
         lines = ["Дневная сводка по подпискам:"]
         lines.append("✅ Пройдено: " + ("—" if not done else " ".join(done)))
         lines.append("⏳ Не пройдено: " + ("—" if not not_done else " ".join(not_done)))
         try: await context.bot.send_message(uid, "\n".join(lines))
-        except Exception: pass
+        except OutboundShed: break
+        except Exception: continue
+        _reminder_sent(uid, "viewer_daily", period)
 
+@_outbound_class("bulk")
+@_ledger_locked
 async def job_auditors_weekly(context: ContextTypes.DEFAULT_TYPE):
     recent = _recent_runs(7)
-    for uid, prof in STAFF.items():
+    for uid, prof in list(STAFF.items()):
         if prof.get("role") != "auditor": continue
         local = _user_now_in_tz(uid)
-        if not (local.weekday() == 0 and local.hour == 10 and 0 <= local.minute <= 5):
+        if not (local.weekday() == 0 and local.hour == 10):
             continue
+        period = _period_week(local)
+        if not _reminder_due(uid, "auditor_weekly", period): continue
         store = prof.get("current_store")
         if not store: continue
         if store in recent:
             continue
         try: await context.bot.send_message(uid, "Напоминание: пройди чек-лист по текущему магазину. (/checklist)")
-        except Exception: pass
+        except OutboundShed: break
+        except Exception: continue
+        _reminder_sent(uid, "auditor_weekly", period)
 
+@_outbound_class("bulk")
+@_ledger_locked
 async def job_auditors_hourly_overdue(context: ContextTypes.DEFAULT_TYPE):
     recent = _recent_runs(7)
-    for uid, prof in STAFF.items():
+    for uid, prof in list(STAFF.items()):
         if prof.get("role") != "auditor": continue
         local = _user_now_in_tz(uid)
         if 22 <= local.hour or local.hour < 8:
@@ -1183,12 +2062,31 @@ async def job_auditors_hourly_overdue(context: ContextTypes.DEFAULT_TYPE):
         if not store: continue
         if store in recent:
             continue
+        period = _period_day(local)
+        if _reminder_needs_escalation(uid, "auditor_overdue", period):
+            # эскалация не ушла на прошлом тике — повторяем, не дожидаясь следующего пинга
+            rec = REMINDER_LEDGER[_ledger_key(uid, "auditor_overdue", period)]
+            rec["esc"] = await _escalate_overdue(context, uid, prof, store, rec["n"])
+        if not _reminder_due(uid, "auditor_overdue", period): continue
         try: await context.bot.send_message(uid, "⏰ Чек-лист просрочен. Пожалуйста, пройди его. (/checklist)")
-        except Exception: pass
+        except OutboundShed: break
+        except Exception: continue
+        rec = _reminder_sent(uid, "auditor_overdue", period)
+        if _reminder_needs_escalation(uid, "auditor_overdue", period):
+            rec["esc"] = await _escalate_overdue(context, uid, prof, store, rec["n"])
+
+# (job, first, interval) в секундах — расписание JobQueue; по нему же идёт tools/simulate_reminders.py
+REMINDER_JOBS = (
+    (job_viewers_weekly, 60, 3600),
+    (job_viewers_daily, 120, 3600),
+    (job_auditors_weekly, 180, 3600),
+    (job_auditors_hourly_overdue, 240, 3600),
+)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Хэндлеры и PTB init
 # ──────────────────────────────────────────────────────────────────────────────
+@_locked("user")
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user; prof = get_profile(u.id); _upd_from_user(u, prof)
     await refresh_chat_commands(context.bot, update.effective_chat.id, u.id)
@@ -1210,7 +2108,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         code = payload[1].strip().upper()
         if code in STORE_CATALOG and (is_admin(u.id) or prof.get("role") != "auditor"):
             # аудитору deep-link смену магазина не даём
-            prof["current_store"] = code; _save_staff()
+            prof["current_store"] = code; _save_profile(u.id)
 
     kb = [[InlineKeyboardButton("Проверка", callback_data="ping"),
            InlineKeyboardButton("Чек-лист", callback_data="cl:start")]]
@@ -1225,6 +2123,29 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown"
     )
 
+async def _bind_actor(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """group=-1: запоминаем автора апдейта для журнала изменений и поля корреляции логов."""
+    uid = update.effective_user.id if update.effective_user else None
+    _actor.set(uid)
+    t = _t()
+    logsetup.bind(fresh=True, update_id=update.update_id, user_id=uid,
+                  chat_id=update.effective_chat.id if update.effective_chat else None,
+                  tenant=None if t.is_default else t.slug)
+
+def _traced(fn):
+    """Хендлер с полем handler в логах и (прореживаемым) событием update с длительностью."""
+    name = getattr(fn, "__name__", type(fn).__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        token = logsetup.bind(handler=name); t0 = time.perf_counter()
+        try:
+            return await fn(update, context)
+        finally:
+            log("handled", component="updates", event="update", ms=round((time.perf_counter() - t0) * 1000, 1))
+            logsetup.reset(token)
+    return wrapper
+
 async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.data: return
@@ -1262,8 +2183,8 @@ async def cmd_dbg_start_run(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     store_code = args[0].strip().upper()
-    # Заглушка папки на Я.Диске — позже заменим на реальную интеграцию
-    folder = f"/checklists/{store_code}/{datetime.now(timezone.utc).strftime('%Y-%m-%d')}/{int(datetime.now().timestamp())}/"
+    # Папка прогона — та же схема, что у фотофиксации (evidence)
+    folder = _run_folder(store_code)
 
     try:
         run_id = start_run(store_code, user.id, folder)
@@ -1298,8 +2219,20 @@ async def cmd_dbg_finish_run(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         await msg.reply_text(f"❌ Ошибка: {e}")
 
-def build_application() -> Application:
-    app_ = Application.builder().token(BOT_TOKEN).build()
+def build_application(token: str = BOT_TOKEN, requests: tuple[HTTPXRequest, HTTPXRequest] | None = None,
+                      job_queue: bool = True) -> Application:
+    send, updates = requests or (_tg_request("send"), _tg_request("updates"))
+    builder = (
+        Application.builder().token(token)
+        .base_url(f"{TG_API_BASE}/bot").base_file_url(f"{TG_API_BASE}/file/bot")
+        .request(send)
+        .get_updates_request(updates)
+        .concurrent_updates(PTB_CONCURRENCY if PTB_CONCURRENCY > 1 else False)
+    )
+    if not job_queue:
+        builder = builder.job_queue(None)  # задания арендаторов крутит JobQueue основного бота
+    app_ = builder.build()
+    app_.add_handler(TypeHandler(Update, _bind_actor), group=-1)
     # команды
     app_.add_handler(CommandHandler("start", cmd_start))
     app_.add_handler(CommandHandler("register", cmd_register))
@@ -1327,6 +2260,9 @@ def build_application() -> Application:
     # ТОМ / RD / TZ
     app_.add_handler(CommandHandler("tom", cmd_tom))
     app_.add_handler(CommandHandler("reload_tom", cmd_reload_tom))
+    app_.add_handler(CommandHandler("reload_examples", cmd_reload_examples))
+    app_.add_handler(CommandHandler("reload_templates", cmd_reload_templates))
+    app_.add_handler(CommandHandler("audit", cmd_audit))
     app_.add_handler(CommandHandler("settz", cmd_settz))
     # callbacks
     app_.add_handler(CallbackQueryHandler(role_pick_callback, pattern=r"^role:"))
@@ -1334,48 +2270,366 @@ def build_application() -> Application:
     app_.add_handler(CallbackQueryHandler(cl_callback, pattern=r"^cl:"))
     app_.add_handler(CallbackQueryHandler(tom_callbacks, pattern=r"^tom:"))
     app_.add_handler(CallbackQueryHandler(on_button, block=False))
+    # фото к разделу чек-листа
+    app_.add_handler(MessageHandler(filters.PHOTO | filters.Document.IMAGE, cl_photo_message))
+    for group, handlers in app_.handlers.items():
+        if group >= 0:  # group=-1 (_bind_actor) сам выставляет контекст апдейта
+            for h in handlers:
+                h.callback = _traced(h.callback)
     return app_
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Холодный старт: загрузка состояния, замеры фаз, буфер ранних апдейтов
+# ──────────────────────────────────────────────────────────────────────────────
+# Кэш личности бота: даёт BOT_USERNAME (ссылки, /diag) до готовности PTB, но сетевой get_me не экономит —
+# Bot.initialize() вызывает его всегда, заодно проверяя токен; этот запрос идёт параллельно с чтением состояния.
+BOT_ME_FILE = DATA_DIR / "bot_me.json"
+BOT_USERNAME = (_read_json(BOT_ME_FILE, {}) or {}).get("username")  # из кэша прошлого запуска, до get_me
+EARLY_UPDATES_MAX = int(os.getenv("EARLY_UPDATES_MAX", "500") or 500)
+EARLY_UPDATES_TTL = float(os.getenv("EARLY_UPDATES_TTL", "120") or 120)   # сек; старше — выбрасываем
+PTB_EAGER_START = os.getenv("PTB_EAGER_START", "1") == "1"
+
+STARTUP_PHASES: dict[str, float] = {}   # фаза -> мс
+_early_updates: deque = deque()         # (monotonic, json) до готовности PTB
+_early_lock = threading.Lock()
+_early_dropped = 0
+
+class _phase:
+    """with _phase("name"): … — пишет длительность в STARTUP_PHASES."""
+    def __init__(self, name: str): self.name = name
+    def __enter__(self): self.t0 = time.monotonic(); return self
+    def __exit__(self, *exc):
+        STARTUP_PHASES[self.name] = round((time.monotonic() - self.t0) * 1000, 1)
+
+_state_loaded: set[str] = set()   # арендаторы, чьё состояние уже в памяти
+
+def _tphase(name: str) -> str:
+    t = _t()
+    return name if t.is_default else f"{name}:{t.slug}"
+
+def _load_state():
+    t = _t()
+    if t.slug in _state_loaded:  # повторная сборка Application не должна перечитывать диск поверх памяти
+        return
+    _store.acquire(wait=STATE_LOCK_WAIT_S)  # один писатель на DATA_DIR; при рестарте ждём уходящий воркер
+    _state_loaded.add(t.slug)
+    state = _store.load(legacy=_legacy_state)
+    # из бинарного снапшота профили приходят уже Profile; из JSON/хвоста журнала — dict
+    STAFF.update({uid: p if type(p) is Profile else Profile.from_dict(p) for uid, p in state["staff"].items()})
+    PENDING.update(state["pending"])
+    _subs.load(state["subs"])
+    LAST_RUNS.update(state["runs"])
+    if _tfile(RUNS_FILE).exists():
+        n = _runlog.import_legacy(_tfile(RUNS_FILE))
+        log(f"runlog: check_runs.jsonl → {_tfile(RUNS_DIR)} ({n} записей)")
+    if not LAST_RUNS:
+        # индекс появился позже лога — строим один раз по истории
+        LAST_RUNS.update({s: ts.isoformat(timespec="seconds") for s, ts in _scan_runs_file().items()})
+    _load_tom_groups()
+    if t.is_default:
+        _load_templates()  # шаблоны общие для всех арендаторов
+    REMINDER_LEDGER.update(_read_json(_tfile(REMINDERS_FILE), {}))
+    _menus.load()
+
+def _timed_state_load():
+    with _phase(_tphase("state")):
+        _load_state()
+
+async def _timed_initialize():
+    with _phase(_tphase("initialize")):
+        await _t().app.initialize()
+
+def _buffer_early_update(data, t: Tenant) -> bool:
+    """Кладёт апдейт в буфер, пока PTB прогревается. False — буфер полон или PTB уже готов."""
+    global _early_dropped
+    with _early_lock:
+        if _ptb_ready:
+            return False
+        if len(_early_updates) >= EARLY_UPDATES_MAX:
+            _early_dropped += 1
+            return False
+        _early_updates.append((time.monotonic(), t.slug, data))
+        return True
+
+async def _replay_early_updates() -> int:
+    """Проигрывает буфер по порядку; готовность выставляется под тем же замком, когда он пуст."""
+    global _ptb_ready, _early_dropped
+    n = 0
+    while True:
+        with _early_lock:
+            if not _early_updates:
+                _ptb_ready = True
+                return n
+            batch = list(_early_updates); _early_updates.clear()
+        for ts, slug, data in batch:
+            t = _tenants.get(slug)
+            if time.monotonic() - ts > EARLY_UPDATES_TTL or t is None or t.app is None:
+                _early_dropped += 1; continue
+            try:
+                await _process_update(t, Update.de_json(data, t.app.bot)); n += 1
+            except Exception as e:
+                log(f"early update replay error: {e}", level=logging.WARNING)
+
+async def _process_update(t: Tenant, upd: Update):
+    """process_update от имени арендатора: его состояние видно хендлерам и всем задачам, созданным из них."""
+    token = _tenants.use(t)
+    try:
+        await t.app.process_update(upd)
+    finally:
+        _tenants.reset(token)
+
+def _tenant_job(t: Tenant, fn):
+    """Задание общего JobQueue от имени арендатора: его состояние и его bot в context."""
+    if t.is_default:
+        return fn
+
+    @functools.wraps(fn)
+    async def job(context: ContextTypes.DEFAULT_TYPE):
+        with _tenants.scoped(t):
+            await fn(CallbackContext.from_job(context.job, t.app))
+    return job
+
+async def _init_tenant(t: Tenant, requests: tuple[HTTPXRequest, HTTPXRequest]):
+    _tenants.use(t)  # своя задача (gather) — арендатор не утекает к соседям
+    with _phase(_tphase("build")):
+        t.app = build_application(t.token, requests, job_queue=t.is_default)
+    # initialize() ходит в сеть (get_me), а чтение JSON — в диск: делаем параллельно
+    await asyncio.gather(asyncio.to_thread(_timed_state_load), _timed_initialize())
+    t.username = t.app.bot.username  # get_me уже выполнен внутри initialize()
+    _write_json(_tfile(BOT_ME_FILE), t.app.bot.bot.to_dict())
+    t.app.create_task(_menus.reconcile_all(t.app.bot))
+    resumed = _evidence.start(_evidence_fetch)
+    if resumed:
+        log(f"evidence: продолжаем {resumed} незавершённых передач")
+    if not _cl_runs and _cl_restore_runs():
+        log(f"evidence: восстановлено {len(_cl_runs)} незакрытых прогонов")
+
 # PTB init + jobs (безопасно)
 async def _ptb_init_async():
-    global _app, _ptb_ready, BOT_USERNAME
-    log("PTB: build application…")
-    _app = build_application()
-    log("PTB: application.initialize()…")
-    await _app.initialize()
-    me = await _app.bot.get_me(); BOT_USERNAME = me.username
+    global _app, BOT_USERNAME
+    t0 = time.monotonic()
+    log(f"PTB: build + application.initialize() + загрузка состояния ({len(_tenants)} ботов)…")
+    requests = (_tg_request("send"), _tg_request("updates"))  # один HTTP-пул Bot API на всех арендаторов
+    results = await asyncio.gather(*(_init_tenant(t, requests) for t in _tenants), return_exceptions=True)
+    for t, res in zip(_tenants, results):
+        if isinstance(res, BaseException):
+            if t.is_default:
+                raise res
+            t.app = None  # вебхук арендатора отвечает 503, остальные работают
+            log(f"tenant {t.slug}: init failed: {res!r}", level=logging.ERROR)
+    _app = _tenants.default.app
+    BOT_USERNAME = _app.bot.username
 
     # Попробуем включить JobQueue, если доступен
     jq = getattr(_app, "job_queue", None)
     if jq is None:
         log("PTB: JobQueue недоступен — планировщик уведомлений отключён (это ок).")
     else:
-        # Раз в час проверяем и отправляем при подходящих локальных условиях
-        jq.run_repeating(job_viewers_weekly, interval=3600, first=60)
-        jq.run_repeating(job_viewers_daily, interval=3600, first=120)
-        jq.run_repeating(job_auditors_weekly, interval=3600, first=180)
-        jq.run_repeating(job_auditors_hourly_overdue, interval=3600, first=240)
-        log("PTB: JobQueue — задания зарегистрированы.")
-
-    _ptb_ready = True
-    log(f"PTB: READY as @{BOT_USERNAME}")
-
-def _ptb_thread_main():
-    global _loop, _loop_alive
-    _loop = asyncio.new_event_loop(); asyncio.set_event_loop(_loop)
-    _loop_alive = True; log("PTB thread: loop created, initializing…")
+        # Раз в час проверяем и отправляем при подходящих локальных условиях (за каждого арендатора)
+        t_jobs = time.monotonic()
+        for t in _tenants:
+            if t.app is None:
+                continue
+            for fn, first, interval in REMINDER_JOBS:
+                jq.run_repeating(_tenant_job(t, fn), interval=interval, first=first, name=f"{fn.__name__}@{t.slug}")
+        # Application.start() мы не вызываем (апдейты идут через свой вебхук) — планировщик запускаем сами
+        await jq.start()
+        STARTUP_PHASES["jobs"] = round((time.monotonic() - t_jobs) * 1000, 1)
+        log("PTB: JobQueue — задания зарегистрированы и запущены.")
+
+    with _phase("replay"):
+        replayed = await _replay_early_updates()
+    STARTUP_PHASES["ready_since_thread"] = round((time.monotonic() - t0) * 1000, 1)
+    STARTUP_PHASES["ready_since_import"] = round((time.monotonic() - _T_IMPORT) * 1000, 1)
+    log(f"PTB: READY as @{BOT_USERNAME} (буфер: {replayed} апдейтов, фазы: {STARTUP_PHASES})")
+
+def _ptb_thread_main(gen: int):
+    global _loop, _loop_alive, _ptb_ready
+    loop = asyncio.new_event_loop(); asyncio.set_event_loop(loop)
+    _loop = loop; _loop_alive = True
+    _watchdog.attach(loop, threading.current_thread())
+    log(f"PTB thread: loop created (gen {gen}), initializing…")
+    apps = []
     try:
-        _loop.run_until_complete(_ptb_init_async()); _loop.run_forever()
+        loop.run_until_complete(_ptb_init_async())
+        apps = [t.app for t in _tenants if t.app is not None]; loop.run_forever()
     except Exception as e:
-        log(f"PTB thread ERROR: {e}")
+        log(f"PTB thread ERROR: {e}", level=logging.ERROR, exc_info=True)
     finally:
-        _loop_alive = False; log("PTB thread: exit")
+        if gen == _ptb_gen:
+            with _early_lock:
+                _ptb_ready = False
+            _loop_alive = False; log("PTB thread: exit")
+        else:
+            # цикл пересобран, а старый всё-таки ожил: гасим его Application и задачи, поток завершается
+            _retire_loop(loop, apps, gen)
 
 def ensure_ptb_started():
     global _ptb_thread
-    if _ptb_thread and _ptb_thread.is_alive(): return
-    _ptb_thread = threading.Thread(target=_ptb_thread_main, name="ptb-thread", daemon=True)
-    _ptb_thread.start(); log("PTB thread: started")
+    with _ptb_start_lock:
+        if _ptb_thread and _ptb_thread.is_alive(): return
+        _ptb_thread = threading.Thread(target=_ptb_thread_main, args=(_ptb_gen,), name=f"ptb-thread-{_ptb_gen}",
+                                       daemon=True)
+        _ptb_thread.start(); _watchdog.start(); log("PTB thread: started")
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Сторож цикла PTB: задержка, 503 при перегрузе, пересборка «заклинившего» цикла
+# ──────────────────────────────────────────────────────────────────────────────
+# Поток-сторож меряет, через сколько цикл выполняет пробу (loopwatch). Если задержка выше LOOP_LAG_503_MS,
+# вебхук отвечает 503 — Telegram повторит апдейт позже, вместо того чтобы он тонул в очереди цикла.
+# Если проба не вернулась за LOOP_WEDGED_S (цикл заблокирован синхронным вызовом), в лог уходит стек
+# потока PTB, а Application собирается заново в новом потоке и цикле; апдейты на это время буферизуются
+# как при прогреве. Не больше LOOP_RESTART_MAX пересборок в час — дальше нужен рестарт процесса.
+LOOP_LAG_503_MS = float(os.getenv("LOOP_LAG_503_MS", "2000") or 2000)
+LOOP_WEDGED_S = float(os.getenv("LOOP_WEDGED_S", "30") or 30)
+LOOP_RESTART_MAX = int(os.getenv("LOOP_RESTART_MAX", "3") or 3)
+
+_ptb_gen = 0
+_ptb_start_lock = threading.RLock()
+_ptb_restarts: deque[float] = deque()
+
+def _reset_loop_bound_state():
+    """Замки, таймеры и задачи asyncio старого цикла в новом не работают — начинаем с чистых."""
+    _locks.clear()
+    for t in _tenants:
+        _edits.of(t).reset()
+        _menus.of(t)._drainer = None
+        _media.of(t).reset_locks()
+
+def _restart_ptb(reason: str) -> bool:
+    global _ptb_gen, _ptb_ready, _loop_alive, _ptb_thread
+    with _ptb_start_lock:
+        now = time.monotonic()
+        while _ptb_restarts and now - _ptb_restarts[0] > 3600:
+            _ptb_restarts.popleft()
+        if len(_ptb_restarts) >= LOOP_RESTART_MAX:
+            log(f"PTB: пересборка не выполнена ({reason}) — лимит {LOOP_RESTART_MAX}/ч исчерпан, нужен рестарт процесса",
+                level=logging.ERROR, event="ptb_restart_limit")
+            return False
+        _ptb_restarts.append(now)
+        old = _loop
+        _ptb_gen += 1  # старый поток, если очнётся, увидит чужое поколение и не тронет общие флаги
+        with _early_lock:
+            _ptb_ready = False
+        _loop_alive = False
+        if old is not None and not old.is_closed():
+            try:
+                old.call_soon_threadsafe(old.stop)
+            except RuntimeError:
+                pass
+        _reset_loop_bound_state()
+        log(f"PTB: пересборка Application (gen {_ptb_gen}): {reason}", level=logging.ERROR, event="ptb_restart")
+        _ptb_thread = None
+        ensure_ptb_started()
+        return True
+
+def _retire_loop(loop: asyncio.AbstractEventLoop, apps: list[Application], gen: int):
+    try:
+        tasks = [t for t in asyncio.all_tasks(loop) if not t.done()]
+        for t in tasks:
+            t.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        for app_ in apps:
+            jq = app_.job_queue
+            if jq is not None and jq.scheduler.running:  # иначе задания старого поколения дублировали бы новые
+                loop.run_until_complete(jq.stop(wait=False))
+            loop.run_until_complete(asyncio.wait_for(app_.shutdown(), 10))
+    except Exception as e:
+        log(f"PTB: old loop (gen {gen}) shutdown: {e}", level=logging.WARNING)
+    finally:
+        loop.close(); log(f"PTB thread: old loop (gen {gen}) released")
+
+_watchdog = LoopWatchdog(wedged_s=LOOP_WEDGED_S, on_wedged=lambda: _restart_ptb("event loop wedged"),
+                         log=functools.partial(log, component="loopwatch", level=logging.ERROR))
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Остановка: приём → дренаж апдейтов → сброс очередей → закрытие клиентов
+# ──────────────────────────────────────────────────────────────────────────────
+# Под gunicorn останов приходит через хук worker_exit (gunicorn.conf.py) — SIGTERM воркера gunicorn
+# обрабатывает сам; без gunicorn ставим свой обработчик SIGTERM. atexit — страховка. Порядок:
+#   1) вебхук отвечает 503 (Telegram повторит апдейт на новом воркере), сторож больше не пересобирает цикл;
+#   2) ждём уже принятые апдейты (SHUTDOWN_DRAIN_S на всё);
+#   3) в цикле: отложенные правки, очередь меню, фото (задания остаются в spool), JobQueue, задачи
+#      create_task (рассылки), затем Application.shutdown() — закрывает HTTP-клиенты Bot API;
+#   4) журнал состояния, ledger напоминаний, пул БД, синхронный клиент, и последним — логи.
+SHUTDOWN_DRAIN_S = float(os.getenv("SHUTDOWN_DRAIN_S", "20") or 20)
+
+_shutting_down = False
+_shutdown_lock = threading.Lock()
+_inflight: set[concurrent.futures.Future] = set()   # process_update, принятые вебхуком
+
+def _track_inflight(fut: concurrent.futures.Future):
+    _inflight.add(fut); fut.add_done_callback(_inflight.discard)
+
+async def _drain_loop(deadline: float):
+    left = lambda: max(0.1, deadline - time.monotonic())
+    apps = [t for t in _tenants if t.app is not None]
+    for t in apps:
+        with _tenants.scoped(t):
+            await _edits.flush_all(t.app.bot)
+            await _menus.flush(t.app.bot)
+            await _evidence.stop()
+    jq = getattr(_app, "job_queue", None)
+    if jq is not None and jq.scheduler.running:
+        try:
+            await asyncio.wait_for(jq.stop(wait=True), left())
+        except asyncio.TimeoutError:
+            log("shutdown: JobQueue jobs still running at deadline", level=logging.WARNING)
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task() and not t.done()]
+    if tasks:
+        done, rest = await asyncio.wait(tasks, timeout=left())
+        for t in rest:
+            t.cancel()
+        if rest:
+            log(f"shutdown: cancelled {len(rest)} unfinished tasks", level=logging.WARNING)
+            await asyncio.gather(*rest, return_exceptions=True)
+    for t in apps:
+        await t.app.shutdown()
+
+def shutdown(reason: str = "exit"):
+    """Идемпотентно; вызывается из хука gunicorn, по SIGTERM или при выходе интерпретатора."""
+    global _shutting_down
+    with _shutdown_lock:
+        if _shutting_down:
+            return
+        _shutting_down = True
+    t0 = time.monotonic(); deadline = t0 + SHUTDOWN_DRAIN_S
+    logsetup.bind(fresh=True)  # хук может прийти из потока, обслуживавшего апдейт
+    _watchdog.stop()
+    log(f"shutdown ({reason}): drain {len(_inflight)} in-flight updates, {len(_early_updates)} buffered")
+    pending = set(_inflight)
+    if pending:
+        _, rest = concurrent.futures.wait(pending, timeout=SHUTDOWN_DRAIN_S)
+        if rest:
+            log(f"shutdown: {len(rest)} updates still running at deadline", level=logging.WARNING)
+    loop = _loop
+    if _app is not None and loop is not None and loop.is_running() and _ptb_ready:
+        try:
+            asyncio.run_coroutine_threadsafe(_drain_loop(deadline), loop).result(timeout=max(1.0, deadline - time.monotonic()) + 5)
+        except Exception as e:
+            log(f"shutdown: loop drain failed: {e!r}", level=logging.ERROR)
+        loop.call_soon_threadsafe(loop.stop)
+    for t in _tenants:
+        with _tenants.scoped(t):
+            if REMINDER_LEDGER:
+                _ledger_reload(); _ledger_flush()
+            store = _store.of(t, create=False)
+            if store is not None:
+                store.close()
+    if not pool.closed:
+        pool.close(timeout=5)
+    if _tg_sync_client is not None:
+        _tg_sync_client.close()
+    log(f"shutdown ({reason}): done in {(time.monotonic() - t0) * 1000:.0f} ms")
+    logsetup.shutdown()
+
+def _on_sigterm(signum, frame):
+    shutdown("SIGTERM")
+    raise SystemExit(0)
+
+atexit.register(shutdown)  # после logsetup.setup — значит, выполнится раньше остановки логов
+if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) in (signal.SIG_DFL, None):
+    signal.signal(signal.SIGTERM, _on_sigterm)  # под gunicorn обработчик уже его, там — worker_exit
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Flask
@@ -1389,91 +2643,91 @@ def loop_state():
         "is_running": bool(_loop and _loop.is_running()),
         "loop_alive": _loop_alive,
         "ptb_ready": _ptb_ready,
+        "generation": _ptb_gen,
+        "lag": _watchdog.stats(),
+        "lag_503_ms": LOOP_LAG_503_MS,
+        "accepting": _ptb_ready and _watchdog.lag() * 1000 < LOOP_LAG_503_MS,
     }
     return app.response_class(json.dumps(info), mimetype="application/json")
 
 @app.route("/diag")
 def diag():
-    total = sum(len(s["items"]) for s in CHECKLIST)
+    default_tpl = _templates.for_store(None)
     info = {
         "loop_alive": _loop_alive,
         "loop_is_running": bool(_loop and _loop.is_running()),
         "ptb_ready": _ptb_ready,
         "has_application": _app is not None,
+        "loop": {"generation": _ptb_gen, "restarts_last_hour": len(_ptb_restarts), "lag_503_ms": LOOP_LAG_503_MS,
+                 "wedged_s": LOOP_WEDGED_S, **_watchdog.stats()},
+        "bot_username": BOT_USERNAME,
+        "startup_phases_ms": STARTUP_PHASES,
+        "early_buffer": {"queued": len(_early_updates), "dropped": _early_dropped, "max": EARLY_UPDATES_MAX},
+        "intake": {"json": _json_loads.__module__, "allowed_updates": ALLOWED_UPDATES, "skipped": _intake_skipped},
         "now": datetime.utcnow().isoformat(timespec="seconds") + "Z",
-        "checklist_total_items": total,
-        "sections": len(CHECKLIST),
+        "checklist_total_items": default_tpl.total,
+        "sections": len(default_tpl.sections),
+        "templates": _templates.stats(),
+        "cl_stateless": CL_STATELESS,
+        "ptb_concurrency": PTB_CONCURRENCY,
         "stores": len(STORE_CATALOG),
         "staff_records": len(STAFF),
         "pending_requests": len(PENDING),
-        "staff_file": str(STAFF_FILE.resolve()),
-        "pending_file": str(PENDING_FILE.resolve()),
-        "subs_file": str(SUBS_FILE.resolve()),
-        "tom_file": str(TOM_FILE.resolve()),
-        "runs_file": str(RUNS_FILE.resolve()),
-        "user_subs_count": len(USER_SUBS),
+        "events_file": str(_store.events_path.resolve()),
+        "snapshot_file": str(_store.snapshot_path.resolve()),
+        "state_seq": _store.seq,
+        "last_runs_indexed": len(LAST_RUNS),
+        "events_since_snapshot": _store.since_snapshot,
+        "tom_file": str(_tfile(TOM_FILE).resolve()),
+        "runs_log": _runlog.stats(),
+        "tg_http": {"pool": TG_POOL_SIZE, "http2": _tg_http2_enabled(), "api": TG_API_BASE},
+        "outbound": _outbound.stats(),
+        "logging": logsetup.stats(),
+        "media": {"sections": {ns: [s + 1 for s in v] for ns, v in _media.sections().items()}, "cached": len(_media.cache),
+                  "dead_seeds": len(_media.dead), **_media.stats},
+        "evidence": {"storage": _evidence.storage.name, "pending": _evidence.pending(), **_evidence.stats},
+        "reminder_ledger": len(REMINDER_LEDGER),
+        "menus_synced": len(_menus.applied),
+        "user_subs_count": len(_subs),
+        "subs": _subs.stats(),
         "tom_groups": {k: len(v["codes"]) for k,v in TOM_GROUPS.items()},
+        "tenants": [{"slug": t.slug, "path": t.webhook_path, "username": t.username, "ready": t.app is not None,
+                     "data_dir": str(t.data_dir), "staff_records": len(STAFF.of(t)), "pending_requests": len(PENDING.of(t))}
+                    for t in _tenants],
     }
     return app.response_class(json.dumps(info, ensure_ascii=False, indent=2), mimetype="application/json")
 
 @app.route("/getwebhookinfo_raw")
 def getwebhookinfo_raw():
     try:
-        r = httpx.get(f"https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo", timeout=10)
+        r = tg_api_get("getWebhookInfo")
         return app.response_class(r.text, mimetype="application/json", status=r.status_code)
     except Exception as e:
         return f"error: {e}", 500
 
 @app.route("/set-webhook")
 def set_webhook():
-    target = BASE_URL.rstrip("/") + "/"
+    targets = []
     try:
-        r = httpx.get(f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook", params={"url": target}, timeout=15)
-        log(f"setWebhook → {r.status_code} {r.text[:200]}")
-        return f"Webhook set to {target}", 200
+        for t in _tenants:  # у каждого бота свой путь: "/" — основной, "/t/<slug>" — арендаторы
+            target = BASE_URL.rstrip("/") + t.webhook_path
+            r = tg_api_get("setWebhook", {"url": target, "allowed_updates": json.dumps(ALLOWED_UPDATES)},
+                           token=t.token)
+            log(f"setWebhook[{t.slug}] → {r.status_code} {r.text[:200]}")
+            targets.append(target)
+        return "Webhook set to " + ", ".join(targets), 200
     except Exception as e:
-        log(f"setWebhook ERROR: {e}")
+        log(f"setWebhook ERROR: {e}", level=logging.ERROR, exc_info=True)
         return f"error: {e}", 500
 
 
 # ── DB schema & health endpoints ──────────────────────────────────────────────
-SCHEMA_SQL = """
-CREATE TABLE IF NOT EXISTS stores (
-  code TEXT PRIMARY KEY,
-  name TEXT NOT NULL
-);
-
-CREATE TABLE IF NOT EXISTS users (
-  user_id BIGINT PRIMARY KEY,
-  role TEXT NOT NULL CHECK (role IN ('admin','auditor','viewer')),
-  default_store TEXT,
-  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
-);
-
-CREATE TABLE IF NOT EXISTS subscriptions (
-  user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
-  store_code TEXT NOT NULL REFERENCES stores(code) ON DELETE CASCADE,
-  PRIMARY KEY (user_id, store_code)
-);
-
-CREATE TABLE IF NOT EXISTS checklist_runs (
-  id BIGSERIAL PRIMARY KEY,
-  store_code TEXT NOT NULL REFERENCES stores(code) ON DELETE CASCADE,
-  auditor_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE SET NULL,
-  status TEXT NOT NULL DEFAULT 'in_progress' CHECK (status IN ('in_progress','finished','cancelled')),
-  started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-  finished_at TIMESTAMPTZ
-);
-
-CREATE TABLE IF NOT EXISTS checklist_items (
-  run_id BIGINT NOT NULL REFERENCES checklist_runs(id) ON DELETE CASCADE,
-  section INT NOT NULL,
-  item_key TEXT NOT NULL,
-  state TEXT NOT NULL CHECK (state IN ('✅','❌','⬜️')),
-  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-  PRIMARY KEY (run_id, section, item_key)
-);
-"""
+# Схема — версионированные миграции в dbschema.py (schema_migrations); здесь только применение
+def db_schema_up() -> list[int]:
+    with db_pool().connection() as conn:
+        done = dbschema.migrate(conn, log=_component_log("db"))
+        dbschema.ensure_item_partitions(conn)
+    return done
 
 @app.get("/db-ping")
 def db_ping():
@@ -1486,29 +2740,184 @@ def db_ping():
 @app.get("/db-init")
 def db_init():
     try:
-        exec_sql(SCHEMA_SQL)
+        applied = db_schema_up()
         exec_sql("INSERT INTO stores(code, name) VALUES "
                  "('C022','Store_C022'),('C09Z','Store_C09Z') "
                  "ON CONFLICT DO NOTHING;")
-        return jsonify({"ok": True, "msg": "schema ensured"})
+        return jsonify({"ok": True, "msg": "schema ensured", "applied": applied})
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+@app.get("/db-plans")
+def db_plans():
+    """EXPLAIN горячих запросов: используются ли нужные индексы/секции (tools/check_plans.py — то же из CLI).
+
+    Под тем же X-Migrate-Token, что и /db-migrate: планы раскрывают схему и нагружают базу."""
+    if not _migrate_authorized():
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    try:
+        with db_pool().connection() as conn:
+            res = dbschema.check_plans(conn)
+        return jsonify({"ok": all(r["ok"] for r in res), "queries": res})
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Перенос состояния и истории прогонов в Postgres (pgmigrate): CLI tools/migrate_to_pg.py или /db-migrate
+# ──────────────────────────────────────────────────────────────────────────────
+MIGRATE_TOKEN = os.getenv("MIGRATE_TOKEN", "").strip()   # заголовок X-Migrate-Token; пусто — роуты выключены
+MIGRATE_BATCH = int(os.getenv("MIGRATE_BATCH", "50000") or 50000)
+_migration: dict = {"running": False, "progress": {}, "result": None, "error": None, "started": None, "tenant": None}
+_migration_lock = threading.Lock()
+
+def _migrate_authorized() -> bool:
+    return bool(MIGRATE_TOKEN) and hmac.compare_digest(request.headers.get("X-Migrate-Token", ""), MIGRATE_TOKEN)
+
+def _runs_since(cursor: str | None):
+    since = datetime.fromisoformat(cursor) if cursor else None
+    if _tfile(RUNS_FILE).exists():  # ещё не разложен по сегментам (CLI до первого старта бота) — читаем как есть
+        yield from read_legacy_runs(_tfile(RUNS_FILE), since)
+    yield from _runlog.read(since=since)
+
+def _disk_state() -> dict:
+    """Состояние арендатора с диска только на чтение: CLI работает рядом с живым ботом, поэтому ни переноса
+    check_runs.jsonl, ни компакции журнала (обе двигают файлы, в которые бот пишет)."""
+    store = StateStore(_t().data_dir, fmt=STATE_SNAPSHOT_FORMAT, profile_cls=Profile)
+    return store.load(legacy=_legacy_state, compact=False)
+
+async def _state_copy(tenant: Tenant) -> dict:
+    # снимок в потоке PTB — там же, где STAFF/PENDING/_subs меняются
+    with _tenants.scoped(tenant):
+        return copy.deepcopy(_state_view())
+
+def migrate_to_pg(state: dict | None = None, restart: bool = False, progress=None, tenant: Tenant | None = None) -> dict:
+    with _tenants.scoped(tenant or _t()) as t:
+        db_schema_up()
+        if state is None:
+            state = _disk_state()
+        with db_pool().connection() as conn:
+            return Migrator(conn, state, _runs_since, dict(STORE_CATALOG), batch=MIGRATE_BATCH, progress=progress,
+                            tenant=t.slug).run(restart)
+
+def _migration_worker(state: dict, restart: bool, tenant: Tenant):
+    def progress(step, n):
+        _migration["progress"][step] = n
+    try:
+        _migration["result"] = migrate_to_pg(state, restart, progress, tenant)
+        log(f"db-migrate: done {_migration['result']}")
+    except MigrationBusy as e:  # перенос уже идёт из другого воркера/CLI (advisory lock)
+        _migration["error"] = str(e)
     except Exception as e:
+        _migration["error"] = str(e); log(f"db-migrate error: {e}", level=logging.ERROR, exc_info=True)
+    finally:
+        _migration["running"] = False
+
+@app.route("/db-migrate", methods=["GET", "POST"])
+def db_migrate():
+    if not _migrate_authorized():
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    if request.method == "GET":
+        return jsonify(_migration)
+    tenant = _tenants.get(request.args.get("tenant") or DEFAULT_TENANT)
+    if tenant is None:
+        return jsonify({"ok": False, "error": "unknown tenant"}), 404
+    if not (_ptb_ready and _loop):
+        return jsonify({"ok": False, "error": "bot is warming up"}), 503
+    with _migration_lock:
+        if _migration["running"]:
+            return jsonify({"ok": False, "error": "already running", **_migration}), 409
+        _migration.update(running=True, progress={}, result=None, error=None, started=iso_now(), tenant=tenant.slug)
+    try:
+        state = asyncio.run_coroutine_threadsafe(_state_copy(tenant), _loop).result(timeout=30)
+    except Exception as e:
+        _migration.update(running=False, error=str(e))
         return jsonify({"ok": False, "error": str(e)}), 500
+    restart = request.args.get("restart") == "1"
+    threading.Thread(target=_migration_worker, args=(state, restart, tenant), name="db-migrate", daemon=True).start()
+    return jsonify({"ok": True, "started": _migration["started"], "restart": restart, "tenant": tenant.slug}), 202
+
+# ── Быстрый приём: разбор тела без Flask, отсев апдейтов, которые ни один хендлер не возьмёт ──
+# Хендлеры читают только message (команды, фото, изображение документом) и callback_query; тот же список
+# уходит в setWebhook (allowed_updates), так что остальное Telegram перестаёт слать. До подтверждения
+# вебхука (и для старых доставок в очереди Telegram) лишнее отсекается здесь, до Update.de_json и до буфера
+# прогрева. Правка сообщения с командой больше не запускает команду повторно.
+ALLOWED_UPDATES = ("message", "callback_query")
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # необязательная зависимость: без неё — stdlib
+    _json_loads = json.loads
+_intake_skipped = 0
+
+def _wanted_update(data: dict) -> bool:
+    """Дойдёт ли апдейт до какого-нибудь хендлера (грубее фильтров PTB, но никогда не строже)."""
+    if "callback_query" in data:
+        return True
+    msg = data.get("message")
+    if not isinstance(msg, dict):
+        return False
+    if "photo" in msg:
+        return True
+    doc = msg.get("document")
+    if isinstance(doc, dict):
+        return str(doc.get("mime_type") or "").startswith("image")
+    text = msg.get("text")
+    return isinstance(text, str) and text.startswith("/")
+
 @app.post("/")
 def telegram_webhook():
-    if not (_loop_alive and _ptb_ready and _app and _loop):
-        log("webhook → loop not ready (503)"); return Response("loop not ready", status=503)
+    return _intake(_tenants.default)
+
+@app.post("/t/<slug>")
+def tenant_webhook(slug: str):
+    t = _tenants.get(slug)
+    if t is None or t.is_default:
+        return Response("not found", status=404)
+    return _intake(t)
+
+def _intake(t: Tenant):
+    global _intake_skipped
+    if _shutting_down:
+        return Response("shutting down", status=503)
     try:
-        data = request.get_json(force=True, silent=False)
-        upd = Update.de_json(data, _app.bot)
-        fut = asyncio.run_coroutine_threadsafe(_app.process_update(upd), _loop)
-        fut.add_done_callback(lambda f: None)
+        data = _json_loads(request.get_data(cache=False))
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return Response("bad request", status=400)
+    if not _wanted_update(data):
+        _intake_skipped += 1
+        return "ok", 200
+    if not _ptb_ready:
+        # прогрев: принимаем в буфер, пока поток PTB жив; иначе пусть Telegram повторит
+        warming = bool(_ptb_thread and _ptb_thread.is_alive())
+        if warming and _buffer_early_update(data, t):
+            return "ok", 200
+        if not _ptb_ready:
+            log("webhook → loop not ready (503)", level=logging.WARNING, event="webhook_503"); return Response("loop not ready", status=503)
+    if not (_loop_alive and t.app and _loop):
+        log("webhook → loop not ready (503)", level=logging.WARNING, event="webhook_503"); return Response("loop not ready", status=503)
+    lag_ms = _watchdog.lag() * 1000
+    if lag_ms >= LOOP_LAG_503_MS:
+        # цикл не успевает: пусть Telegram повторит, чем апдейт будет ждать в очереди (или потеряется при пересборке)
+        log("webhook → loop lagging (503)", level=logging.WARNING, event="webhook_503", lag_ms=round(lag_ms))
+        return Response("loop overloaded", status=503)
+    try:
+        logsetup.bind(fresh=True, update_id=data.get("update_id"), tenant=None if t.is_default else t.slug)
+        upd = Update.de_json(data, t.app.bot)
+        _track_inflight(asyncio.run_coroutine_threadsafe(_process_update(t, upd), _loop))
         return "ok", 200
     except Exception as e:
-        log(f"webhook ERROR: {e}")
+        log(f"webhook ERROR: {e}", level=logging.ERROR, exc_info=True)
         return Response("internal error", status=500)
 
 @app.before_request
 def _before_any():
+    logsetup.bind(fresh=True)  # поток Flask переиспользуется — поля прошлого запроса не тянем
+    ensure_ptb_started()
+
+# стартуем PTB сразу при импорте воркером, а не на первом запросе
+if PTB_EAGER_START:
+    STARTUP_PHASES["import"] = round((time.monotonic() - _T_IMPORT) * 1000, 1)
     ensure_ptb_started()
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+## cltemplates.py — реестр шаблонов чек-листа: версии, выбор по магазину/формату, предкомпиляция
+#
+#   checklist_templates/urban.json:
+#     {"id": "urban", "version": 2, "title": "URBAN",
+#      "formats": ["URBAN"],            — суффикс имени магазина в каталоге (…_URBAN)
+#      "stores": ["C022"],              — явная привязка (сильнее формата)
+#      "sections": [{"title": "1. …", "items": ["…", "…"]}, …]}
+#
+# Шаблон компилируется один раз при загрузке: заголовки, строки пунктов, callback_data и подписи кнопок,
+# раскладка (число пунктов по разделам), итог. Хендлеры берут готовые кортежи и не обходят dict шаблона
+# на каждый тап. Версия и отпечаток (fp) едут в состояние прогона и в stateless-токен; reload() заменяет
+# текущие версии атомарно, а уже начатые прогоны дорабатывают на своей (старые версии остаются в памяти).
+import json
+import zlib
+import hashlib
+import threading
+from pathlib import Path
+
+DEFAULT_ID = "default"
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class Section:
+    __slots__ = ("index", "title", "items", "n", "header", "item_heads", "item_tails", "toggle_cb",
+                 "labels", "goto_label", "goto_cb")
+
+    def __init__(self, index: int, title: str, items: list[str]):
+        self.index = index
+        self.title = title
+        self.items = tuple(items)
+        self.n = len(self.items)
+        self.header = f"*{title}*"
+        # строка пункта = head + символ отметки + tail
+        self.item_heads = tuple(f"{ii + 1}. " for ii in range(self.n))
+        self.item_tails = tuple(f" {text}" for text in self.items)
+        self.toggle_cb = tuple(f"cl:toggle:{ii}" for ii in range(self.n))
+        self.labels = tuple(f"{ii + 1} " for ii in range(self.n))
+        self.goto_label = f"{index + 1}. {title}"
+        self.goto_cb = f"cl:goto_{index}"
+
+
+class Template:
+    """Скомпилированный шаблон (неизменяемый после сборки)."""
+    __slots__ = ("id", "version", "title", "sections", "layout", "total", "key", "fp", "digest",
+                 "stores", "formats", "source")
+
+    def __init__(self, tid: str, version: int, sections: list[dict], title: str = "",
+                 stores=(), formats=(), source: str = ""):
+        if not sections:
+            raise TemplateError(f"template {tid}: no sections")
+        if len(sections) > 255:
+            raise TemplateError(f"template {tid}: too many sections")
+        secs = []
+        for i, s in enumerate(sections):
+            items = s.get("items") or []
+            if not s.get("title") or not items or not all(isinstance(x, str) and x for x in items):
+                raise TemplateError(f"template {tid}: section {i + 1} needs a title and non-empty items")
+            secs.append(Section(i, s["title"], items))
+        self.id = tid
+        self.version = int(version)
+        self.title = title or tid
+        self.sections = tuple(secs)
+        self.layout = tuple(s.n for s in secs)
+        self.total = sum(self.layout)
+        self.key = f"{tid}@{self.version}"
+        canon = json.dumps([[s.title, list(s.items)] for s in secs], ensure_ascii=False, separators=(",", ":"))
+        self.digest = hashlib.sha256(canon.encode()).hexdigest()[:12]
+        # 16 бит для токена; коллизии разрешает MAC (он покрывает key и раскладку)
+        self.fp = zlib.crc32(self.key.encode()) & 0xFFFF
+        self.stores = frozenset(stores)
+        self.formats = frozenset(f.upper() for f in formats)
+        self.source = source
+
+    @classmethod
+    def from_dict(cls, d: dict, source: str = "") -> "Template":
+        if not d.get("id") or "version" not in d:
+            raise TemplateError(f"{source or 'template'}: id and version are required")
+        return cls(str(d["id"]), d["version"], d.get("sections") or [], d.get("title", ""),
+                   d.get("stores", ()), d.get("formats", ()), source)
+
+    def progress(self, marks: dict) -> tuple[int, int]:
+        done = sum(1 for sec_marks in marks.values() for v in sec_marks.values() if v is True)
+        return done, self.total
+
+    def info(self) -> dict:
+        return {"key": self.key, "digest": self.digest, "sections": len(self.sections), "items": self.total,
+                "stores": sorted(self.stores), "formats": sorted(self.formats), "source": self.source}
+
+
+def store_format(store_name: str) -> str:
+    """RU_MOSCOW_MegaBelayaDacha_URBAN → URBAN."""
+    return store_name.rsplit("_", 1)[-1].upper() if "_" in store_name else ""
+
+
+class TemplateRegistry:
+    def __init__(self, builtin: Template, log=print):
+        self.builtin = builtin
+        self.log = log
+        self._lock = threading.Lock()
+        self.current: dict[str, Template] = {builtin.id: builtin}   # id → текущая версия
+        self._known: dict[str, Template] = {builtin.key: builtin}   # key → любая загруженная версия
+        self._by_fp: dict[int, list[Template]] = {builtin.fp: [builtin]}
+        self._by_store: dict[str, str] = {}
+        self._by_format: dict[str, str] = {}
+        self._select_cache: dict[str, Template] = {}
+        self.errors: list[str] = []
+
+    # ── загрузка ──────────────────────────────────────────────────────────────
+    @staticmethod
+    def read_dir(path: Path) -> tuple[list[Template], list[str]]:
+        out, errors = [], []
+        if Path(path).is_dir():
+            for f in sorted(Path(path).glob("*.json")):
+                try:
+                    out.append(Template.from_dict(json.loads(f.read_text(encoding="utf-8")), source=f.name))
+                except (ValueError, TypeError) as e:
+                    errors.append(f"{f.name}: {e}")
+        return out, errors
+
+    def reload(self, templates: list[Template], errors: list[str] | None = None) -> dict:
+        """Заменить набор текущих шаблонов. На один id берётся старшая версия; builtin — запасной."""
+        errors = list(errors or [])
+        cur: dict[str, Template] = {self.builtin.id: self.builtin}
+        for t in templates:
+            if t.id not in cur or cur[t.id] is self.builtin or t.version > cur[t.id].version:
+                cur[t.id] = t
+        by_store, by_format = {}, {}
+        for t in sorted(cur.values(), key=lambda t: t.id):
+            for code in t.stores:
+                if code in by_store:
+                    errors.append(f"store {code} is claimed by {by_store[code]} and {t.id}")
+                by_store.setdefault(code, t.id)
+            for fmt in t.formats:
+                by_format.setdefault(fmt, t.id)
+        with self._lock:
+            changed = []
+            for t in cur.values():
+                old = self._known.get(t.key)
+                if old is not None and old.digest != t.digest:
+                    # тот же id@version, другое содержимое — токены/прогоны старой раскладки сломались бы
+                    self.log(f"templates: {t.key} changed without a version bump — keeping the loaded one")
+                    cur[t.id] = old; continue
+                if old is None:
+                    self._known[t.key] = t
+                    self._by_fp.setdefault(t.fp, []).append(t)
+                    changed.append(t.key)
+            self.current = cur
+            self._by_store, self._by_format = by_store, by_format
+            self._select_cache = {}
+            self.errors = errors
+        for e in self.errors:
+            self.log(f"templates: {e}")
+        return {"current": sorted(t.key for t in cur.values()), "new": changed, "errors": self.errors}
+
+    # ── выбор ─────────────────────────────────────────────────────────────────
+    def for_store(self, code: str | None, store_name: str = "") -> Template:
+        """Шаблон для нового прогона: явная привязка магазина → формат из имени → default."""
+        key = code or ""
+        t = self._select_cache.get(key)
+        if t is None:
+            tid = self._by_store.get(key) or self._by_format.get(store_format(store_name)) or DEFAULT_ID
+            t = self.current.get(tid) or self.current.get(DEFAULT_ID) or self.builtin
+            self._select_cache[key] = t
+        return t
+
+    def get(self, key: str | None) -> Template:
+        """Шаблон начатого прогона по id@version (неизвестный — текущий default)."""
+        return self._known.get(key) or self.current.get(DEFAULT_ID) or self.builtin
+
+    def by_fp(self, fp: int) -> list[Template]:
+        return self._by_fp.get(fp, [])
+
+    def stats(self) -> dict:
+        return {"current": {tid: t.info() for tid, t in sorted(self.current.items())},
+                "by_store": dict(self._by_store), "by_format": dict(self._by_format),
+                "versions_loaded": len(self._known), "errors": self.errors}
@@ -0,0 +1,324 @@
+## dbschema.py — версионированные миграции схемы Postgres вместо одного CREATE IF NOT EXISTS
+#
+# Каждая миграция — (версия, имя, SQL); применённые записываются в schema_migrations. migrate() держит
+# pg_advisory_xact_lock, так что несколько воркеров/инстансов на старте не накатывают одно и то же дважды.
+# checklist_items секционирована по месяцу прогона (run_started_at); ensure_item_partitions() заранее
+# создаёт секции на ближайшие месяцы (строки без своей секции попадают в checklist_items_default).
+import hashlib
+from datetime import date
+
+LOCK_KEY = 0x636C7363  # отдельный от pgmigrate.LOCK_KEY
+
+SCHEMA_MIGRATIONS_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+  version INT PRIMARY KEY,
+  name TEXT NOT NULL,
+  checksum TEXT NOT NULL,
+  applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+MIGRATIONS: list[tuple[int, str, str]] = [
+    (1, "base", """
+CREATE TABLE IF NOT EXISTS stores (
+  code TEXT PRIMARY KEY,
+  name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+  user_id BIGINT PRIMARY KEY,
+  role TEXT NOT NULL CHECK (role IN ('admin','auditor','viewer')),
+  default_store TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+  user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+  store_code TEXT NOT NULL REFERENCES stores(code) ON DELETE CASCADE,
+  PRIMARY KEY (user_id, store_code)
+);
+
+CREATE TABLE IF NOT EXISTS checklist_runs (
+  id BIGSERIAL PRIMARY KEY,
+  store_code TEXT NOT NULL REFERENCES stores(code) ON DELETE CASCADE,
+  auditor_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE SET NULL,
+  status TEXT NOT NULL DEFAULT 'in_progress' CHECK (status IN ('in_progress','finished','cancelled')),
+  started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  finished_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS checklist_items (
+  run_id BIGINT NOT NULL REFERENCES checklist_runs(id) ON DELETE CASCADE,
+  section INT NOT NULL,
+  item_key TEXT NOT NULL,
+  state TEXT NOT NULL CHECK (state IN ('✅','❌','⬜️')),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (run_id, section, item_key)
+);
+"""),
+    (2, "profile_columns_and_run_import", """
+-- профиль целиком (см. profile_model) и «подписан на все магазины» вместо "*" в subscriptions
+ALTER TABLE users ADD COLUMN IF NOT EXISTS username TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS tz TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS stores TEXT[] NOT NULL DEFAULT '{}';
+ALTER TABLE users ADD COLUMN IF NOT EXISTS flags INT NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS follow_all BOOLEAN NOT NULL DEFAULT false;
+
+-- прогоны из лога: source_key = ts|store|auditor (идемпотентный перенос), итог по пунктам
+ALTER TABLE checklist_runs ADD COLUMN IF NOT EXISTS source_key TEXT;
+ALTER TABLE checklist_runs ADD COLUMN IF NOT EXISTS items_done INT;
+ALTER TABLE checklist_runs ADD COLUMN IF NOT EXISTS items_total INT;
+CREATE UNIQUE INDEX IF NOT EXISTS checklist_runs_source_key ON checklist_runs(source_key);
+
+CREATE TABLE IF NOT EXISTS pending_requests (
+  req_id TEXT PRIMARY KEY,
+  payload JSONB NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""),
+    (3, "run_indexes", """
+-- ON DELETE SET NULL при NOT NULL никогда не срабатывал бы — удаление пользователя падало
+ALTER TABLE checklist_runs ALTER COLUMN auditor_id DROP NOT NULL;
+
+-- «последний прогон по магазину за N дней»
+CREATE INDEX IF NOT EXISTS checklist_runs_store_finished
+  ON checklist_runs (store_code, finished_at DESC) WHERE status = 'finished';
+-- незавершённые прогоны (их единицы, индекс крошечный)
+CREATE INDEX IF NOT EXISTS checklist_runs_open
+  ON checklist_runs (store_code, started_at) WHERE status = 'in_progress';
+-- история аудитора
+CREATE INDEX IF NOT EXISTS checklist_runs_auditor
+  ON checklist_runs (auditor_id, started_at DESC);
+-- внешний ключ subscriptions.store_code: рассылка по магазину и ON DELETE CASCADE
+CREATE INDEX IF NOT EXISTS subscriptions_store ON subscriptions (store_code);
+"""),
+    (4, "partition_checklist_items", """
+-- секционирование по месяцу прогона: ключ секции входит в PK, run_started_at = checklist_runs.started_at
+ALTER TABLE checklist_items RENAME TO checklist_items_old;
+ALTER TABLE checklist_items_old RENAME CONSTRAINT checklist_items_pkey TO checklist_items_old_pkey;
+
+CREATE TABLE checklist_items (
+  run_id BIGINT NOT NULL REFERENCES checklist_runs(id) ON DELETE CASCADE,
+  run_started_at TIMESTAMPTZ NOT NULL,
+  section INT NOT NULL,
+  item_key TEXT NOT NULL,
+  state TEXT NOT NULL CHECK (state IN ('✅','❌','⬜️')),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (run_id, run_started_at, section, item_key)
+) PARTITION BY RANGE (run_started_at);
+
+CREATE TABLE checklist_items_default PARTITION OF checklist_items DEFAULT;
+
+-- секции под уже накопленные месяцы — до переноса строк, иначе всё осело бы в DEFAULT
+DO $$
+DECLARE m date;
+BEGIN
+  FOR m IN SELECT DISTINCT date_trunc('month', r.started_at AT TIME ZONE 'UTC')::date
+           FROM checklist_items_old i JOIN checklist_runs r ON r.id = i.run_id
+  LOOP
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF checklist_items FOR VALUES FROM (%L) TO (%L)',
+                   'checklist_items_' || to_char(m, 'YYYYMM'), m::timestamp AT TIME ZONE 'UTC',
+                   (m + interval '1 month')::timestamp AT TIME ZONE 'UTC');
+  END LOOP;
+END $$;
+
+INSERT INTO checklist_items (run_id, run_started_at, section, item_key, state, updated_at)
+SELECT i.run_id, r.started_at, i.section, i.item_key, i.state, i.updated_at
+FROM checklist_items_old i JOIN checklist_runs r ON r.id = i.run_id;
+
+DROP TABLE checklist_items_old;
+"""),
+    (5, "checklist_templates", """
+-- шаблоны чек-листа (см. cltemplates): body = {"title", "stores", "formats", "sections"}; берётся старшая active-версия
+CREATE TABLE IF NOT EXISTS checklist_templates (
+  id TEXT NOT NULL,
+  version INT NOT NULL,
+  body JSONB NOT NULL,
+  active BOOLEAN NOT NULL DEFAULT true,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (id, version)
+);
+
+-- каким шаблоном (id@version) пройден прогон
+ALTER TABLE checklist_runs ADD COLUMN IF NOT EXISTS template TEXT;
+"""),
+    (6, "tenants", """
+-- несколько ботов в одной базе (см. tenants.py): арендатор входит в ключи; шаблоны чек-листа остаются общими
+ALTER TABLE stores ADD COLUMN IF NOT EXISTS tenant TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE users ADD COLUMN IF NOT EXISTS tenant TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS tenant TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE pending_requests ADD COLUMN IF NOT EXISTS tenant TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE checklist_runs ADD COLUMN IF NOT EXISTS tenant TEXT NOT NULL DEFAULT 'default';
+
+-- внешние ключи смотрят на старые PK — снимаем, меняем PK на составные и вешаем заново
+ALTER TABLE subscriptions DROP CONSTRAINT IF EXISTS subscriptions_user_id_fkey,
+                          DROP CONSTRAINT IF EXISTS subscriptions_store_code_fkey;
+ALTER TABLE checklist_runs DROP CONSTRAINT IF EXISTS checklist_runs_store_code_fkey,
+                           DROP CONSTRAINT IF EXISTS checklist_runs_auditor_id_fkey;
+
+ALTER TABLE stores DROP CONSTRAINT stores_pkey, ADD PRIMARY KEY (tenant, code);
+ALTER TABLE users DROP CONSTRAINT users_pkey, ADD PRIMARY KEY (tenant, user_id);
+ALTER TABLE subscriptions DROP CONSTRAINT subscriptions_pkey, ADD PRIMARY KEY (tenant, user_id, store_code);
+ALTER TABLE pending_requests DROP CONSTRAINT pending_requests_pkey, ADD PRIMARY KEY (tenant, req_id);
+
+ALTER TABLE subscriptions
+  ADD CONSTRAINT subscriptions_user_fkey FOREIGN KEY (tenant, user_id) REFERENCES users(tenant, user_id) ON DELETE CASCADE,
+  ADD CONSTRAINT subscriptions_store_fkey FOREIGN KEY (tenant, store_code) REFERENCES stores(tenant, code) ON DELETE CASCADE;
+-- SET NULL только auditor_id (PG15+): tenant обнулять нельзя, он NOT NULL
+ALTER TABLE checklist_runs
+  ADD CONSTRAINT checklist_runs_store_fkey FOREIGN KEY (tenant, store_code) REFERENCES stores(tenant, code) ON DELETE CASCADE,
+  ADD CONSTRAINT checklist_runs_auditor_fkey FOREIGN KEY (tenant, auditor_id) REFERENCES users(tenant, user_id)
+    ON DELETE SET NULL (auditor_id);
+
+-- горячие запросы всегда в пределах арендатора — он первым в индексах
+DROP INDEX IF EXISTS checklist_runs_source_key;
+CREATE UNIQUE INDEX checklist_runs_source_key ON checklist_runs (tenant, source_key);
+DROP INDEX IF EXISTS checklist_runs_store_finished;
+CREATE INDEX checklist_runs_store_finished
+  ON checklist_runs (tenant, store_code, finished_at DESC) WHERE status = 'finished';
+DROP INDEX IF EXISTS checklist_runs_open;
+CREATE INDEX checklist_runs_open ON checklist_runs (tenant, store_code, started_at) WHERE status = 'in_progress';
+DROP INDEX IF EXISTS checklist_runs_auditor;
+CREATE INDEX checklist_runs_auditor ON checklist_runs (tenant, auditor_id, started_at DESC);
+DROP INDEX IF EXISTS subscriptions_store;
+CREATE INDEX subscriptions_store ON subscriptions (tenant, store_code);
+"""),
+]
+
+
+def _checksum(sql: str) -> str:
+    return hashlib.sha256(sql.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def applied(conn) -> dict[int, str]:
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_MIGRATIONS_SQL)
+        cur.execute("SELECT version, checksum FROM schema_migrations")
+        return dict(cur.fetchall())
+
+
+def migrate(conn, target: int | None = None, log=print) -> list[int]:
+    """Накатить недостающие миграции (каждая — своя транзакция). Возвращает применённые версии."""
+    done: list[int] = []
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_MIGRATIONS_SQL)
+        conn.commit()
+        for version, name, sql in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_KEY,))
+            cur.execute("SELECT checksum FROM schema_migrations WHERE version = %s", (version,))
+            row = cur.fetchone()
+            if row:
+                if row[0] != _checksum(sql):
+                    log(f"schema: migration {version} ({name}) changed after it was applied")
+                conn.commit()
+                continue
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations(version, name, checksum) VALUES (%s, %s, %s)",
+                        (version, name, _checksum(sql)))
+            conn.commit()
+            done.append(version)
+            log(f"schema: applied {version} {name}")
+    return done
+
+
+def _month_add(d: date, n: int) -> date:
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+
+def ensure_item_partitions(conn, today: date | None = None, ahead: int = 2) -> list[str]:
+    """Секции checklist_items на текущий и ahead следующих месяцев."""
+    today = today or date.today()
+    first = today.replace(day=1)
+    created = []
+    with conn.cursor() as cur:
+        for i in range(ahead + 1):
+            lo, hi = _month_add(first, i), _month_add(first, i + 1)
+            name = f"checklist_items_{lo:%Y%m}"
+            cur.execute("SELECT to_regclass(%s)", (name,))
+            if cur.fetchone()[0] is not None:
+                continue
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF checklist_items "
+                        f"FOR VALUES FROM ('{lo.isoformat()} 00:00+00') TO ('{hi.isoformat()} 00:00+00')")
+            created.append(name)
+    conn.commit()
+    return created
+
+
+# ── планы горячих запросов ────────────────────────────────────────────────────
+# name -> (SQL, параметры, индексы/секции, которые обязаны быть в плане, узлы, которых быть не должно).
+# Проверяем при enable_seqscan = off: на пустой/маленькой базе seq scan дешевле всегда, а нас интересует,
+# что подходящий индекс вообще есть и пригоден (иначе план останется Seq Scan и проверка упадёт).
+HOT_QUERIES: dict[str, tuple[str, tuple, tuple[str, ...], tuple[str, ...]]] = {
+    "last_run_per_store": (
+        """SELECT DISTINCT ON (store_code) store_code, finished_at FROM checklist_runs
+           WHERE tenant = %s AND status = 'finished' AND store_code = ANY(%s)
+             AND finished_at >= now() - interval '7 days'
+           ORDER BY store_code, finished_at DESC""",
+        ("default", ["C0SL", "C00X"]), ("checklist_runs_store_finished",), ("Seq Scan",)),
+    "open_runs_for_store": (
+        "SELECT id, started_at FROM checklist_runs WHERE tenant = %s AND status = 'in_progress' AND store_code = %s",
+        ("default", "C0SL"), ("checklist_runs_open",), ("Seq Scan",)),
+    "auditor_history": (
+        """SELECT id, store_code, started_at FROM checklist_runs WHERE tenant = %s AND auditor_id = %s
+           ORDER BY started_at DESC LIMIT 20""",
+        ("default", 1), ("checklist_runs_auditor",), ("Seq Scan", "Sort")),
+    # секция и момент внутри неё подставляются из существующих (_item_partition): проверка только читает
+    "run_items": (
+        "SELECT section, item_key, state FROM checklist_items WHERE run_id = %s AND run_started_at = %s",
+        (1, None), ("checklist_items_{month}",), ("Seq Scan",)),
+}
+
+
+def _item_partition(conn) -> tuple[str, str]:
+    """(YYYYMM, ts) последней месячной секции checklist_items; нет ни одной — текущий месяц (план тогда
+    уйдёт в секцию default, и проверка честно покажет, что секций нет)."""
+    with conn.cursor() as cur:
+        cur.execute("""SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                       WHERE i.inhparent = 'checklist_items'::regclass AND c.relname ~ '^checklist_items_[0-9]{6}$'
+                       ORDER BY c.relname DESC LIMIT 1""")
+        row = cur.fetchone()
+    month = row[0].rsplit("_", 1)[1] if row else f"{date.today():%Y%m}"
+    return month, f"{month[:4]}-{month[4:]}-01T09:00:00+00:00"
+
+
+def _walk(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def explain(conn, sql: str, params: tuple) -> dict:
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        return cur.fetchone()[0][0]["Plan"]
+
+
+def check_plans(conn) -> list[dict]:
+    """EXPLAIN горячих запросов; ok=False, если нужный индекс/секция не используется.
+
+    Только чтение (всё в одной транзакции с откатом): секции не создаются — для этого ensure_item_partitions.
+    """
+    out = []
+    try:
+        month, ts = _item_partition(conn)
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+        for name, (sql, params, want, forbid) in HOT_QUERIES.items():
+            params = tuple(ts if p is None else p for p in params)
+            want = tuple(w.format(month=month) for w in want)
+            plan = explain(conn, sql, params)
+            nodes = list(_walk(plan))
+            used = {n.get("Index Name") for n in nodes} | {n.get("Relation Name") for n in nodes}
+            used = {u for u in used if u}
+            # индекс секции называется по имени секции (checklist_items_202610_pkey)
+            missing = [w for w in want if not any(u == w or u.startswith(w + "_") for u in used)]
+            bad = sorted({n["Node Type"] for n in nodes if n["Node Type"] in forbid})
+            out.append({"query": name, "ok": not missing and not bad, "missing": missing, "forbidden": bad,
+                        "nodes": [n["Node Type"] + (f" {n['Index Name']}" if n.get("Index Name") else "") for n in nodes]})
+    finally:
+        conn.rollback()
+    return out
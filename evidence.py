@@ -0,0 +1,304 @@
+## evidence.py — фотофиксация по разделам чек-листа: очередь передачи Telegram → хранилище
+#
+# Хендлер только ставит задание (мгновенный ответ пользователю), дальше фиксированное число воркеров
+# скачивает файл из Telegram и кладёт в хранилище (LocalStorage или Яндекс.Диск). Задания лежат в spool/
+# на диске до успешной загрузки — после рестарта продолжаются; неудачи повторяются с экспоненциальной
+# паузой. На каждый прогон — manifest.json (что, к какому разделу, статус), копия уходит в папку прогона.
+#
+#   spool/jobs/<job>.json         — незавершённые задания
+#   spool/manifests/<run>.json    — манифесты прогонов (незакрытые — ещё и «текущий прогон» чата после рестарта)
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import httpx
+
+
+class StorageError(Exception):
+    pass
+
+
+class LocalStorage:
+    """Папки прогонов на локальном диске (по умолчанию и для проверок)."""
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, path: str) -> Path:
+        p = (self.root / path.lstrip("/")).resolve()
+        if self.root.resolve() not in p.parents:
+            raise StorageError(f"path escapes storage root: {path}")
+        return p
+
+    async def put(self, path: str, data: bytes):
+        p = self._path(path)
+
+        def write():
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_name(p.name + ".part")
+            tmp.write_bytes(data)
+            os.replace(tmp, p)
+        await asyncio.to_thread(write)
+
+    async def exists(self, path: str) -> bool:
+        return await asyncio.to_thread(self._path(path).exists)
+
+    async def close(self):
+        pass
+
+
+class YandexDiskStorage:
+    """REST API Яндекс.Диска: upload-ссылка → PUT байтов; папки создаются по цепочке."""
+    name = "yadisk"
+    API = "https://cloud-api.yandex.net/v1/disk/resources"
+
+    def __init__(self, token: str, timeout: float = 60.0):
+        if not token:
+            raise StorageError("YADISK_TOKEN is required for yadisk storage")
+        self._headers = {"Authorization": f"OAuth {token}"}
+        self._timeout = timeout
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop = None
+        self._dirs: set[str] = set()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # пул соединений httpx привязан к циклу: после пересборки цикла PTB нужен новый клиент
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(headers=self._headers, timeout=self._timeout)
+            self._client_loop = loop
+        return self._client
+
+    async def _mkdirs(self, folder: str):
+        parts = [p for p in folder.strip("/").split("/") if p]
+        cur = ""
+        for part in parts:
+            cur += "/" + part
+            if cur in self._dirs:
+                continue
+            r = await self.client.put(self.API, params={"path": f"disk:{cur}"})
+            if r.status_code not in (201, 409):  # 409 — уже есть
+                raise StorageError(f"mkdir {cur}: {r.status_code} {r.text[:200]}")
+            self._dirs.add(cur)
+
+    async def put(self, path: str, data: bytes):
+        await self._mkdirs(path.rsplit("/", 1)[0])
+        r = await self.client.get(self.API + "/upload", params={"path": f"disk:{path}", "overwrite": "true"})
+        if r.status_code != 200:
+            raise StorageError(f"upload link {path}: {r.status_code} {r.text[:200]}")
+        up = await self.client.put(r.json()["href"], content=data)
+        if up.status_code not in (200, 201, 202):
+            raise StorageError(f"upload {path}: {up.status_code}")
+
+    async def exists(self, path: str) -> bool:
+        r = await self.client.get(self.API, params={"path": f"disk:{path}", "fields": "name"})
+        return r.status_code == 200
+
+    async def close(self):
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+
+
+def make_storage(kind: str, local_root: Path, yadisk_token: str = ""):
+    if kind == "yadisk":
+        return YandexDiskStorage(yadisk_token)
+    return LocalStorage(local_root)
+
+
+class TransferPool:
+    """workers корутин забирают задания из очереди; fetch(file_id) → bytes (скачивание из Telegram)."""
+
+    def __init__(self, storage, spool: Path, workers: int = 4, max_attempts: int = 8,
+                 base_delay: float = 2.0, max_delay: float = 300.0, log=print):
+        self.storage = storage
+        self.spool = Path(spool)
+        self.jobs_dir = self.spool / "jobs"
+        self.man_dir = self.spool / "manifests"
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay, self.max_delay = base_delay, max_delay
+        self.log = log
+        self.fetch: Callable[[str], Awaitable[bytes]] | None = None
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._lock = threading.Lock()  # манифесты пишутся и из хендлеров, и из воркеров
+        self.stats = {"queued": 0, "uploaded": 0, "retried": 0, "failed": 0, "bytes": 0}
+
+    # ── манифесты ─────────────────────────────────────────────────────────────
+    def _man_path(self, run: str) -> Path:
+        return self.man_dir / f"{run.replace('/', '_')}.json"
+
+    def manifest(self, run: str) -> dict | None:
+        p = self._man_path(run)
+        return json.loads(p.read_text(encoding="utf-8")) if p.exists() else None
+
+    def _update_manifest(self, run: str, fn):
+        with self._lock:
+            self.man_dir.mkdir(parents=True, exist_ok=True)
+            p = self._man_path(run)
+            man = json.loads(p.read_text(encoding="utf-8")) if p.exists() else {"run": run, "photos": []}
+            fn(man)
+            tmp = p.with_suffix(".tmp")
+            tmp.write_text(json.dumps(man, ensure_ascii=False, indent=1), encoding="utf-8")
+            os.replace(tmp, p)
+            return man
+
+    def open_run(self, run: str, folder: str, **meta):
+        def fn(man):
+            man.setdefault("folder", folder); man.setdefault("opened", _iso())
+            man.update({k: v for k, v in meta.items() if v is not None})
+        self._update_manifest(run, fn)
+
+    def close_run(self, run: str, **meta):
+        man = self._update_manifest(run, lambda m: m.update(finished=_iso(), **meta))
+        self._enqueue_manifest(run, man)
+
+    def open_runs(self) -> list[dict]:
+        """Манифесты незакрытых прогонов, по времени открытия (текущие прогоны чатов после рестарта)."""
+        out = []
+        for p in sorted(self.man_dir.glob("*.json")) if self.man_dir.exists() else ():
+            try:
+                man = json.loads(p.read_text(encoding="utf-8"))
+            except ValueError:
+                continue
+            if not man.get("finished"):
+                out.append(man)
+        return sorted(out, key=lambda m: m.get("opened", ""))
+
+    def _enqueue_manifest(self, run: str, man: dict):
+        if self._queue is not None and man.get("folder"):
+            self._queue.put_nowait({"kind": "manifest", "run": run, "path": man["folder"].rstrip("/") + "/manifest.json"})
+
+    # ── задания ───────────────────────────────────────────────────────────────
+    def submit(self, run: str, folder: str, file_id: str, unique_id: str, section: int, ext: str = "jpg",
+               **meta) -> dict | None:
+        """Поставить фото в очередь (синхронно и быстро: только запись JSON в spool).
+
+        None — это фото (unique_id) в прогоне уже есть: повторно не ставится, иначе второе задание под тем же id
+        загрузило бы файл под новым именем мимо манифеста. Не загрузившееся (failed) ставится заново под прежним.
+        """
+        names = []
+
+        def fn(man):
+            p = next((p for p in man["photos"] if p["unique_id"] == unique_id), None)
+            if p is None:
+                p = {"section": section, "name": f"s{section + 1:02d}_{int(time.time())}_{unique_id}.{ext}",
+                     "unique_id": unique_id}
+                man["photos"].append(p)
+            elif p.get("status") != "failed":
+                return  # то же фото прислали повторно
+            p.update(status="queued", queued=_iso()); p.pop("error", None)
+            names.append(p["name"])
+        self._update_manifest(run, fn)
+        if not names:
+            return None
+        job = {"id": f"{run.replace('/', '_')}-{unique_id}", "kind": "photo", "run": run,
+               "path": folder.rstrip("/") + "/" + names[0], "file_id": file_id, "unique_id": unique_id,
+               "section": section, "attempts": 0, "queued": _iso(), **meta}
+        self._write_job(job)
+        self.stats["queued"] += 1
+        if self._queue is not None:
+            self._queue.put_nowait(job)
+        return job
+
+    def _write_job(self, job: dict):
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        p = self.jobs_dir / f"{job['id']}.json"
+        tmp = p.with_suffix(".tmp")
+        tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, p)
+
+    def _drop_job(self, job: dict):
+        (self.jobs_dir / f"{job['id']}.json").unlink(missing_ok=True)
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # ── воркеры ───────────────────────────────────────────────────────────────
+    def start(self, fetch: Callable[[str], Awaitable[bytes]]) -> int:
+        """Запустить воркеры в текущем цикле и подхватить задания из spool. Возвращает число подхваченных."""
+        self.fetch = fetch
+        self._queue = asyncio.Queue()
+        resumed = 0
+        if self.jobs_dir.exists():
+            for p in sorted(self.jobs_dir.glob("*.json")):
+                try:
+                    self._queue.put_nowait(json.loads(p.read_text(encoding="utf-8"))); resumed += 1
+                except ValueError:
+                    p.unlink(missing_ok=True)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+        return resumed
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.storage.close()
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job["kind"] == "manifest":
+                    await self._put_manifest(job)
+                else:
+                    await self._transfer(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._retry(job, e)
+            finally:
+                self._queue.task_done()
+
+    async def _put_manifest(self, job: dict):
+        man = self.manifest(job["run"])
+        if man is not None:
+            await self.storage.put(job["path"], json.dumps(man, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    async def _transfer(self, job: dict):
+        data = await self.fetch(job["file_id"])
+        await self.storage.put(job["path"], data)
+        self.stats["uploaded"] += 1; self.stats["bytes"] += len(data)
+        self._drop_job(job)
+        man = self._update_manifest(job["run"], lambda m: _set_photo(m, job["unique_id"], status="uploaded",
+                                                                      size=len(data), uploaded=_iso()))
+        if man.get("finished"):  # прогон уже закрыт — обновляем копию манифеста в хранилище
+            self._enqueue_manifest(job["run"], man)
+
+    def _retry(self, job: dict, err: Exception):
+        job["attempts"] = job.get("attempts", 0) + 1
+        if job["attempts"] >= self.max_attempts:
+            self.stats["failed"] += 1
+            self.log(f"evidence: {job.get('path')} failed after {job['attempts']} attempts: {err}")
+            if job["kind"] == "photo":
+                self._drop_job(job)
+                man = self._update_manifest(job["run"], lambda m: _set_photo(m, job["unique_id"], status="failed",
+                                                                              error=str(err)[:200]))
+                if man.get("finished"):
+                    self._enqueue_manifest(job["run"], man)
+            return
+        self.stats["retried"] += 1
+        if job["kind"] == "photo":
+            self._write_job(job)  # attempts переживают рестарт
+        delay = min(self.max_delay, self.base_delay * 2 ** (job["attempts"] - 1)) * random.uniform(0.8, 1.2)
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job)
+
+
+def _set_photo(man: dict, unique_id: str, **fields):
+    for p in man["photos"]:
+        if p["unique_id"] == unique_id:
+            p.update(fields)
+
+
+def _iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -0,0 +1,19 @@
+## gunicorn.conf.py — подхватывается gunicorn автоматически (из рабочей папки)
+#
+# SIGTERM воркера (рестарт дино, max_requests, HUP) gunicorn обрабатывает сам: дожидается текущего запроса
+# и выходит. worker_exit выполняется в процессе воркера — там и дренируем PTB (app.shutdown).
+# graceful_timeout должен быть больше SHUTDOWN_DRAIN_S (+5 с на закрытие клиентов), иначе мастер добьёт воркер.
+import os
+import sys
+
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Один воркер: состояние бота (STAFF, подписки, seq журнала, журнал напоминаний) живёт в памяти процесса.
+# Второй процесс на том же DATA_DIR ждёт flock писателя (statestore, STATE_LOCK_WAIT_S) и не поднимает бота —
+# так и должен вести себя только новый воркер, пока старый дренируется. Параллелизм — PTB_CONCURRENCY.
+workers = 1
+
+
+def worker_exit(server, worker):
+    mod = sys.modules.get("app")  # приложение могло не загрузиться (ошибка импорта)
+    if mod is not None and hasattr(mod, "shutdown"):
+        mod.shutdown("worker_exit")
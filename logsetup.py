@@ -0,0 +1,176 @@
+## logsetup.py — логирование без блокирующей записи на горячем пути
+#
+# Хендлеры (Flask-потоки, цикл PTB) только кладут запись в очередь (QueueHandler); форматирует и пишет
+# в stdout отдельный поток QueueListener. Поля корреляции (update_id, chat_id, user_id, handler) берутся
+# из contextvars в момент вызова — так одна и та же цепочка апдейта видна и в Flask, и в PTB, и в задачах.
+#
+#   LOG_FORMAT=json|text
+#   LOG_LEVEL=INFO                               — корневой уровень
+#   LOG_LEVELS=evidence=DEBUG,httpx=WARNING      — по компонентам (bot.<component> или имя чужого логгера)
+#   LOG_SAMPLE=update=0.01,edit=0.1              — доля сохраняемых записей по event (WARNING и выше — всегда)
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+ROOT = "bot"
+EXTERNAL = ("httpx", "httpcore", "telegram", "apscheduler", "werkzeug", "gunicorn", "psycopg")
+_ctx: ContextVar[dict] = ContextVar("log_ctx", default={})
+_STD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def bind(fresh: bool = False, **fields):
+    """Добавить поля корреляции в текущий контекст (fresh — начать с чистого). Возвращает токен для reset()."""
+    base = {} if fresh else _ctx.get()
+    return _ctx.set({**base, **{k: v for k, v in fields.items() if v is not None}})
+
+
+def reset(token):
+    _ctx.reset(token)
+
+
+def context() -> dict:
+    return _ctx.get()
+
+
+def parse_kv(spec: str) -> dict[str, str]:
+    out = {}
+    for part in (spec or "").replace(";", ",").split(","):
+        k, sep, v = part.partition("=")
+        if sep and k.strip():
+            out[k.strip()] = v.strip()
+    return out
+
+
+class ContextFilter(logging.Filter):
+    """Копирует поля корреляции в запись (выполняется в потоке вызова, до очереди)."""
+    def filter(self, record):
+        for k, v in _ctx.get().items():
+            if not hasattr(record, k):
+                setattr(record, k, v)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Для записей с event из rates оставляет каждую round(1/rate)-ю; WARNING и выше не трогает."""
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.every = {ev: max(1, round(1 / r)) if r > 0 else 0 for ev, r in rates.items()}
+        self.seen: dict[str, int] = {}
+        self.dropped: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def decide(self, ev: str | None, levelno: int) -> int:
+        """0 — отбросить; иначе сколько событий представляет запись (1 — без прореживания)."""
+        every = self.every.get(ev) if ev is not None else None
+        if every is None or levelno >= logging.WARNING:
+            return 1
+        with self._lock:
+            n = self.seen[ev] = self.seen.get(ev, 0) + 1
+            if every and n % every == 1 % every:
+                return every
+            self.dropped[ev] = self.dropped.get(ev, 0) + 1
+            return 0
+
+    def filter(self, record):
+        if getattr(record, "_sampled", False):  # уже решено в sample() до создания записи
+            return True
+        k = self.decide(getattr(record, "event", None), record.levelno)
+        if k > 1:
+            record.sampled = k
+        return k > 0
+
+
+def sample(event: str, levelno: int = logging.INFO) -> int:
+    """Решение о прореживании до создания записи (дёшево для отброшенных). См. SamplingFilter.decide."""
+    s = _State.sampler
+    return s.decide(event, levelno) if s is not None else 1
+
+
+def _ts(record) -> str:
+    return datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _fields(record) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _STD_ATTRS and not k.startswith("_")}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {"ts": _ts(record), "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        out.update(_fields(record))
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        extra = _fields(record)
+        exc = extra.pop("exc", None)
+        tail = (" " + " ".join(f"{k}={v}" for k, v in extra.items())) if extra else ""
+        line = f"[{_ts(record)}] {record.levelname} {record.name}: {record.getMessage()}{tail}"
+        return line + ("\n" + exc if exc else "")
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Как QueueHandler, но исключение уходит отдельным полем exc, а не вклеивается в msg."""
+    def prepare(self, record):
+        rec = logging.makeLogRecord(vars(record))
+        rec.msg = record.getMessage(); rec.args = None
+        if record.exc_info:
+            rec.exc = logging.Formatter().formatException(record.exc_info)
+            rec.exc_info = None; rec.exc_text = None
+        return rec
+
+
+class _State:
+    listener: logging.handlers.QueueListener | None = None
+    q: queue.SimpleQueue | None = None
+    sampler: SamplingFilter | None = None
+    handler: logging.Handler | None = None
+
+
+def setup(fmt: str = "json", level: str = "INFO", levels: str = "", sample: str = "", stream=None) -> logging.Logger:
+    """Настроить корневой логгер один раз на процесс (повторный вызов — no-op)."""
+    root = logging.getLogger()
+    if _State.listener is not None:
+        return logging.getLogger(ROOT)
+    out = logging.StreamHandler(stream or sys.stdout)
+    out.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _State.q = queue.SimpleQueue()
+    qh = _QueueHandler(_State.q)
+    qh.addFilter(ContextFilter())
+    rates = {}
+    for ev, r in parse_kv(sample).items():
+        try:
+            rates[ev] = float(r)
+        except ValueError:
+            pass
+    _State.sampler = SamplingFilter(rates)
+    qh.addFilter(_State.sampler)
+    root.handlers[:] = [qh]
+    root.setLevel(level.upper())
+    for name, lvl in parse_kv(levels).items():
+        logging.getLogger(name if "." in name or name in EXTERNAL else f"{ROOT}.{name}").setLevel(lvl.upper())
+    _State.handler = qh
+    _State.listener = logging.handlers.QueueListener(_State.q, out, respect_handler_level=False)
+    _State.listener.start()
+    atexit.register(shutdown)
+    return logging.getLogger(ROOT)
+
+
+def shutdown():
+    """Дописать очередь и остановить поток записи."""
+    if _State.listener is not None:
+        _State.listener.stop()
+        _State.listener = None
+
+
+def stats() -> dict:
+    s = _State.sampler
+    return {"queued": _State.q.qsize() if _State.q is not None else 0,
+            "sampled_out": dict(s.dropped) if s else {}, "running": _State.listener is not None}
@@ -0,0 +1,111 @@
+## loopwatch.py — сторож цикла PTB: задержка цикла, «заклинивший» цикл, дамп стека
+#
+# Отдельный поток раз в interval ставит в цикл пробу (call_soon_threadsafe) и меряет, через сколько она
+# выполнилась. Пока проба не вернулась, текущая задержка — её возраст: так видно и медленный цикл
+# (длинные синхронные куски между await), и намертво заблокированный (time.sleep, синхронный HTTP, замок).
+#
+#   lag()         — текущая задержка, с (для решения «принимать ли апдейты»)
+#   stats()       — last/ewma/max/p99 за окно, число «залипаний», возраст неотвеченной пробы
+#   on_wedged     — вызывается один раз на цикл, если проба не вернулась за wedged_s
+#                   (перед этим в лог уходит стек потока цикла — видно, чем он занят)
+import sys
+import time
+import threading
+import traceback
+from collections import deque
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.25, wedged_s: float = 30.0, slow_s: float = 0.5,
+                 window: int = 240, on_wedged=None, log=print):
+        self.interval = interval
+        self.wedged_s = wedged_s
+        self.slow_s = slow_s          # проба дольше — считается «залипанием» (stalls)
+        self.on_wedged = on_wedged
+        self.log = log
+        self._loop = None
+        self._thread: threading.Thread | None = None
+        self._gen = 0
+        self._sent: float | None = None     # monotonic отправки неотвеченной пробы
+        self._fired = False                 # on_wedged уже вызван для текущего цикла
+        self._samples: deque[float] = deque(maxlen=window)
+        self._last = 0.0
+        self._ewma = 0.0
+        self._stalls = 0
+        self._wedged = 0
+        self._last_ok: float | None = None
+        self._stop = threading.Event()
+        self._runner: threading.Thread | None = None
+
+    # ── привязка ──────────────────────────────────────────────────────────────
+    def attach(self, loop, thread: threading.Thread):
+        """Следить за новым циклом (после старта или пересборки PTB); статистика окна начинается заново."""
+        self._gen += 1
+        self._loop, self._thread = loop, thread
+        self._sent, self._fired = None, False
+        self._samples.clear(); self._last = self._ewma = 0.0
+
+    def start(self):
+        if self._runner is None or not self._runner.is_alive():
+            self._stop.clear()
+            self._runner = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+            self._runner.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ── замер ─────────────────────────────────────────────────────────────────
+    def _beat(self, gen: int, sent: float):
+        if gen != self._gen:
+            return  # проба от прошлого цикла
+        lag = time.monotonic() - sent
+        self._sent = None
+        self._last = lag
+        self._ewma = lag if not self._samples else self._ewma * 0.8 + lag * 0.2
+        self._samples.append(lag)
+        self._last_ok = time.time()
+        if lag >= self.slow_s:
+            self._stalls += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            loop, sent, gen = self._loop, self._sent, self._gen
+            if loop is None or loop.is_closed() or not loop.is_running():
+                continue
+            if sent is None:
+                self._sent = now = time.monotonic()
+                try:
+                    loop.call_soon_threadsafe(self._beat, gen, now)
+                except RuntimeError:  # цикл закрыли между проверкой и вызовом
+                    self._sent = None
+                continue
+            if not self._fired and time.monotonic() - sent >= self.wedged_s:
+                self._fired = True; self._wedged += 1
+                self.log(f"loop wedged: no heartbeat for {time.monotonic() - sent:.1f}s\n{self.stack()}")
+                if self.on_wedged is not None:
+                    try:
+                        self.on_wedged()
+                    except Exception as e:
+                        self.log(f"loop watchdog: on_wedged failed: {e}")
+
+    # ── чтение ────────────────────────────────────────────────────────────────
+    def lag(self) -> float:
+        sent = self._sent
+        pending = time.monotonic() - sent if sent is not None else 0.0
+        return max(self._last, pending)
+
+    def stack(self) -> str:
+        """Где сейчас стоит поток цикла."""
+        t = self._thread
+        frame = sys._current_frames().get(t.ident) if t is not None and t.ident else None
+        return "".join(traceback.format_stack(frame)) if frame is not None else "(thread is not running)"
+
+    def stats(self) -> dict:
+        s = sorted(self._samples)
+        ms = lambda v: round(v * 1000, 1)
+        return {"lag_ms": ms(self.lag()), "last_ms": ms(self._last), "ewma_ms": ms(self._ewma),
+                "max_ms": ms(s[-1]) if s else 0.0, "p99_ms": ms(s[min(len(s) - 1, int(len(s) * 0.99))]) if s else 0.0,
+                "samples": len(s), "stalls": self._stalls, "wedged": self._wedged,
+                "probe_pending_ms": ms(time.monotonic() - self._sent) if self._sent is not None else None,
+                "last_ok": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self._last_ok)) if self._last_ok else None,
+                "watching": self._runner is not None and self._runner.is_alive()}
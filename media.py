@@ -0,0 +1,210 @@
+## media.py — реестр примеров по разделам чек-листа: локальные картинки + кэш file_id + альбомы
+#
+#   examples/
+#     01/vitrina.jpg, 01/posm.png     — примеры к разделу 1 шаблона default (номер папки = номер раздела)
+#     05/…
+#     urban/02/…                      — примеры к разделу 2 шаблона urban (см. cltemplates)
+#   media_cache.json                  — {"files": {путь: {file_id, sha1, mtime, size}}, "dead": [file_id…]}
+#
+# Локальный файл загружается в Telegram один раз: file_id из ответа кэшируется (ключ — путь + sha1
+# содержимого, так что заменённая картинка уйдёт заново). Несколько примеров раздела уходят одним
+# send_media_group (до 10 на альбом). Если Telegram отверг file_id (протух, другой бот) — кэш сбрасывается
+# для ещё не ушедших примеров, и пересылаются из файлов только они, начиная с отвергнутого альбома (ушедшие
+# раньше альбомы пользователь второй раз не получает); «голые» file_id без файла (seeds) при этом отбрасываются.
+import os
+import json
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+IMAGE_EXT = {".jpg", ".jpeg", ".png", ".webp"}
+DEFAULT_NS = "default"
+ALBUM_MAX = 10
+# признаки «этот file_id больше не годится» в ответе Bot API
+STALE_MARKERS = ("wrong file identifier", "wrong remote file", "file reference", "failed to get http url content",
+                 "wrong type of the web page content")
+
+
+def _sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_stale_error(e: Exception) -> bool:
+    return isinstance(e, BadRequest) and any(m in str(e).lower() for m in STALE_MARKERS)
+
+
+class MediaRegistry:
+    """(шаблон, section 0-based) → список примеров; send() шлёт их одним альбомом и дописывает кэш.
+
+    seeds — file_id без локального файла, относятся к шаблону default.
+    """
+
+    def __init__(self, root: Path, cache_path: Path, seeds: dict[int, list[str]] | None = None, log=print):
+        self.root = Path(root)
+        self.cache_path = Path(cache_path)
+        self.seeds = {(DEFAULT_NS, int(k)): list(v) for k, v in (seeds or {}).items()}
+        self.log = log
+        self._lock = threading.Lock()
+        self._send_locks: dict[tuple[str, int], asyncio.Lock] = {}
+        self.files: dict[tuple[str, int], list[Path]] = {}
+        self.cache: dict[str, dict] = {}
+        self.dead: set[str] = set()
+        self.stats = {"sent": 0, "uploaded": 0, "cached_hits": 0, "invalidated": 0}
+        self.load()
+
+    # ── загрузка/сохранение ───────────────────────────────────────────────────
+    def load(self):
+        data = {}
+        try:
+            if self.cache_path.exists():
+                data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except ValueError as e:
+            self.log(f"media cache unreadable, starting empty: {e}")
+        self.cache = data.get("files", {})
+        self.dead = set(data.get("dead", []))
+        self.scan()
+
+    def scan(self) -> int:
+        """Перечитать папку примеров (после добавления картинок). Возвращает число файлов."""
+        files: dict[tuple[str, int], list[Path]] = {}
+
+        def sections(ns: str, base: Path):
+            for d in sorted(base.iterdir()):
+                if d.is_dir() and d.name.isdigit() and int(d.name) > 0:
+                    imgs = sorted(p for p in d.iterdir() if p.suffix.lower() in IMAGE_EXT)
+                    if imgs:
+                        files[(ns, int(d.name) - 1)] = imgs
+                elif d.is_dir() and ns == DEFAULT_NS and not d.name.isdigit():
+                    sections(d.name, d)
+        if self.root.is_dir():
+            sections(DEFAULT_NS, self.root)
+        self.files = files
+        return sum(len(v) for v in files.values())
+
+    def _save(self):
+        with self._lock:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"files": self.cache, "dead": sorted(self.dead)}, ensure_ascii=False, indent=1),
+                           encoding="utf-8")
+            os.replace(tmp, self.cache_path)
+
+    # ── запросы ───────────────────────────────────────────────────────────────
+    def _key(self, path: Path) -> str:
+        return path.relative_to(self.root).as_posix()
+
+    def items(self, section: int, ns: str = DEFAULT_NS) -> list[tuple[str | None, Path | None, str | None]]:
+        """[(ключ кэша, файл, file_id)] — локальные файлы (с file_id, если он ещё действителен), затем seeds."""
+        out = []
+        for p in self.files.get((ns, section), []):
+            key = self._key(p)
+            out.append((key, p, self._cached_id(key, p)))
+        out += [(None, None, fid) for fid in self.seeds.get((ns, section), []) if fid not in self.dead]
+        return out
+
+    def _cached_id(self, key: str, path: Path) -> str | None:
+        ent = self.cache.get(key)
+        if not ent:
+            return None
+        st = path.stat()
+        if ent.get("mtime") == st.st_mtime_ns and ent.get("size") == st.st_size:
+            return ent["file_id"]
+        if ent.get("sha1") == _sha1(path):  # файл «тронули», но содержимое то же
+            ent["mtime"], ent["size"] = st.st_mtime_ns, st.st_size
+            return ent["file_id"]
+        return None
+
+    def has(self, section: int, ns: str = DEFAULT_NS) -> bool:
+        return bool(self.files.get((ns, section))) or any(f not in self.dead for f in self.seeds.get((ns, section), []))
+
+    def sections(self) -> dict[str, list[int]]:
+        out: dict[str, list[int]] = {}
+        for ns, s in sorted(set(self.files) | set(self.seeds)):
+            if self.has(s, ns):
+                out.setdefault(ns, []).append(s)
+        return out
+
+    def invalidate(self, section: int | None = None, ns: str = DEFAULT_NS):
+        """Сбросить кэш file_id раздела (или всех) — следующая отправка загрузит файлы заново."""
+        paths = {self._key(p) for p in self.files.get((ns, section), [])}
+        keys = [k for k in self.cache if section is None or k in paths]
+        for k in keys:
+            self.cache.pop(k, None)
+        self.stats["invalidated"] += len(keys)
+        self._save()
+
+    def reset_locks(self):
+        """Замки отправки привязаны к циклу asyncio — после пересборки цикла начинаем с новых."""
+        self._send_locks = {}
+
+    # ── отправка ──────────────────────────────────────────────────────────────
+    async def send(self, bot, chat_id: int, section: int, caption: str | None = None, ns: str = DEFAULT_NS) -> int:
+        """Отправить примеры раздела. Возвращает число отправленных фото (0 — примеров нет)."""
+        lock = self._send_locks.setdefault((ns, section), asyncio.Lock())
+        async with lock:  # два аудитора разом не должны загрузить один файл дважды
+            items = self.items(section, ns)
+            if not items:
+                return 0
+            done = [0]  # сколько примеров уже ушло (целыми альбомами)
+            try:
+                await self._send_items(bot, chat_id, items, caption, done)
+            except BadRequest as e:
+                if not is_stale_error(e):
+                    raise
+                self.log(f"media: stale file_id in {ns} section {section + 1} ({e}); re-uploading")
+                rest = items[done[0]:]
+                keys = [key for key, _, _ in rest if key is not None and self.cache.pop(key, None)]
+                self.stats["invalidated"] += len(keys)
+                dropped = [fid for key, _, fid in rest if key is None]
+                retry = [(key, p, None) for key, p, _ in rest if p is not None]
+                if not retry:
+                    self.dead.update(dropped); self._save()
+                    raise
+                self._save()
+                await self._send_items(bot, chat_id, retry, caption if not done[0] else None, done)
+                if dropped:  # альбом из одних файлов прошёл — виноваты seeds
+                    self.dead.update(dropped); self._save()
+            self.stats["sent"] += done[0]
+            return done[0]
+
+    async def _send_items(self, bot, chat_id: int, items: list, caption: str | None, done: list[int]):
+        """done[0] растёт после каждого ушедшего альбома — по нему send() продолжает с отвергнутого."""
+        changed = False
+        try:
+            for start in range(0, len(items), ALBUM_MAX):
+                chunk = items[start:start + ALBUM_MAX]
+                handles = []
+                try:
+                    media = []
+                    for key, path, fid in chunk:
+                        if fid is None:
+                            fh = path.open("rb"); handles.append(fh); src = fh
+                        else:
+                            src = fid; self.stats["cached_hits"] += 1
+                        cap = caption if (start == 0 and not media) else None
+                        media.append((src, cap))
+                    if len(media) == 1:
+                        msgs = [await bot.send_photo(chat_id, photo=media[0][0], caption=media[0][1])]
+                    else:
+                        msgs = await bot.send_media_group(chat_id, [InputMediaPhoto(src, caption=cap) for src, cap in media])
+                finally:
+                    for fh in handles:
+                        fh.close()
+                for (key, path, fid), msg in zip(chunk, msgs):
+                    if fid is None and key is not None and msg.photo:
+                        st = path.stat()
+                        self.cache[key] = {"file_id": msg.photo[-1].file_id, "sha1": _sha1(path),
+                                           "mtime": st.st_mtime_ns, "size": st.st_size}
+                        self.stats["uploaded"] += 1; changed = True
+                done[0] += len(chunk)
+        finally:
+            if changed:  # и если отвергнут следующий альбом: загруженное до него уже в Telegram
+                self._save()
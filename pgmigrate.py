@@ -0,0 +1,202 @@
+## pgmigrate.py — перенос состояния бота (staff / subs / pending) и истории прогонов в Postgres
+#
+# Всё идёт через COPY во временные staging-таблицы и затем INSERT … ON CONFLICT, поэтому повторный запуск
+# ничего не дублирует. История прогонов льётся пачками, каждая пачка — своя транзакция; курсор (ts последней
+# перенесённой записи) сохраняется в migration_progress, так что прерванный перенос продолжается с места
+# остановки, а повторный — докачивает только новые прогоны. Каждый арендатор (tenants.py) переносится своим
+# запуском: строки помечаются его tenant, «лишнее» удаляется только в его пределах, прогресс — свой.
+import time
+from itertools import islice
+from typing import Callable, Iterable
+
+from psycopg.types.json import Jsonb
+
+from profile_model import Profile
+
+LOCK_KEY = 0x636C6D67  # pg_advisory_lock: один перенос за раз
+STEPS = ("stores", "users", "subscriptions", "pending", "runs")
+
+PROGRESS_SQL = """
+CREATE TABLE IF NOT EXISTS migration_progress (
+  step TEXT PRIMARY KEY,
+  position BIGINT NOT NULL DEFAULT 0,
+  cursor TEXT,
+  rows BIGINT NOT NULL DEFAULT 0,
+  done BOOLEAN NOT NULL DEFAULT false,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+class MigrationBusy(RuntimeError):
+    pass
+
+
+def _copy(cur, table: str, columns: tuple, rows: Iterable[tuple]) -> int:
+    n = 0
+    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as cp:
+        for row in rows:
+            cp.write_row(row); n += 1
+    return n
+
+
+def _stage(cur, name: str, definition: str, columns: tuple, rows) -> int:
+    """definition — имя таблицы-образца или явный список колонок "(a int, b text)".
+    С образца берутся и DEFAULT: колонки вне COPY (created_at NOT NULL DEFAULT now()) иначе останутся NULL."""
+    if not definition.startswith("("):
+        definition = f"(LIKE {definition} INCLUDING DEFAULTS)"
+    cur.execute(f"CREATE TEMP TABLE {name} {definition} ON COMMIT DROP")
+    return _copy(cur, name, columns, rows)
+
+
+def _progress(cur, step: str) -> tuple[int, str | None]:
+    cur.execute("SELECT position, cursor FROM migration_progress WHERE step = %s", (step,))
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def _mark(cur, step: str, position: int, rows: int, done: bool, cursor: str | None = None):
+    cur.execute("""INSERT INTO migration_progress(step, position, cursor, rows, done) VALUES (%s, %s, %s, %s, %s)
+                   ON CONFLICT (step) DO UPDATE SET position = EXCLUDED.position,
+                     cursor = COALESCE(EXCLUDED.cursor, migration_progress.cursor),
+                     rows = migration_progress.rows + EXCLUDED.rows, done = EXCLUDED.done, updated_at = now()""",
+                (step, position, cursor, rows, done))
+
+
+def run_key(rec: dict) -> str:
+    """Естественный ключ записи лога прогонов (ts|store|auditor) — по нему повторный перенос не дублирует."""
+    return f"{rec['ts']}|{rec['store']}|{rec.get('auditor')}"
+
+
+class Migrator:
+    def __init__(self, conn, state: dict, runs: Callable[[str | None], Iterable[dict]], store_names: dict[str, str],
+                 batch: int = 50_000, progress: Callable[[str, int], None] | None = None, tenant: str = "default"):
+        self.conn = conn
+        self.state = state            # {"staff": {uid: dict}, "subs": {uid: [codes | "*"]}, "pending": {...}}
+        self.runs = runs              # runs(since_iso) → записи лога прогонов с ts >= since, по возрастанию ts
+        self.store_names = store_names
+        self.batch = batch
+        self.report = progress or (lambda step, n: None)
+        self.stats: dict[str, dict] = {}
+        self.tenant = tenant
+
+    def _key(self, step: str) -> str:
+        """Ключ шага в migration_progress (у основного бота — без префикса, как до арендаторов)."""
+        return step if self.tenant == "default" else f"{self.tenant}:{step}"
+
+    def run(self, restart: bool = False) -> dict:
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                self.conn.rollback()
+                raise MigrationBusy("migration already running")
+            try:
+                cur.execute(PROGRESS_SQL)
+                if restart:
+                    cur.execute("DELETE FROM migration_progress WHERE step = ANY(%s)", ([self._key(s) for s in STEPS],))
+                self.conn.commit()
+                for step in STEPS:
+                    t0 = time.monotonic()
+                    rows = getattr(self, f"_step_{step}")(cur)
+                    self.stats[step] = {"rows": rows, "seconds": round(time.monotonic() - t0, 2)}
+            except BaseException:
+                self.conn.rollback()
+                raise
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+                self.conn.commit()
+        return self.stats
+
+    # ── шаги ──────────────────────────────────────────────────────────────────
+    def _step_stores(self, cur) -> int:
+        codes = set(self.store_names)
+        for p in self.state["staff"].values():
+            codes.update(p.get("stores") or [])
+            if p.get("current_store"): codes.add(p["current_store"])
+        for subs in self.state["subs"].values():
+            codes.update(c for c in subs if c != "*")
+        n = _stage(cur, "stg_stores", "stores", ("tenant", "code", "name"),
+                   ((self.tenant, c, self.store_names.get(c, c)) for c in sorted(codes)))
+        cur.execute("""INSERT INTO stores(tenant, code, name) SELECT tenant, code, name FROM stg_stores
+                       ON CONFLICT (tenant, code) DO UPDATE SET name = EXCLUDED.name
+                       WHERE stores.name IS DISTINCT FROM EXCLUDED.name""")
+        _mark(cur, self._key("stores"), n, n, True); self.conn.commit()
+        self.report("stores", n)
+        return n
+
+    def _user_rows(self):
+        subs = self.state["subs"]
+        for uid, d in self.state["staff"].items():
+            p = Profile.from_dict(d) if isinstance(d, dict) else d
+            yield (self.tenant, int(uid), p.role if p.role in ("admin", "auditor", "viewer") else "viewer",
+                   p.current_store, p.username, p.name, p.tz, list(p.stores), int(p.flags), "*" in subs.get(uid, ()))
+        for uid, codes in subs.items():  # подписчики без профиля (такое бывало в старом subs.json)
+            if uid not in self.state["staff"]:
+                yield (self.tenant, int(uid), "viewer", None, None, None, None, [], 0, "*" in codes)
+
+    def _step_users(self, cur) -> int:
+        cols = ("tenant", "user_id", "role", "default_store", "username", "full_name", "tz", "stores", "flags", "follow_all")
+        n = _stage(cur, "stg_users", "users", cols, self._user_rows())
+        cur.execute(f"""INSERT INTO users({', '.join(cols)}) SELECT {', '.join(cols)} FROM stg_users
+                        ON CONFLICT (tenant, user_id) DO UPDATE SET
+                          {', '.join(f'{c} = EXCLUDED.{c}' for c in cols[2:])}""")
+        _mark(cur, self._key("users"), n, n, True); self.conn.commit()
+        self.report("users", n)
+        return n
+
+    def _step_subscriptions(self, cur) -> int:
+        rows = ((self.tenant, int(uid), c) for uid, codes in self.state["subs"].items() for c in codes if c != "*")
+        n = _stage(cur, "stg_subs", "subscriptions", ("tenant", "user_id", "store_code"), rows)
+        # JSON — источник правды: лишние подписки арендатора в БД убираем
+        cur.execute("""DELETE FROM subscriptions s WHERE s.tenant = %s AND NOT EXISTS
+                       (SELECT 1 FROM stg_subs t WHERE t.user_id = s.user_id AND t.store_code = s.store_code)""",
+                    (self.tenant,))
+        cur.execute("""INSERT INTO subscriptions(tenant, user_id, store_code) SELECT tenant, user_id, store_code FROM stg_subs
+                       ON CONFLICT DO NOTHING""")
+        _mark(cur, self._key("subscriptions"), n, n, True); self.conn.commit()
+        self.report("subscriptions", n)
+        return n
+
+    def _step_pending(self, cur) -> int:
+        rows = ((self.tenant, str(k), Jsonb(v)) for k, v in self.state["pending"].items())
+        n = _stage(cur, "stg_pending", "pending_requests", ("tenant", "req_id", "payload"), rows)
+        cur.execute("""INSERT INTO pending_requests(tenant, req_id, payload) SELECT tenant, req_id, payload FROM stg_pending
+                       ON CONFLICT (tenant, req_id) DO UPDATE SET payload = EXCLUDED.payload""")
+        cur.execute("""DELETE FROM pending_requests p WHERE p.tenant = %s
+                       AND NOT EXISTS (SELECT 1 FROM stg_pending t WHERE t.req_id = p.req_id)""", (self.tenant,))
+        _mark(cur, self._key("pending"), n, n, True); self.conn.commit()
+        self.report("pending", n)
+        return n
+
+    def _step_runs(self, cur) -> int:
+        step = self._key("runs")
+        position, cursor = _progress(cur, step)
+        cols = ("tenant", "source_key", "store_code", "auditor_id", "status", "started_at", "finished_at", "items_done",
+                "items_total", "template")
+        stg = ("(tenant text, source_key text, store_code text, auditor_id bigint, status text, started_at timestamptz, "
+               "finished_at timestamptz, items_done int, items_total int, template text)")
+        # записи с ts == cursor читаются повторно — их отсеет уникальный source_key
+        it = iter(self.runs(cursor))
+        total = 0
+        while True:
+            chunk = list(islice(it, self.batch))
+            if not chunk:
+                break
+            rows = ((self.tenant, run_key(r), r["store"], r.get("auditor"), "finished", r["ts"], r["ts"],
+                     r.get("done"), r.get("total"), r.get("tpl")) for r in chunk)
+            _stage(cur, "stg_runs", stg, cols, rows)
+            # магазины/аудиторы, которых уже нет в staff, — заглушки, чтобы не нарушить внешние ключи
+            cur.execute("""INSERT INTO stores(tenant, code, name) SELECT DISTINCT tenant, store_code, store_code FROM stg_runs
+                           ON CONFLICT DO NOTHING""")
+            cur.execute("""INSERT INTO users(tenant, user_id, role) SELECT DISTINCT tenant, auditor_id, 'auditor' FROM stg_runs
+                           WHERE auditor_id IS NOT NULL ON CONFLICT DO NOTHING""")
+            # прогон без аудитора (старые записи) переносится с NULL: auditor_id допускает NULL с миграции 3
+            cur.execute(f"""INSERT INTO checklist_runs({', '.join(cols)}) SELECT {', '.join(cols)} FROM stg_runs
+                            ON CONFLICT (tenant, source_key) DO NOTHING""")
+            inserted = cur.rowcount
+            position += len(chunk); total += inserted
+            cursor = max(cursor or "", max(r["ts"] for r in chunk))
+            _mark(cur, step, position, inserted, False, cursor); self.conn.commit()
+            self.report("runs", position)
+        _mark(cur, step, position, 0, True); self.conn.commit()
+        return total
@@ -0,0 +1,206 @@
+## profile_model.py — компактный профиль сотрудника вместо свободного dict
+#
+# Поля — __slots__ (без __dict__ на каждый профиль), повторяющиеся строки (роль, таймзона, коды магазинов)
+# интернируются, булевы признаки — один IntFlag. Снаружи Profile ведёт себя как старый dict
+# (prof["role"], prof.get(...), "tz" in prof, prof.pop("approved", None)), поэтому хендлеры не меняются,
+# а на диск/в БД уходит тот же JSON, что и раньше (to_dict/from_dict, to_db_row/from_db_row). Базовые ключи
+# (role, stores, current_store, username, name, tz) to_dict пишет всегда: полный профиль проходит
+# from_dict → to_dict без изменений, неполный старый dict дополняется значениями по умолчанию.
+import sys
+from enum import IntFlag
+
+DEFAULT_TZ = "Europe/Moscow"
+_intern = sys.intern
+_MISSING = object()
+
+
+class Flag(IntFlag):
+    INACTIVE = 1
+    APPROVED = 2
+    AWAITING_APPROVAL = 4
+
+
+# ключ профиля -> бит (внутри хранится int: операции над IntFlag в горячем пути заметно дороже)
+FLAG_KEYS = {"inactive": int(Flag.INACTIVE), "approved": int(Flag.APPROVED),
+             "awaiting_approval": int(Flag.AWAITING_APPROVAL)}
+# строковые поля в порядке старого dict; intended_role — необязательное (None = ключа нет)
+STR_FIELDS = ("role", "current_store", "username", "name", "tz")
+_INTERNED = frozenset(("role", "current_store", "tz", "intended_role"))
+
+
+def _istr(v):
+    return _intern(v) if type(v) is str else v
+
+
+class Profile:
+    __slots__ = ("role", "stores", "current_store", "username", "name", "tz", "intended_role", "_flags", "extra")
+
+    def __init__(self, role="viewer", stores=(), current_store=None, username="", name="", tz=DEFAULT_TZ,
+                 intended_role=None, flags=Flag(0), extra=None):
+        self.role = _istr(role)
+        self.stores = [_intern(c) for c in stores]
+        self.current_store = _istr(current_store)
+        self.username = username
+        self.name = name
+        self.tz = _istr(tz)
+        self.intended_role = _istr(intended_role)
+        self._flags = int(flags)
+        self.extra = extra  # dict | None — ключи, которых нет в модели (старые/экспериментальные)
+
+    # ── (де)сериализация ──────────────────────────────────────────────────────
+    @classmethod
+    def from_dict(cls, d: dict) -> "Profile":
+        p = cls.__new__(cls)
+        p.role = _istr(d.get("role", "viewer"))
+        st = d.get("stores")
+        p.stores = [_intern(c) for c in st] if st else []
+        p.current_store = _istr(d.get("current_store"))
+        p.username = d.get("username", "")
+        p.name = d.get("name", "")
+        p.tz = _istr(d.get("tz", DEFAULT_TZ))
+        p.intended_role = _istr(d.get("intended_role"))
+        flags = 0
+        extra = None
+        for key, v in d.items():
+            f = FLAG_KEYS.get(key)
+            if f is not None:
+                if v is True:
+                    flags |= f
+                else:
+                    extra = extra or {}; extra[key] = v
+            elif key not in _KNOWN:
+                extra = extra or {}; extra[key] = v
+        p._flags = flags
+        p.extra = extra
+        return p
+
+    @classmethod
+    def from_row(cls, role, stores, current_store, username, name, tz, intended_role, flags, extra) -> "Profile":
+        """Сборка из колонок бинарного снапшота (statefile): коды магазинов там уже общие на весь файл."""
+        p = cls.__new__(cls)
+        p.role = _istr(role); p.stores = stores; p.current_store = _istr(current_store)
+        p.username = username; p.name = name; p.tz = _istr(tz)
+        p.intended_role = _istr(intended_role); p._flags = flags; p.extra = extra
+        return p
+
+    def to_dict(self) -> dict:
+        """Базовые ключи — всегда (отсутствовавшие в исходном dict — со значениями по умолчанию), остальные — если заданы."""
+        d = {"role": self.role, "stores": list(self.stores), "current_store": self.current_store,
+             "username": self.username, "name": self.name, "tz": self.tz}
+        if self.intended_role is not None:
+            d["intended_role"] = self.intended_role
+        flags = self._flags
+        if flags:
+            for key, f in FLAG_KEYS.items():
+                if flags & f:
+                    d[key] = True
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def to_db_row(self, uid: int) -> tuple:
+        """(user_id, role, default_store) — строка таблицы users."""
+        return (uid, self.role, self.current_store)
+
+    @classmethod
+    def from_db_row(cls, row) -> "Profile":
+        _, role, default_store = row[:3]
+        return cls(role=role, stores=[], current_store=default_store)
+
+    @property
+    def flags(self) -> Flag:
+        return Flag(self._flags)
+
+    @flags.setter
+    def flags(self, value: Flag):
+        self._flags = int(value)
+
+    # ── совместимость со старым dict ──────────────────────────────────────────
+    def __getitem__(self, key):
+        v = self.get(key, _MISSING)
+        if v is _MISSING:
+            raise KeyError(key)
+        return v
+
+    def get(self, key, default=None):
+        if key in _SLOT_KEYS:
+            if key == "intended_role" and self.intended_role is None:
+                return default
+            return getattr(self, key)
+        f = FLAG_KEYS.get(key)
+        if f is not None and self._flags & f:
+            return True
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        return default
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, value):
+        if key in _SLOT_KEYS:
+            if key == "stores":
+                value = [_intern(c) for c in value]
+            elif key in _INTERNED:
+                value = _istr(value)
+            setattr(self, key, value)
+            return
+        f = FLAG_KEYS.get(key)
+        if f is not None and value is True:
+            self._flags |= f
+            if self.extra: self.extra.pop(key, None)
+            return
+        if f is not None:
+            self._flags &= ~f
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def pop(self, key, default=_MISSING):
+        v = self.get(key, _MISSING)
+        if v is _MISSING:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        if key == "intended_role":
+            self.intended_role = None
+        elif key in _SLOT_KEYS:
+            # базовый ключ удалить нельзя (to_dict пишет его всегда) — как у dict, отдаём значение,
+            # а поле возвращается к значению по умолчанию, как у профиля, где ключа не было
+            self[key] = _SLOT_DEFAULTS[key]
+        elif key in FLAG_KEYS and v is True:
+            self._flags &= ~FLAG_KEYS[key]
+        else:
+            del self.extra[key]
+        return v
+
+    def setdefault(self, key, default=None):
+        v = self.get(key, _MISSING)
+        if v is _MISSING:
+            self[key] = default
+            return self.get(key)
+        return v
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Profile):
+            other = other.to_dict()
+        return self.to_dict() == other if isinstance(other, dict) else NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Profile({self.to_dict()!r})"
+
+
+_SLOT_KEYS = frozenset(STR_FIELDS + ("stores", "intended_role"))
+_SLOT_DEFAULTS = {"role": "viewer", "stores": (), "current_store": None, "username": "", "name": "", "tz": DEFAULT_TZ}
+_KNOWN = _SLOT_KEYS | FLAG_KEYS.keys()
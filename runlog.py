@@ -0,0 +1,332 @@
+## runlog.py — лог прогонов чек-листа сегментами вместо одного бесконечного check_runs.jsonl
+#
+#   runs/
+#     manifest.json                       — закрытые сегменты: файл, диапазон ts, набор магазинов, число записей
+#     runs-20261019-000.jsonl             — активный сегмент (дописывается)
+#     runs-20261018-000.jsonl.gz|.zst     — закрытые сегменты (сжаты)
+#
+# Ротация — по дню (UTC) и/или по размеру; читатели открывают только сегменты, пересекающиеся с окном
+# (и содержащие нужные магазины). Сегменты старше retention_days удаляются при ротации.
+#
+# append только запечатывает старый сегмент (дёшево — он вызывается из цикла PTB); сжимает compress_sealed(),
+# которую приложение зовёт в потоке. Порядок сжатия: .part → .gz/.zst → manifest.json → удалить исходник,
+# так что после падения на любом шаге _load находит либо исходник (сожмёт заново), либо запись в манифесте.
+import os
+import io
+import gzip
+import json
+import threading
+import importlib.util
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+from statestore import trim_torn_tail
+
+MANIFEST = "manifest.json"
+
+
+def _zstd():
+    if importlib.util.find_spec("zstandard") is None:
+        return None
+    import zstandard
+    return zstandard
+
+
+def pick_codec(name: str = "auto") -> str:
+    """auto → zstd, если установлен zstandard, иначе gzip; none — не сжимать."""
+    if name == "auto":
+        return "zstd" if _zstd() else "gzip"
+    if name == "zstd" and not _zstd():
+        return "gzip"
+    return name if name in ("zstd", "gzip", "none") else "gzip"
+
+
+_SUFFIX = {"zstd": ".zst", "gzip": ".gz", "none": ""}
+
+
+def _ts(iso: str) -> datetime:
+    return datetime.fromisoformat(iso).astimezone(timezone.utc)
+
+
+def _iso(ts: datetime) -> str:
+    return ts.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+
+def read_legacy(path: Path, since: datetime | None = None):
+    """Записи старого check_runs.jsonl (битые строки пропускаются) — только чтение, файл не трогается."""
+    with Path(path).open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line); ts = _ts(rec["ts"]); rec["store"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            if since and ts < since:
+                continue
+            yield rec
+
+
+def _open_read(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.suffix == ".zst":
+        return io.TextIOWrapper(_zstd().ZstdDecompressor().stream_reader(path.open("rb")), encoding="utf-8")
+    return path.open("r", encoding="utf-8")
+
+
+class _Seg:
+    """Метаданные сегмента (для активного — считаются на лету)."""
+    __slots__ = ("file", "day", "first", "last", "stores", "count", "bytes")
+
+    def __init__(self, file: str, day: str, first=None, last=None, stores=(), count=0, size=0):
+        self.file, self.day = file, day
+        self.first, self.last = first, last
+        self.stores = set(stores); self.count = count; self.bytes = size
+
+    def add(self, rec: dict, size: int):
+        ts = rec["ts"]
+        if self.first is None or ts < self.first: self.first = ts
+        if self.last is None or ts > self.last: self.last = ts
+        self.stores.add(rec["store"]); self.count += 1; self.bytes += size
+
+    def overlaps(self, since: str | None, until: str | None, stores) -> bool:
+        if self.first is None:
+            return False
+        if since and self.last < since: return False
+        if until and self.first > until: return False
+        return not stores or bool(self.stores & stores)
+
+    def to_json(self) -> dict:
+        return {"file": self.file, "day": self.day, "from": self.first, "to": self.last,
+                "stores": sorted(self.stores), "count": self.count, "bytes": self.bytes}
+
+    @classmethod
+    def from_json(cls, d: dict) -> "_Seg":
+        return cls(d["file"], d["day"], d["from"], d["to"], d["stores"], d["count"], d["bytes"])
+
+
+class RunLog:
+    def __init__(self, root: Path, rotate: str = "daily", max_bytes: int = 16 << 20,
+                 codec: str = "auto", retention_days: int = 365):
+        self.root = Path(root)
+        self.rotate = rotate            # daily | size (size-ротация работает и в режиме daily)
+        self.max_bytes = max_bytes
+        self.codec = pick_codec(codec)
+        self.retention_days = retention_days  # 0 — хранить всё
+        self.segments: list[_Seg] = []  # закрытые, по возрастанию
+        self.sealed: list[_Seg] = []    # закрытые, но ещё не сжатые (нет в манифесте)
+        self.active: _Seg | None = None
+        self._lock = threading.Lock()
+        self._compress_lock = threading.Lock()
+        self._loaded = False
+        self._tail_checked = False
+
+    # ── манифест / активный сегмент ───────────────────────────────────────────
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        man = self.root / MANIFEST
+        if man.exists():
+            raw = json.loads(man.read_text(encoding="utf-8"))
+            self.segments = [_Seg.from_json(d) for d in raw.get("segments", [])]
+        for part in self.root.glob("runs-*.part"):
+            part.unlink()  # сжатие оборвалось — исходник цел
+        closed = {s.file for s in self.segments}
+        for path in sorted(self.root.glob("runs-*.jsonl.*")):
+            if path.name in closed:
+                continue
+            if path.with_suffix("").exists():
+                path.unlink()  # сжат, но в манифест не попал — сожмём исходник заново
+            else:  # манифест старого формата потерял сегмент — подбираем
+                self.segments.append(self._scan(path)); closed.add(path.name)
+                self.segments.sort(key=lambda s: (s.first or "", s.file))
+                self._write_manifest()
+        # несжатые *.jsonl вне манифеста: последний — активный, остальные ждут сжатия
+        for path in sorted(self.root.glob("runs-*.jsonl")):
+            if path.name in closed:
+                continue
+            if any(path.name + sfx in closed for sfx in _SUFFIX.values() if sfx):
+                path.unlink(); continue  # манифест уже записан, упали до удаления исходника
+            if self.active is not None:
+                self.sealed.append(self.active)
+            self.active = self._scan(path)
+
+    def _scan(self, path: Path) -> _Seg:
+        seg = _Seg(path.name, path.name[5:13])
+        with _open_read(path) as f:
+            for line in f:
+                try:
+                    seg.add(json.loads(line), len(line.encode("utf-8")))
+                except (ValueError, KeyError):
+                    continue
+        if path.suffix != ".jsonl":
+            seg.bytes = path.stat().st_size
+        return seg
+
+    def _write_manifest(self):
+        tmp = self.root / (MANIFEST + ".tmp")
+        tmp.write_text(json.dumps({"codec": self.codec, "segments": [s.to_json() for s in self.segments]},
+                                  ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.root / MANIFEST)
+
+    def _new_active(self, day: str) -> _Seg:
+        n = 0
+        while (self.root / f"runs-{day}-{n:03d}.jsonl").exists() or any(
+                s.file.startswith(f"runs-{day}-{n:03d}.") for s in self.segments):
+            n += 1
+        return _Seg(f"runs-{day}-{n:03d}.jsonl", day)
+
+    def _seal_active(self):
+        """Закрыть активный сегмент без сжатия (под self._lock)."""
+        seg = self.active
+        self.active = None
+        if seg is None:
+            return
+        if not seg.count:
+            (self.root / seg.file).unlink(missing_ok=True); return
+        self.sealed.append(seg)
+
+    def _compress(self, seg: _Seg):
+        """Сжать запечатанный сегмент рядом с исходником (без self._lock — это долго)."""
+        if self.codec == "none":
+            return
+        src = self.root / seg.file
+        dst = src.with_name(src.name + _SUFFIX[self.codec])
+        part = dst.with_name(dst.name + ".part")
+        data = src.read_bytes()
+        if self.codec == "zstd":
+            part.write_bytes(_zstd().ZstdCompressor(level=10).compress(data))
+        else:
+            with gzip.open(part, "wb", compresslevel=6) as f:
+                f.write(data)
+        os.replace(part, dst)
+
+    def compress_sealed(self) -> int:
+        """Сжать запечатанные сегменты и внести их в манифест. Вызывать вне цикла (asyncio.to_thread)."""
+        if not self._compress_lock.acquire(blocking=False):
+            return 0  # уже сжимает другой поток
+        try:
+            with self._lock:
+                self._load()
+                todo = list(self.sealed)
+            for seg in todo:
+                self._compress(seg)
+                src = self.root / seg.file
+                with self._lock:
+                    if self.codec != "none":
+                        dst = src.with_name(src.name + _SUFFIX[self.codec])
+                        seg.file, seg.bytes = dst.name, dst.stat().st_size
+                    self.sealed.remove(seg)
+                    self.segments.append(seg)
+                    self.segments.sort(key=lambda s: (s.first or "", s.file))
+                    self._apply_retention()
+                    self._write_manifest()
+                if self.codec != "none":
+                    src.unlink(missing_ok=True)
+            return len(todo)
+        finally:
+            self._compress_lock.release()
+
+    def _apply_retention(self, now: datetime | None = None):
+        if not self.retention_days:
+            return
+        cutoff = _iso((now or datetime.now(timezone.utc)) - timedelta(days=self.retention_days))
+        keep = []
+        for s in self.segments:
+            if s.last and s.last < cutoff:
+                (self.root / s.file).unlink(missing_ok=True)
+            else:
+                keep.append(s)
+        self.segments = keep
+
+    # ── запись ────────────────────────────────────────────────────────────────
+    def append(self, rec: dict):
+        """rec: {"ts": iso, "store": code, ...}"""
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        day = _ts(rec["ts"]).strftime("%Y%m%d")
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._load()
+            a = self.active
+            if a is not None and ((self.rotate == "daily" and a.day != day) or a.bytes >= self.max_bytes):
+                self._seal_active()
+            if self.active is None:
+                self.active = self._new_active(day)
+            path = self.root / self.active.file
+            if not self._tail_checked:  # обрывок строки после падения — иначе запись приклеится к нему
+                trim_torn_tail(path); self._tail_checked = True
+            with path.open("a", encoding="utf-8") as f:
+                f.write(line)
+            self.active.add(rec, len(line.encode("utf-8")))
+
+    def rotate_now(self):
+        """Закрыть и сжать активный сегмент (например, по расписанию или при остановке)."""
+        with self._lock:
+            self._load()
+            self._seal_active()
+        self.compress_sealed()
+
+    def import_legacy(self, path: Path) -> int:
+        """Разложить старый check_runs.jsonl по сегментам; исходник → *.migrated. Возвращает число записей.
+
+        Исходник переименовывается только в конце; если импорт оборвался раньше, повторный пропускает записи,
+        уже лежащие в сегментах (ключ ts|store|auditor, как в pgmigrate.run_key).
+        """
+        path = Path(path)
+        if not path.exists():
+            return 0
+        first = min((_ts(r["ts"]) for r in read_legacy(path)), default=None)
+        seen = {(r["ts"], r["store"], r.get("auditor")) for r in self.read(since=first)} if first else set()
+        n = 0
+        for rec in read_legacy(path):
+            if (rec["ts"], rec["store"], rec.get("auditor")) in seen:
+                continue
+            self.append(rec); n += 1
+        self.compress_sealed()
+        os.replace(path, path.with_name(path.name + ".migrated"))
+        return n
+
+    # ── чтение ────────────────────────────────────────────────────────────────
+    def read(self, since: datetime | None = None, until: datetime | None = None, stores=None):
+        """Записи из окна [since, until] (и по нужным магазинам), только из пересекающихся сегментов."""
+        s_iso = _iso(since) if since else None
+        u_iso = _iso(until) if until else None
+        stores = set(stores) if stores else None
+        with self._lock:
+            self._load()
+            segs = [s for s in self.segments + self.sealed if s.overlaps(s_iso, u_iso, stores)]
+            if self.active is not None and self.active.overlaps(s_iso, u_iso, stores):
+                segs.append(self.active)
+        for seg in segs:
+            path = self.root / seg.file
+            if not path.exists():
+                continue
+            with _open_read(path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        ts = _ts(rec["ts"])
+                    except (ValueError, KeyError):
+                        continue  # недописанная строка
+                    if (since and ts < since) or (until and ts > until):
+                        continue
+                    if stores and rec.get("store") not in stores:
+                        continue
+                    yield rec
+
+    def last_by_store(self, since: datetime | None = None) -> dict[str, datetime]:
+        last: dict[str, datetime] = {}
+        for rec in self.read(since=since):
+            ts = _ts(rec["ts"]); store = rec["store"]
+            if store not in last or ts > last[store]:
+                last[store] = ts
+        return last
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load()
+            return {"dir": str(self.root.resolve()), "codec": self.codec, "segments": len(self.segments),
+                    "sealed": len(self.sealed),
+                    "bytes": sum(s.bytes for s in self.segments + self.sealed) + (self.active.bytes if self.active else 0),
+                    "active": self.active.file if self.active else None,
+                    "from": self.segments[0].first if self.segments else (self.active.first if self.active else None)}
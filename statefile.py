@@ -0,0 +1,286 @@
+## statefile.py — компактный бинарный снапшот состояния (staff / subs / pending / индекс прогонов)
+#
+# Формат v2 (little-endian; v1 читается — в нём подписки только секцией SUBS):
+#   MAGIC "CLSNAP" | u16 version | затем секции: tag(4) | u32 len | payload
+#   STRS — таблица строк: u32 count + utf-8 строк через \0 (роли/таймзоны/коды/имена — по одному разу);
+#          индекс == count означает None
+#   STAF — профили колонками: uid[q], mask[H], role/cur/user/name/tz/intended[I → STRS], stores offsets+flat
+#   SUBS — подписки: uid[q], offsets[I], codes[I → STRS]
+#   SUBB — то же битовыми масками (v2, пишется вместо SUBS, когда выходит меньше): codes[I → STRS] в порядке
+#          битов (см. subsbits), uid[q], u16 ширина маски в байтах, маски подряд (little-endian)
+#   RUNX — последний прогон по магазину: store[I], ts[I → STRS]
+#   PEND, TOMG, META — JSON (маленькие и редко читаемые)
+# Значения, не ложащиеся в колонки (неизвестные ключи, approved=False и т.п.), уходят в JSON-секцию XTRA,
+# так что JSON → bin → JSON даёт те же данные.
+import gc
+import sys
+import json
+import struct
+from array import array
+from pathlib import Path
+
+from subsbits import bits
+
+MAGIC = b"CLSNAP"
+VERSION = 2
+READABLE = (1, 2)
+NONE = 0xFFFFFFFF  # временная метка None при сборке; в файле заменяется на count таблицы строк
+
+# порядок = номер бита в mask (присутствие ключа в профиле)
+STR_KEYS = ("role", "current_store", "username", "name", "tz", "intended_role")
+FLAG_KEYS = ("inactive", "approved", "awaiting_approval")  # mask >> _FLAG_BIT0 == profile_model.Flag
+_BIT_STORES = 1 << len(STR_KEYS)
+_FLAG_BIT0 = len(STR_KEYS) + 1
+KNOWN_KEYS = frozenset(STR_KEYS + FLAG_KEYS + ("stores",))
+
+_SWAP = sys.byteorder != "little"
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _arr_bytes(typecode: str, values) -> bytes:
+    a = array(typecode, values)
+    if _SWAP:
+        a.byteswap()
+    return struct.pack("<I", len(a)) + a.tobytes()
+
+
+def _arr_read(typecode: str, buf: memoryview, pos: int) -> tuple[array, int]:
+    (n,) = struct.unpack_from("<I", buf, pos); pos += 4
+    a = array(typecode)
+    size = n * a.itemsize
+    a.frombytes(buf[pos:pos + size])
+    if _SWAP:
+        a.byteswap()
+    return a, pos + size
+
+
+class _Strings:
+    def __init__(self):
+        self.index: dict[str, int] = {}
+        self.items: list[str] = []
+
+    def __call__(self, s) -> int:
+        if s is None:
+            return NONE
+        i = self.index.get(s)
+        if i is None:
+            if "\0" in s:
+                raise SnapshotError("NUL in string")
+            i = self.index[s] = len(self.items)
+            self.items.append(s)
+        return i
+
+
+def _section(tag: bytes, payload: bytes) -> bytes:
+    return tag + struct.pack("<I", len(payload)) + payload
+
+
+def _json_bytes(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(state: dict) -> bytes:
+    """state: {"staff": {uid: dict}, "subs": {uid: [codes]}, "pending": {...}, "runs": {store: iso}, "tom": {...}, "seq": int}"""
+    S = _Strings()
+    staff = state.get("staff", {})
+    ids, masks, stores_off, stores_flat = [], [], [0], []
+    cols = {k: [] for k in STR_KEYS}
+    extras: dict[str, dict] = {}
+    for i, (uid, p) in enumerate(staff.items()):
+        mask = 0; extra = {}
+        for b, key in enumerate(STR_KEYS):
+            if key in p:
+                v = p[key]
+                if v is None or isinstance(v, str):
+                    mask |= 1 << b; cols[key].append(S(v)); continue
+                extra[key] = v
+            cols[key].append(NONE)
+        st = p.get("stores")
+        if "stores" in p and isinstance(st, list) and all(isinstance(c, str) for c in st):
+            mask |= _BIT_STORES; stores_flat.extend(S(c) for c in st)
+        elif "stores" in p:
+            extra["stores"] = st
+        stores_off.append(len(stores_flat))
+        for b, key in enumerate(FLAG_KEYS):
+            if key in p:
+                if p[key] is True:
+                    mask |= 1 << (_FLAG_BIT0 + b)
+                else:
+                    extra[key] = p[key]
+        for key, v in p.items():
+            if key not in KNOWN_KEYS:
+                extra[key] = v
+        if extra:
+            extras[str(i)] = extra
+        ids.append(int(uid)); masks.append(mask)
+    subs = state.get("subs", {})
+    subs_b = _subs_bits(subs, S)
+    if subs_b is None:
+        s_ids, s_off, s_flat = [], [0], []
+        for uid, codes in subs.items():
+            s_ids.append(int(uid)); s_flat.extend(S(c) for c in codes); s_off.append(len(s_flat))
+        subs_sec = _section(b"SUBS", _arr_bytes("q", s_ids) + _arr_bytes("I", s_off) + _arr_bytes("I", s_flat))
+    else:
+        subs_sec = _section(b"SUBB", subs_b)
+    runs = state.get("runs", {})
+    run_keys, run_vals = [S(k) for k in runs], [S(v) for v in runs.values()]
+
+    none_idx = len(S.items)
+    fix = lambda col: [none_idx if x == NONE else x for x in col]
+    staf = b"".join([_arr_bytes("q", ids), _arr_bytes("H", masks)]
+                    + [_arr_bytes("I", fix(cols[k])) for k in STR_KEYS]
+                    + [_arr_bytes("I", stores_off), _arr_bytes("I", stores_flat)])
+    runx = _arr_bytes("I", run_keys) + _arr_bytes("I", fix(run_vals))
+
+    strs = "\0".join(S.items).encode("utf-8")
+    out = [MAGIC, struct.pack("<H", VERSION),
+           _section(b"STRS", struct.pack("<I", len(S.items)) + strs),
+           _section(b"STAF", staf), subs_sec, _section(b"RUNX", runx),
+           _section(b"PEND", _json_bytes(state.get("pending", {}))),
+           _section(b"META", _json_bytes({"seq": state.get("seq", 0)}))]
+    if extras:
+        out.append(_section(b"XTRA", _json_bytes(extras)))
+    if "tom" in state:
+        out.append(_section(b"TOMG", _json_bytes(state["tom"])))
+    return b"".join(out)
+
+
+def _subs_bits(subs: dict, S: _Strings) -> bytes | None:
+    """SUBB, если маски короче списков индексов (и списки отсортированы без повторов — иначе не восстановить)."""
+    table, total = set(), 0
+    for codes in subs.values():
+        if any(a >= b for a, b in zip(codes, codes[1:])) or not all(isinstance(c, str) for c in codes):
+            return None
+        table.update(codes); total += len(codes)
+    table = sorted(table)
+    width = (len(table) + 7) // 8
+    if not subs or width * len(subs) >= 4 * (len(subs) + 1 + total):
+        return None
+    bit = {c: i for i, c in enumerate(table)}
+    flat = bytearray()
+    for codes in subs.values():
+        m = 0
+        for c in codes:
+            m |= 1 << bit[c]
+        flat += m.to_bytes(width, "little")
+    return (_arr_bytes("I", [S(c) for c in table]) + _arr_bytes("q", [int(u) for u in subs])
+            + struct.pack("<H", width) + bytes(flat))
+
+
+def _subs_from_bits(sb: memoryview, col) -> dict[int, list[str]]:
+    t, p = _arr_read("I", sb, 0)
+    table = col(t)
+    ids, p = _arr_read("q", sb, p)
+    (width,) = struct.unpack_from("<H", sb, p); p += 2
+    raw = bytes(sb[p:p + width * len(ids)])
+    return {uid: [table[b] for b in bits(int.from_bytes(raw[i * width:(i + 1) * width], "little"))]
+            for i, uid in enumerate(ids)}
+
+
+def loads(data: bytes, profile_cls=None) -> dict:
+    """profile_cls (например profile_model.Profile) — собирать профили сразу объектами, минуя dict."""
+    # сотни тысяч мелких dict/list подряд: циклический GC здесь только мешает (циклов нет)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _loads(data, profile_cls)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _loads(data: bytes, profile_cls) -> dict:
+    buf = memoryview(data)
+    if bytes(buf[:6]) != MAGIC:
+        raise SnapshotError("not a CLSNAP file")
+    (ver,) = struct.unpack_from("<H", buf, 6)
+    if ver not in READABLE:
+        raise SnapshotError(f"unsupported snapshot version {ver}")
+    sections: dict[bytes, memoryview] = {}
+    pos = 8
+    while pos < len(buf):
+        tag = bytes(buf[pos:pos + 4]); (ln,) = struct.unpack_from("<I", buf, pos + 4)
+        sections[tag] = buf[pos + 8:pos + 8 + ln]; pos += 8 + ln
+
+    (count,) = struct.unpack_from("<I", sections[b"STRS"], 0)
+    strs = bytes(sections[b"STRS"][4:]).decode("utf-8").split("\0") if count else []
+    strs.append(None)  # индекс count
+    col = lambda a: list(map(strs.__getitem__, a))
+
+    st = sections[b"STAF"]; p = 0
+    ids, p = _arr_read("q", st, p)
+    masks, p = _arr_read("H", st, p)
+    cols = []
+    for _ in STR_KEYS:
+        a, p = _arr_read("I", st, p); cols.append(col(a))
+    stores_off, p = _arr_read("I", st, p)
+    stores_flat, p = _arr_read("I", st, p)
+    stores_all = col(stores_flat)
+    extras = {int(k): v for k, v in json.loads(bytes(sections[b"XTRA"])).items()} if b"XTRA" in sections else {}
+
+    # быстрый путь: у типичного профиля есть все базовые ключи — собираем dict литералом
+    stores_list = [stores_all[a:b] for a, b in zip(stores_off, stores_off[1:])]
+    flag_bits = [(1 << (_FLAG_BIT0 + b), key) for b, key in enumerate(FLAG_KEYS)]
+    any_flag = sum(bit for bit, _ in flag_bits)
+    base = _BIT_STORES | sum(1 << b for b, key in enumerate(STR_KEYS) if key != "intended_role")
+    intended_bit = 1 << STR_KEYS.index("intended_role")
+    str_bits = [(1 << b, b, key) for b, key in enumerate(STR_KEYS)]
+    staff: dict[int, dict] = {}
+    from_row = profile_cls.from_row if profile_cls is not None else None
+    for i, (uid, m, role, cur, user, name, tz, intended, stores) in enumerate(zip(ids, masks, *cols, stores_list)):
+        if from_row is not None and m & base == base:
+            staff[uid] = from_row(role, stores, cur, user, name, tz, intended if m & intended_bit else None,
+                                  (m >> _FLAG_BIT0) & 7, extras.get(i))
+            continue
+        if m & base == base:
+            prof = {"role": role, "stores": stores, "current_store": cur, "username": user, "name": name, "tz": tz}
+            if m & intended_bit:
+                prof["intended_role"] = intended
+        else:
+            row = (role, cur, user, name, tz, intended)
+            prof = {key: row[b] for bit, b, key in str_bits if m & bit}
+            if m & _BIT_STORES:
+                prof["stores"] = stores
+        if m & any_flag:
+            for bit, key in flag_bits:
+                if m & bit:
+                    prof[key] = True
+        if i in extras:
+            prof.update(extras[i])
+        staff[uid] = profile_cls.from_dict(prof) if profile_cls is not None else prof
+
+    if b"SUBB" in sections:
+        subs = _subs_from_bits(sections[b"SUBB"], col)
+    else:
+        sb = sections[b"SUBS"]; p = 0
+        s_ids, p = _arr_read("q", sb, p)
+        s_off, p = _arr_read("I", sb, p)
+        s_flat, p = _arr_read("I", sb, p)
+        codes = col(s_flat)
+        subs = {uid: codes[s_off[i]:s_off[i + 1]] for i, uid in enumerate(s_ids)}
+
+    rx = sections.get(b"RUNX"); runs = {}
+    if rx is not None:
+        keys, p = _arr_read("I", rx, 0)
+        vals, p = _arr_read("I", rx, p)
+        runs = dict(zip(col(keys), col(vals)))
+
+    state = {
+        "staff": staff, "subs": subs, "runs": runs,
+        "pending": json.loads(bytes(sections[b"PEND"])),
+        "seq": json.loads(bytes(sections[b"META"])).get("seq", 0),
+    }
+    if b"TOMG" in sections:
+        state["tom"] = json.loads(bytes(sections[b"TOMG"]))
+    return state
+
+
+def dump(state: dict, path: Path):
+    Path(path).write_bytes(dumps(state))
+
+
+def load(path: Path, profile_cls=None) -> dict:
+    return loads(Path(path).read_bytes(), profile_cls)
@@ -0,0 +1,289 @@
+## statestore.py — журнал изменений состояния бота (append-only) + периодические снапшоты
+#
+# Каждое изменение — одна строка в events.jsonl: {"seq", "ts", "op", "k", "v", "by"}.
+# Раз в N событий состояние целиком пишется в снапшот, а закрытый журнал уезжает в audit/
+# (история «кто кому поменял роль/подписки» не теряется). Старт = снапшот + хвост журнала.
+#
+# Писатель у каталога один: seq живёт в памяти процесса, а compact уносит events.jsonl из-под чужого
+# открытого файла. Поэтому запись идёт только под эксклюзивным flock на <data_dir>/.writer.lock (acquire);
+# второй процесс на том же каталоге (второй воркер gunicorn) получает StateLocked. Читать (load с
+# compact=False) можно без замка.
+import os
+import json
+import time
+import fcntl
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+import statefile
+
+# op -> (раздел состояния, тип ключа)
+OPS = {
+    "staff.put": ("staff", int), "staff.del": ("staff", int),
+    "pending.put": ("pending", str), "pending.del": ("pending", str),
+    "subs.put": ("subs", int), "subs.del": ("subs", int),
+    "runs.put": ("runs", str),  # последний прогон по магазину: store -> iso ts
+}
+
+
+LOCK_FILE = ".writer.lock"
+
+
+class StateLocked(RuntimeError):
+    pass
+
+
+def trim_torn_tail(path: Path, chunk: int = 4096) -> int:
+    """Отрезать недописанную последнюю строку (падение посреди записи). Возвращает число отрезанных байт.
+
+    Без этого следующая запись приклеилась бы к обрывку, и при чтении пропала бы уже целая строка.
+    """
+    if not path.exists():
+        return 0
+    with path.open("r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk)
+            f.seek(start)
+            nl = f.read(pos - start).rfind(b"\n")
+            if nl >= 0:
+                pos = start + nl + 1
+                break
+            pos = start
+        if pos < end:
+            f.truncate(pos)
+        return end - pos
+
+
+def empty_state() -> dict:
+    # staff: {uid: profile}, pending: {req_id: request}, subs: {uid: [codes | "*"]}, runs: {store: iso}
+    return {"staff": {}, "pending": {}, "subs": {}, "runs": {}}
+
+
+def _read_json_file(path: Path, default):
+    if not path.exists():
+        return default
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def read_legacy(data_dir: Path) -> dict:
+    """staff.json / pending.json / subs.json (формат до журнала) → state.
+
+    В старом subs.json флаг "*" затирал коды в USER_SUBS, а сами коды жили только в STORE_SUBS —
+    здесь они сливаются обратно.
+    """
+    data_dir = Path(data_dir)
+    state = empty_state()
+    state["staff"] = {int(k): v for k, v in _read_json_file(data_dir / "staff.json", {}).items()}
+    state["pending"] = _read_json_file(data_dir / "pending.json", {})
+    raw = _read_json_file(data_dir / "subs.json", {})
+    merged: dict[int, set[str]] = {}
+    for k, v in raw.get("USER_SUBS", {}).items():
+        merged[int(k)] = {"*"} if v == "*" else set(v or [])
+    for code, uids in raw.get("STORE_SUBS", {}).items():
+        for uid in uids:
+            merged.setdefault(int(uid), set()).add(code)
+    state["subs"] = {uid: sorted(codes) for uid, codes in merged.items()}
+    return state
+
+
+def write_legacy(state: dict, out_dir: Path):
+    """Обратная операция к read_legacy (для выгрузки/отката)."""
+    out_dir = Path(out_dir); out_dir.mkdir(parents=True, exist_ok=True)
+    dump = lambda name, obj: (out_dir / name).write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    dump("staff.json", {str(k): v for k, v in state["staff"].items()})
+    dump("pending.json", state["pending"])
+    user_subs, store_subs = {}, {}
+    for uid, codes in state["subs"].items():
+        user_subs[str(uid)] = "*" if "*" in codes else sorted(codes)
+        for code in codes:
+            if code != "*":
+                store_subs.setdefault(code, []).append(int(uid))
+    dump("subs.json", {"USER_SUBS": user_subs, "STORE_SUBS": {c: sorted(u) for c, u in store_subs.items()}})
+
+
+def apply_event(state: dict, ev: dict):
+    section, key_type = OPS[ev["op"]]
+    key = key_type(ev["k"])
+    if ev["op"].endswith(".del"):
+        state[section].pop(key, None)
+    else:
+        state[section][key] = ev["v"]
+
+
+class StateStore:
+    def __init__(self, data_dir: Path, snapshot_every: int = 500, fmt: str = "bin", profile_cls=None):
+        self.data_dir = Path(data_dir)
+        self.events_path = self.data_dir / "events.jsonl"
+        self.fmt = fmt  # "bin" (statefile) | "json"
+        self.profile_cls = profile_cls  # staff из бинарного снапшота — сразу объектами (иначе dict)
+        self.snapshot_path = self.data_dir / ("snapshot.bin" if fmt == "bin" else "snapshot.json")
+        self.audit_dir = self.data_dir / "audit"
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.since_snapshot = 0
+        self._lock = threading.Lock()
+        self._fh = None
+        self._writer = None  # открытый LOCK_FILE под flock, пока этот процесс — писатель каталога
+
+    # ── единственный писатель ─────────────────────────────────────────────────
+    def acquire(self, wait: float = 0.0):
+        """Стать писателем каталога. wait — сколько ждать, пока замок отпустит уходящий процесс (рестарт воркера)."""
+        if self._writer is not None:
+            return
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        fh = (self.data_dir / LOCK_FILE).open("a+", encoding="utf-8")
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    fh.seek(0); owner = fh.read().strip() or "?"
+                    fh.close()
+                    raise StateLocked(f"{self.data_dir} is written by another process (pid {owner}); "
+                                      f"run a single worker per DATA_DIR")
+                time.sleep(0.2)
+        fh.seek(0); fh.truncate(); fh.write(f"{os.getpid()}\n"); fh.flush()
+        self._writer = fh
+
+    # ── чтение ────────────────────────────────────────────────────────────────
+    def _read_snapshot(self) -> dict | None:
+        bin_path, json_path = self.data_dir / "snapshot.bin", self.data_dir / "snapshot.json"
+        if bin_path.exists():
+            raw = statefile.load(bin_path, self.profile_cls)
+            state = empty_state()
+            for key in state:
+                state[key] = raw.get(key, {})
+            self.snapshot_seq = int(raw.get("seq", 0))
+            return state
+        if not json_path.exists():
+            return None
+        raw = json.loads(json_path.read_text(encoding="utf-8"))
+        state = empty_state()
+        state["staff"] = {int(k): v for k, v in raw.get("staff", {}).items()}
+        state["pending"] = dict(raw.get("pending", {}))
+        state["subs"] = {int(k): v for k, v in raw.get("subs", {}).items()}
+        state["runs"] = dict(raw.get("runs", {}))
+        self.snapshot_seq = int(raw.get("seq", 0))
+        return state
+
+    def load(self, legacy=None, compact: bool = True) -> dict:
+        """Снапшот + хвост журнала. legacy() → state используется один раз, если снапшота ещё нет.
+
+        compact=False — только чтение (другой процесс рядом с живым ботом): переезд со старых файлов
+        не записывается, журнал остаётся на месте.
+        """
+        state = self._read_snapshot()
+        fresh = state is None
+        if fresh:
+            state = legacy() if legacy else empty_state()
+        self.seq = self.snapshot_seq
+        replayed = 0
+        if self.events_path.exists():
+            with self.events_path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        ev = json.loads(line)
+                    except ValueError:
+                        continue  # недописанная строка после падения
+                    if ev["seq"] <= self.snapshot_seq:
+                        continue
+                    apply_event(state, ev)
+                    self.seq = ev["seq"]; replayed += 1
+        self.since_snapshot = replayed
+        if compact and fresh and not replayed and any(state.values()):
+            self.compact(state)  # переезд со старых staff/pending/subs.json
+        return state
+
+    # ── запись ────────────────────────────────────────────────────────────────
+    def append(self, op: str, key, value=None, actor: int | None = None) -> int:
+        if op not in OPS:
+            raise ValueError(f"unknown op {op}")
+        self.acquire()
+        with self._lock:
+            self.seq += 1
+            rec = {"seq": self.seq, "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "op": op, "k": key, "v": value, "by": actor}
+            if self._fh is None:
+                self.data_dir.mkdir(parents=True, exist_ok=True)
+                trim_torn_tail(self.events_path)  # писатель мы (acquire выше), так что резать можно
+                self._fh = self.events_path.open("a", encoding="utf-8")
+            self._fh.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._fh.flush()
+            self.since_snapshot += 1
+            return self.seq
+
+    def should_compact(self) -> bool:
+        return self.since_snapshot >= self.snapshot_every
+
+    def _write_snapshot(self, state: dict):
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        fmt = self.fmt
+        if fmt == "bin":
+            try:
+                tmp.write_bytes(statefile.dumps({**state, "seq": self.seq}))
+            except statefile.SnapshotError:
+                # строку с NUL таблица строк не хранит: этот снапшот — JSON, следующий снова попробует bin
+                # (иначе компакция падала бы на каждом append, а журнал рос бы без конца)
+                fmt = "json"
+        if fmt == "json":
+            data = {
+                "seq": self.seq,
+                "staff": {str(k): v for k, v in state["staff"].items()},
+                "pending": state["pending"],
+                "subs": {str(k): v for k, v in state["subs"].items()},
+                "runs": state.get("runs", {}),
+            }
+            tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, self.data_dir / ("snapshot.bin" if fmt == "bin" else "snapshot.json"))
+        # снапшот другого формата больше не актуален
+        other = self.data_dir / ("snapshot.json" if fmt == "bin" else "snapshot.bin")
+        if other.exists():
+            other.unlink()
+
+    def compact(self, state: dict):
+        """Снапшот текущего состояния; закрытый журнал → audit/events-<from>-<to>.jsonl."""
+        self.acquire()
+        with self._lock:
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            self._write_snapshot(state)
+            if self._fh is not None:
+                self._fh.close(); self._fh = None
+            if self.events_path.exists() and self.events_path.stat().st_size:
+                self.audit_dir.mkdir(parents=True, exist_ok=True)
+                os.replace(self.events_path, self.audit_dir / f"events-{self.snapshot_seq + 1:09d}-{self.seq:09d}.jsonl")
+            self.snapshot_seq = self.seq
+            self.since_snapshot = 0
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close(); self._fh = None
+            if self._writer is not None:
+                self._writer.close(); self._writer = None  # закрытие снимает flock
+
+    def audit(self, limit: int = 50, key=None) -> list[dict]:
+        """Последние события (архив + текущий журнал), опционально по одному ключу."""
+        files = sorted(self.audit_dir.glob("events-*.jsonl")) if self.audit_dir.exists() else []
+        if self.events_path.exists():
+            files.append(self.events_path)
+        out: list[dict] = []
+        for path in reversed(files):
+            with path.open("r", encoding="utf-8") as f:
+                lines = f.readlines()
+            for line in reversed(lines):
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue
+                if key is not None and str(ev["k"]) != str(key):
+                    continue
+                out.append(ev)
+                if len(out) >= limit:
+                    return out
+        return out
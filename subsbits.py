@@ -0,0 +1,227 @@
+## subsbits.py — подписки на магазины битовыми масками вместо множеств строк
+#
+# StoreIndex даёт каждому коду магазина плотный номер бита (бит 0 — "*", «все магазины»); номера не
+# переиспользуются, так что маска, посчитанная раньше (ТОМ-группа, «пройдено сегодня»), остаётся верной.
+# Subscriptions хранит:
+#   user[uid]        — маска магазинов пользователя (int);
+#   store[bit]       — маска пользователей магазина по их слотам (обратный индекс; store[0] — подписанные на "*").
+# Отсюда все частые вопросы — одна-две битовые операции:
+#   покрыта ли ТОМ-группа        m & ALL_BIT or m & g == g
+#   получатели по магазину       store[bit] | store[0]
+#   наблюдатели ТОМ-группы       AND store[bit] по кодам группы, без store[0]
+#   пройдено / не пройдено       m & done, m & ~done
+# Наружу — те же коды-строки (decode, codes), журнал и снапшот получают списки кодов как раньше.
+ALL = "*"
+ALL_BIT = 1
+
+
+def bits(mask: int) -> list[int]:
+    """Номера единичных битов по возрастанию."""
+    out = []
+    if mask.bit_count() * mask.bit_length() <= 1 << 16:
+        # короткая маска (подписки пользователя): младший бит за раз — пара операций над парой слов
+        while mask:
+            low = mask & -mask
+            out.append(low.bit_length() - 1)
+            mask ^= low
+        return out
+    # длинная (пользователи магазина по слотам): поиск по двоичной строке идёт в C
+    s = bin(mask)[:1:-1]
+    find = s.find
+    i = find("1")
+    while i >= 0:
+        out.append(i)
+        i = find("1", i + 1)
+    return out
+
+
+class StoreIndex:
+    """Код магазина → номер бита."""
+    __slots__ = ("codes", "_bit", "_ordered")
+
+    def __init__(self, codes=()):
+        self.codes: list[str] = [ALL]
+        self._bit: dict[str, int] = {ALL: 0}
+        self._ordered = True  # коды добавлялись по возрастанию — порядок битов уже отсортирован
+        for c in codes:
+            self.bit(c)
+
+    def bit(self, code: str) -> int:
+        b = self._bit.get(code)
+        if b is None:
+            b = self._bit[code] = len(self.codes)
+            self._ordered = self._ordered and code > self.codes[-1]
+            self.codes.append(code)
+        return b
+
+    def find(self, code: str) -> int | None:
+        return self._bit.get(code)
+
+    def mask(self, codes, add: bool = True) -> int:
+        """add=False — незнакомые коды пропускаются (маска «для чтения», индекс не растёт)."""
+        m = 0
+        for c in codes:
+            b = self.bit(c) if add else self._bit.get(c)
+            if b is not None:
+                m |= 1 << b
+        return m
+
+    def decode(self, mask: int) -> list[str]:
+        """Коды маски, отсортированные (как sorted(set) раньше); "*" — если стоит бит 0."""
+        codes = self.codes
+        out = [codes[b] for b in bits(mask)]
+        return out if self._ordered else sorted(out)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class Subscriptions:
+    def __init__(self, index: StoreIndex | None = None, catalog=()):
+        self.index = index or StoreIndex()
+        self.catalog_mask = self.index.mask(catalog)   # кого считать «всеми магазинами» для "*"
+        self.user: dict[int, int] = {}
+        self.store: list[int] = [0] * len(self.index)
+        self._slot: dict[int, int] = {}
+        self._uids: list[int | None] = []
+        self._free: list[int] = []
+
+    # ── слоты пользователей ───────────────────────────────────────────────────
+    def _slot_of(self, uid: int) -> int:
+        s = self._slot.get(uid)
+        if s is None:
+            s = self._free.pop() if self._free else len(self._uids)
+            if s == len(self._uids):
+                self._uids.append(uid)
+            else:
+                self._uids[s] = uid
+            self._slot[uid] = s
+        return s
+
+    def _uids_of(self, slots: int) -> set[int]:
+        uids = self._uids
+        return {uids[s] for s in bits(slots)}
+
+    def _set(self, uid: int, new: int):
+        """Единственное место, где меняется маска пользователя: обратный индекс — по разнице."""
+        old = self.user.get(uid, 0)
+        diff = old ^ new
+        if diff:
+            if len(self.store) < len(self.index):
+                self.store.extend([0] * (len(self.index) - len(self.store)))
+            sbit = 1 << self._slot_of(uid)
+            for b in bits(diff):
+                self.store[b] ^= sbit
+        self.user[uid] = new
+
+    # ── загрузка / выгрузка ───────────────────────────────────────────────────
+    def load(self, raw: dict[int, list[str]]):
+        """{uid: [коды | "*"]} — как в журнале и снапшоте. Пустой движок собирается сразу целиком."""
+        if self.user:
+            for uid, codes in raw.items():
+                self._set(int(uid), self.index.mask(codes or ()))
+            return
+        mask = self.index.mask
+        self.user = {int(uid): mask(codes or ()) for uid, codes in raw.items()}
+        self._uids = list(self.user)
+        self._slot = {uid: s for s, uid in enumerate(self._uids)}
+        self._free = []  # слоты выданы заново подряд — освобождённые после remove() больше не действительны
+        # обратный индекс: биты слотов в bytearray на магазин, в int — один раз (не OR по растущему int)
+        width = (len(self._uids) + 7) // 8
+        cols: dict[int, bytearray] = {}
+        for s, m in enumerate(self.user.values()):
+            for b in bits(m):
+                col = cols.get(b)
+                if col is None:
+                    col = cols[b] = bytearray(width)
+                col[s >> 3] |= 1 << (s & 7)
+        self.store = [0] * len(self.index)
+        for b, col in cols.items():
+            self.store[b] = int.from_bytes(col, "little")
+
+    def as_lists(self) -> dict[int, list[str]]:
+        return {uid: self.index.decode(m) for uid, m in self.user.items()}
+
+    # ── чтение ────────────────────────────────────────────────────────────────
+    def __contains__(self, uid):
+        return uid in self.user
+
+    def __len__(self):
+        return len(self.user)
+
+    def __iter__(self):
+        return iter(list(self.user))
+
+    def mask(self, uid: int) -> int:
+        return self.user.get(uid, 0)
+
+    def codes(self, uid: int) -> list[str]:
+        """Подписки пользователя как отсортированные коды (с "*", если подписан на все)."""
+        return self.index.decode(self.user.get(uid, 0))
+
+    def follows_all(self, uid: int) -> bool:
+        return bool(self.user.get(uid, 0) & ALL_BIT)
+
+    def covers(self, uid: int, group_mask: int) -> bool:
+        m = self.user.get(uid, 0)
+        return bool(m & ALL_BIT) or m & group_mask == group_mask
+
+    def stores(self, uid: int) -> int:
+        """Маска магазинов, о которых пользователь получает сводки ("*" — весь справочник)."""
+        m = self.user.get(uid, 0)
+        return self.catalog_mask if m & ALL_BIT else m & ~ALL_BIT
+
+    def recipients(self, code: str) -> set[int]:
+        b = self.index.find(code)
+        slots = self.store[0] | (self.store[b] if b is not None and b < len(self.store) else 0)
+        return self._uids_of(slots)
+
+    def covering(self, group_mask: int) -> set[int]:
+        """Подписанные на все коды группы точечно (без "*")."""
+        bs = bits(group_mask & ~ALL_BIT)
+        if not bs or max(bs) >= len(self.store):
+            return set()
+        slots = self.store[bs[0]]
+        for b in bs[1:]:
+            slots &= self.store[b]
+            if not slots:
+                return set()
+        return self._uids_of(slots & ~self.store[0])
+
+    # ── изменения ─────────────────────────────────────────────────────────────
+    def subscribe(self, uid: int, codes: list[str]) -> tuple[int, list[str]]:
+        """(сколько добавлено, какие уже были); при "*" ничего не меняет."""
+        m = self.user.get(uid, 0)
+        if m & ALL_BIT:
+            return 0, []
+        added, ignored = 0, []
+        for c in codes:
+            b = 1 << self.index.bit(c)
+            if m & b:
+                ignored.append(c); continue
+            m |= b; added += 1
+        self._set(uid, m)
+        return added, ignored
+
+    def unsubscribe(self, uid: int, codes: list[str]) -> int:
+        m = self.user.get(uid, 0)
+        drop = self.index.mask(codes) & ~ALL_BIT
+        self._set(uid, m & ~drop)
+        return (m & drop).bit_count()
+
+    def set_all(self, uid: int, on: bool):
+        m = self.user.get(uid, 0)
+        self._set(uid, m | ALL_BIT if on else m & ~ALL_BIT)
+
+    def remove(self, uid: int):
+        if uid not in self.user:
+            return
+        self._set(uid, 0)
+        del self.user[uid]
+        slot = self._slot.pop(uid, None)  # без единой подписки слот не выдавался
+        if slot is not None:
+            self._free.append(slot)
+
+    def stats(self) -> dict:
+        return {"users": len(self.user), "stores_indexed": len(self.index) - 1,
+                "follow_all": self.store[0].bit_count() if self.store else 0}
@@ -0,0 +1,183 @@
+## tenants.py — несколько ботов в одном процессе: реестр арендаторов и объекты «на арендатора»
+#
+#   TENANTS_FILE=tenants.json:
+#     [{"slug": "urban", "token": "123:…", "admin_id": 42,
+#       "auditor_secret": "…", "viewer_secret": "…",
+#       "data_dir": "data/urban",            — по умолчанию <DATA_DIR>/tenants/<slug>
+#       "catalog": {"C022": "…"}}]           — по умолчанию общий справочник магазинов
+#     токен можно не писать в файл: "token_env": "URBAN_BOT_TOKEN"
+#
+# Основной бот (BOT_TOKEN, TELEGRAM_ADMIN_ID, DATA_DIR) — арендатор "default" на вебхуке "/", остальные —
+# на "/t/<slug>". Все Application живут в одном цикле PTB и делят пул БД, HTTP-пул Bot API, планировщик и
+# сторожа. Текущий арендатор — contextvar: вебхук выставляет его в задаче process_update, дочерние задачи
+# (create_task, таймеры правок, воркеры фото) наследуют. Состояние (STAFF, журнал, лог прогонов, меню, …)
+# объявлено через local(): прокси, который на каждом обращении берёт объект текущего арендатора
+# (создаётся фабрикой при первом обращении), так что код хендлеров не знает об арендаторах.
+import os
+import re
+import json
+from pathlib import Path
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT = "default"
+_SLUG = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+
+class TenantError(ValueError):
+    pass
+
+
+class Tenant:
+    __slots__ = ("slug", "token", "admin_id", "data_dir", "auditor_secret", "viewer_secret", "catalog",
+                 "app", "username", "ns")
+
+    def __init__(self, slug: str, token: str, admin_id: int = 0, data_dir: Path | None = None,
+                 auditor_secret: str = "", viewer_secret: str = "", catalog: dict[str, str] | None = None):
+        self.slug = slug
+        self.token = token
+        self.admin_id = admin_id
+        self.data_dir = Path(data_dir) if data_dir is not None else Path("data")
+        self.auditor_secret = auditor_secret
+        self.viewer_secret = viewer_secret
+        self.catalog = catalog          # None — общий справочник
+        self.app = None                 # telegram.ext.Application (собирается в цикле PTB)
+        self.username: str | None = None
+        self.ns: dict[str, object] = {}  # объекты local() этого арендатора
+
+    @property
+    def is_default(self) -> bool:
+        return self.slug == DEFAULT
+
+    @property
+    def webhook_path(self) -> str:
+        return "/" if self.is_default else f"/t/{self.slug}"
+
+    def __repr__(self):
+        return f"<Tenant {self.slug}>"
+
+    @classmethod
+    def from_dict(cls, d: dict, data_root: Path) -> "Tenant":
+        slug = str(d.get("slug", ""))
+        if not _SLUG.match(slug) or slug == DEFAULT:
+            raise TenantError(f"bad tenant slug {slug!r}")
+        token = d.get("token") or os.getenv(d.get("token_env", ""), "")
+        if not token:
+            raise TenantError(f"tenant {slug}: token (or token_env) is required")
+        catalog = d.get("catalog")
+        if catalog is not None and not isinstance(catalog, dict):
+            raise TenantError(f"tenant {slug}: catalog must be an object code → name")
+        return cls(slug, token.strip(), int(d.get("admin_id") or 0), Path(d.get("data_dir") or data_root / slug),
+                   str(d.get("auditor_secret", "")), str(d.get("viewer_secret", "")), catalog)
+
+
+class TenantLocal:
+    """Прокси «объект текущего арендатора»: атрибуты, индексация, итерация, len/in — как у самого объекта."""
+    __slots__ = ("_reg", "_name", "_factory")
+
+    def __init__(self, reg: "TenantRegistry", name: str, factory):
+        object.__setattr__(self, "_reg", reg)
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_factory", factory)
+
+    def of(self, tenant: Tenant, create: bool = True):
+        """Объект конкретного арендатора (None, если ещё не создан и create=False)."""
+        obj = tenant.ns.get(self._name)
+        if obj is None and create:
+            obj = tenant.ns.setdefault(self._name, self._factory(tenant))
+        return obj
+
+    def _target(self):
+        t = self._reg.current()
+        try:
+            return t.ns[self._name]
+        except KeyError:
+            return self.of(t)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __contains__(self, key):
+        return key in self._target()
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def __bool__(self):
+        return bool(self._target())
+
+    def __repr__(self):
+        return f"<{self._name}@{self._reg.current().slug}: {self._target()!r}>"
+
+
+class TenantRegistry:
+    def __init__(self, default: Tenant):
+        if not default.is_default:
+            raise TenantError("the first tenant must be 'default'")
+        self.default = default
+        self._by_slug: dict[str, Tenant] = {default.slug: default}
+        self._var: ContextVar[Tenant] = ContextVar("tenant", default=default)
+
+    # ── состав ────────────────────────────────────────────────────────────────
+    def add(self, tenant: Tenant):
+        if tenant.slug in self._by_slug:
+            raise TenantError(f"duplicate tenant {tenant.slug}")
+        if any(t.token == tenant.token for t in self._by_slug.values()):
+            raise TenantError(f"tenant {tenant.slug}: token is already used by another tenant")
+        if any(t.data_dir.resolve() == tenant.data_dir.resolve() for t in self._by_slug.values()):
+            raise TenantError(f"tenant {tenant.slug}: data_dir is shared with another tenant")
+        self._by_slug[tenant.slug] = tenant
+
+    @staticmethod
+    def read_file(path: str | Path, data_root: Path) -> list[Tenant]:
+        p = Path(path)
+        raw = json.loads(p.read_text(encoding="utf-8"))
+        if not isinstance(raw, list):
+            raise TenantError(f"{p.name}: expected a list of tenants")
+        return [Tenant.from_dict(d, data_root) for d in raw]
+
+    def get(self, slug: str) -> Tenant | None:
+        return self._by_slug.get(slug)
+
+    def __iter__(self):
+        return iter(list(self._by_slug.values()))
+
+    def __len__(self):
+        return len(self._by_slug)
+
+    # ── текущий арендатор ─────────────────────────────────────────────────────
+    def current(self) -> Tenant:
+        return self._var.get()
+
+    def use(self, tenant: Tenant):
+        """Сделать арендатора текущим в этом контексте (задаче). Возвращает токен для reset()."""
+        return self._var.set(tenant)
+
+    def reset(self, token):
+        self._var.reset(token)
+
+    @contextmanager
+    def scoped(self, tenant: Tenant):
+        token = self._var.set(tenant)
+        try:
+            yield tenant
+        finally:
+            self._var.reset(token)
+
+    def local(self, name: str, factory) -> TenantLocal:
+        return TenantLocal(self, name, factory)
@@ -0,0 +1,28 @@
+# Тесты лежат рядом с модулями бота (они в корне репозитория, не пакетом) — как tools/, добавляем корень в путь.
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def pg():
+    """Соединение с чистой временной базой на сервере из DATABASE_URL (без него тест пропускается)."""
+    dsn = os.getenv("DATABASE_URL", "")
+    if not dsn:
+        pytest.skip("DATABASE_URL is not set")
+    psycopg = pytest.importorskip("psycopg")
+    from psycopg.conninfo import make_conninfo
+    name = f"clbot_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(dsn, autocommit=True) as admin:
+        admin.execute(f"CREATE DATABASE {name}")
+    try:
+        with psycopg.connect(make_conninfo(dsn, dbname=name)) as conn:
+            yield conn
+    finally:
+        with psycopg.connect(dsn, autocommit=True) as admin:
+            admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from cltemplates import DEFAULT_ID, Template, TemplateError, TemplateRegistry, store_format
+
+SECTIONS = [{"title": "Витрина", "items": ["Свет", "Манекены"]}, {"title": "Касса", "items": ["Чистота"]}]
+
+
+def tpl(tid=DEFAULT_ID, version=1, sections=SECTIONS, **kw):
+    return Template(tid, version, sections, **kw)
+
+
+def registry():
+    return TemplateRegistry(tpl(), log=lambda *a: None)
+
+
+def test_compiled_layout_and_callbacks():
+    t = tpl()
+    assert t.key == "default@1" and t.layout == (2, 1) and t.total == 3
+    s = t.sections[0]
+    assert s.header == "*Витрина*" and s.toggle_cb == ("cl:toggle:0", "cl:toggle:1")
+    assert s.item_heads[1] + "✅" + s.item_tails[1] == "2. ✅ Манекены"
+    assert t.sections[1].goto_cb == "cl:goto_1"
+    assert t.progress({0: {0: True, 1: False}, 1: {0: True}}) == (2, 3)
+
+
+@pytest.mark.parametrize("bad", [[], [{"title": "", "items": ["x"]}], [{"title": "T", "items": ["", "x"]}],
+                                 [{"title": "T", "items": []}], [{"title": "T"}]])
+def test_invalid_templates_are_rejected(bad):
+    with pytest.raises(TemplateError):
+        tpl(sections=bad)
+    with pytest.raises(TemplateError):
+        Template.from_dict({"id": "x"})
+
+
+def test_selection_store_beats_format_beats_default():
+    reg = registry()
+    urban = tpl("urban", 2, formats=["urban"])
+    c022 = tpl("c022", 1, stores=["C022"])
+    res = reg.reload([urban, c022])
+    assert res["current"] == ["c022@1", "default@1", "urban@2"] and not res["errors"]
+    assert store_format("RU_MOSCOW_Mega_URBAN") == "URBAN"
+    assert reg.for_store("C022", "RU_X_URBAN") is c022
+    assert reg.for_store("C0GJ", "RU_MOSCOW_MegaBelayaDacha_URBAN") is urban
+    assert reg.for_store("C0SL", "RU_MOSCOW_Afimall_SPORT").id == DEFAULT_ID
+    assert reg.for_store(None).id == DEFAULT_ID
+
+
+def test_highest_version_wins_and_old_versions_stay_reachable():
+    reg = registry()
+    v1, v2 = tpl("urban", 1, formats=["URBAN"]), tpl("urban", 2, sections=SECTIONS[:1], formats=["URBAN"])
+    reg.reload([v1])
+    reg.reload([v2, v1])
+    assert reg.current["urban"] is v2
+    assert reg.get("urban@1") is v1          # начатый прогон дорабатывает на своей версии
+    assert v1 in reg.by_fp(v1.fp)
+    assert reg.get("nope@9").id == DEFAULT_ID
+
+
+def test_changed_content_without_version_bump_keeps_loaded_template():
+    reg = registry()
+    first = tpl("urban", 1)
+    reg.reload([first])
+    reg.reload([tpl("urban", 1, sections=SECTIONS[:1])])
+    assert reg.current["urban"] is first
+
+
+def test_store_claimed_twice_is_reported():
+    reg = registry()
+    res = reg.reload([tpl("a", 1, stores=["C1"]), tpl("b", 1, stores=["C1"])])
+    assert res["errors"] == ["store C1 is claimed by a and b"]
+    assert reg.for_store("C1").id == "a"
+
+
+def test_read_dir_collects_errors(tmp_path):
+    (tmp_path / "ok.json").write_text(json.dumps({"id": "ok", "version": 3, "sections": SECTIONS}), encoding="utf-8")
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    (tmp_path / "noid.json").write_text(json.dumps({"version": 1}), encoding="utf-8")
+    templates, errors = TemplateRegistry.read_dir(tmp_path)
+    assert [t.key for t in templates] == ["ok@3"] and templates[0].source == "ok.json"
+    assert sorted(e.split(":")[0] for e in errors) == ["broken.json", "noid.json"]
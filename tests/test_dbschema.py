@@ -0,0 +1,38 @@
+import pytest
+
+import dbschema
+
+pytest.importorskip("psycopg")
+
+
+def test_migrations_are_idempotent(pg):
+    first = dbschema.migrate(pg, log=lambda *a, **k: None)
+    assert first and first == sorted(first)
+    assert dbschema.migrate(pg, log=lambda *a, **k: None) == []
+    assert sorted(dbschema.applied(pg)) == first
+
+
+def test_hot_query_plans(pg):
+    """Планы горячих запросов закреплены: нужный индекс/секция используется, запрещённых узлов нет."""
+    dbschema.migrate(pg, log=lambda *a, **k: None)
+    dbschema.ensure_item_partitions(pg)
+    res = dbschema.check_plans(pg)
+    assert {r["query"] for r in res} == set(dbschema.HOT_QUERIES)
+    bad = {r["query"]: {"missing": r["missing"], "forbidden": r["forbidden"], "nodes": r["nodes"]}
+           for r in res if not r["ok"]}
+    assert not bad
+
+
+
+def test_check_plans_creates_no_partitions(pg):
+    dbschema.migrate(pg, log=lambda *a, **k: None)
+    parts = "SELECT count(*) FROM pg_inherits WHERE inhparent = 'checklist_items'::regclass"
+    with pg.cursor() as cur:
+        cur.execute(parts); before = cur.fetchone()[0]
+    res = {r["query"]: r for r in dbschema.check_plans(pg)}
+    with pg.cursor() as cur:
+        cur.execute(parts)
+        assert cur.fetchone()[0] == before == 1       # только checklist_items_default
+    assert not res["run_items"]["ok"] and res["run_items"]["missing"][0].startswith("checklist_items_20")
+    dbschema.ensure_item_partitions(pg)
+    assert all(r["ok"] for r in dbschema.check_plans(pg))
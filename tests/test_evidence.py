@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+from evidence import LocalStorage, StorageError, TransferPool
+
+
+def pool(tmp_path, **kw):
+    return TransferPool(LocalStorage(tmp_path / "disk"), tmp_path / "spool", workers=2, log=lambda *a: None, **kw)
+
+
+async def settle(p: TransferPool, run: str, timeout: float = 5.0):
+    """Дождаться, пока ни одно фото прогона не останется в очереди."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while any(ph["status"] == "queued" for ph in p.manifest(run)["photos"]):
+        assert loop.time() < deadline, p.manifest(run)
+        await asyncio.sleep(0.01)
+    await p._queue.join()
+
+
+def test_local_storage_stays_under_root(tmp_path):
+    with pytest.raises(StorageError):
+        LocalStorage(tmp_path / "disk")._path("../escape.jpg")
+
+
+def test_upload_manifest_and_duplicate_submit(tmp_path):
+    p = pool(tmp_path)
+
+    async def fetch(file_id):
+        return f"bytes of {file_id}".encode()
+
+    async def main():
+        p.start(fetch)
+        p.open_run("C001/r1", "runs/C001/r1", store="C001")
+        job = p.submit("C001/r1", "runs/C001/r1", "f1", "u1", section=0)
+        assert p.submit("C001/r1", "runs/C001/r1", "f1-again", "u1", section=0) is None
+        await settle(p, "C001/r1")
+        p.close_run("C001/r1", auditor=7)
+        await p._queue.join()
+        await p.stop()
+        return job
+
+    job = asyncio.run(main())
+    disk = tmp_path / "disk" / "runs" / "C001" / "r1"
+    assert (disk / job["path"].rsplit("/", 1)[1]).read_bytes() == b"bytes of f1"
+    man = json.loads((disk / "manifest.json").read_text(encoding="utf-8"))
+    assert man["store"] == "C001" and man["auditor"] == 7
+    assert [(ph["unique_id"], ph["status"], ph["size"]) for ph in man["photos"]] == [("u1", "uploaded", 11)]
+    assert not list((tmp_path / "spool" / "jobs").iterdir())
+    assert p.stats["uploaded"] == 1 and p.stats["queued"] == 1
+
+
+def test_failed_photo_is_requeued_under_the_same_name(tmp_path):
+    p = pool(tmp_path, max_attempts=2, base_delay=0.01)
+    broken = {"on": True}
+
+    async def fetch(file_id):
+        if broken["on"]:
+            raise RuntimeError("telegram is down")
+        return b"ok"
+
+    async def main():
+        p.start(fetch)
+        first = p.submit("r", "runs/r", "f1", "u1", section=1)
+        await settle(p, "r")
+        assert p.manifest("r")["photos"][0]["status"] == "failed" and p.stats["retried"] == 1
+        broken["on"] = False
+        again = p.submit("r", "runs/r", "f1", "u1", section=1)
+        await settle(p, "r")
+        await p.stop()
+        return first, again
+
+    first, again = asyncio.run(main())
+    assert again is not None and again["path"] == first["path"]
+    (ph,) = p.manifest("r")["photos"]
+    assert ph["status"] == "uploaded" and "error" not in ph
+    assert (tmp_path / "disk" / first["path"]).read_bytes() == b"ok"
+
+
+def test_jobs_left_in_spool_resume_after_restart(tmp_path):
+    before = pool(tmp_path)
+    before.submit("r", "runs/r", "f1", "u1", section=0)     # воркеры не запущены — задание только в spool
+    before.submit("r", "runs/r", "f2", "u2", section=0)
+    after = pool(tmp_path)
+
+    async def fetch(file_id):
+        return file_id.encode()
+
+    async def main():
+        resumed = after.start(fetch)
+        await settle(after, "r")
+        await after.stop()
+        return resumed
+
+    assert asyncio.run(main()) == 2
+    assert {ph["status"] for ph in after.manifest("r")["photos"]} == {"uploaded"}
+
+
+def test_open_runs_survive_a_restart(tmp_path):
+    before = pool(tmp_path)
+    before.open_run("a", "runs/a", chat=1)
+    before.open_run("b", "runs/b", chat=2)
+    before.submit("b", "runs/b", "f1", "u1", section=3)
+    before.close_run("a")
+    (run,) = pool(tmp_path).open_runs()
+    assert run["run"] == "b" and run["chat"] == 2 and [p["section"] for p in run["photos"]] == [3]
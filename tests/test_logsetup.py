@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+
+import pytest
+
+import logsetup
+
+
+def test_sampling_keeps_every_nth_and_counts_drops():
+    f = logsetup.SamplingFilter({"update": 0.25, "off": 0})
+    kept = [f.decide("update", logging.INFO) for _ in range(8)]
+    assert kept == [4, 0, 0, 0, 4, 0, 0, 0]
+    assert f.dropped == {"update": 6}
+    assert f.decide("off", logging.INFO) == 0
+    assert f.decide("update", logging.WARNING) == 1     # предупреждения не прореживаются
+    assert f.decide("other", logging.INFO) == 1 and f.decide(None, logging.DEBUG) == 1
+
+
+def test_parse_kv():
+    assert logsetup.parse_kv("update=0.01; edit = 0.1,junk,=1") == {"update": "0.01", "edit": "0.1"}
+
+
+@pytest.fixture
+def configured():
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    out = io.StringIO()
+    log = logsetup.setup(fmt="json", level="INFO", sample="edit=0.5", stream=out)
+    try:
+        yield log, out
+    finally:
+        logsetup.shutdown()
+        logsetup._State.q = logsetup._State.sampler = logsetup._State.handler = None
+        root.handlers[:], _ = saved[0], root.setLevel(saved[1])
+
+
+def test_setup_writes_json_with_context_and_sampling(configured):
+    log, out = configured
+    token = logsetup.bind(update_id=7, chat_id=None)
+    try:
+        for i in range(4):
+            log.info("edited", extra={"event": "edit", "i": i})
+        if logsetup.sample("edit"):
+            log.info("pre-sampled", extra={"event": "edit", "_sampled": True})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            log.warning("boom", exc_info=True, extra={"event": "edit"})
+    finally:
+        logsetup.reset(token)
+    logsetup.shutdown()
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    edited = [r for r in lines if r["msg"] == "edited"]
+    assert [r["i"] for r in edited] == [0, 2] and all(r["sampled"] == 2 for r in edited)
+    assert all(r["update_id"] == 7 and "chat_id" not in r for r in lines)
+    assert [r["msg"] for r in lines if r["msg"] != "edited"] == ["pre-sampled", "boom"]
+    assert "ZeroDivisionError" in lines[-1]["exc"]
+    assert logsetup.stats()["sampled_out"] == {"edit": 2}
@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+from media import ALBUM_MAX, MediaRegistry
+
+
+class FakeBot:
+    """Запоминает альбомы; file_id из stale отвергает, как Bot API."""
+    def __init__(self, stale=()):
+        self.stale = set(stale)
+        self.albums: list[list[str]] = []
+        self.n = 0
+
+    def _msg(self, src):
+        if isinstance(src, str):
+            if src in self.stale:
+                raise BadRequest("Wrong file identifier/http url specified")
+            fid = src
+        else:
+            self.n += 1; fid = f"up{self.n}"
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=fid)]), fid
+
+    async def send_media_group(self, chat_id, media):
+        out = [self._msg(m.media) for m in media]
+        self.albums.append([fid for _, fid in out])
+        return [m for m, _ in out]
+
+    async def send_photo(self, chat_id, photo, caption=None):
+        m, fid = self._msg(photo)
+        self.albums.append([fid])
+        return m
+
+
+def make_registry(tmp_path, n):
+    sec = tmp_path / "examples" / "01"
+    sec.mkdir(parents=True)
+    for i in range(n):
+        (sec / f"{i:02d}.jpg").write_bytes(b"jpeg%d" % i)
+    return MediaRegistry(tmp_path / "examples", tmp_path / "media_cache.json", log=lambda *a: None)
+
+
+def test_upload_once_then_reuse_file_ids(tmp_path):
+    reg = make_registry(tmp_path, 3)
+    bot = FakeBot()
+    assert asyncio.run(reg.send(bot, 1, 0)) == 3
+    assert asyncio.run(reg.send(bot, 1, 0)) == 3
+    assert bot.albums == [["up1", "up2", "up3"], ["up1", "up2", "up3"]]
+    assert reg.stats["uploaded"] == 3 and reg.stats["cached_hits"] == 3
+    assert MediaRegistry(tmp_path / "examples", tmp_path / "media_cache.json").items(0)[0][2] == "up1"
+
+
+def test_stale_file_id_in_later_album_resends_only_from_that_album(tmp_path):
+    reg = make_registry(tmp_path, ALBUM_MAX + 3)
+    first = FakeBot()
+    asyncio.run(reg.send(first, 1, 0))
+    stale = {reg.items(0)[ALBUM_MAX + 1][2]}           # протух file_id во втором альбоме
+    bot = FakeBot(stale=stale)
+    assert asyncio.run(reg.send(bot, 1, 0)) == ALBUM_MAX + 3
+    assert len(bot.albums) == 2                         # первый альбом, затем второй — из файлов
+    assert len(bot.albums[0]) == ALBUM_MAX and bot.albums[1] == ["up1", "up2", "up3"]
+    ids = [fid for _, _, fid in reg.items(0)]
+    assert ids[:ALBUM_MAX] == [fid for a in first.albums[:1] for fid in a]  # кэш первого альбома не сброшен
+    assert not stale & set(ids)
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pytest
+
+import dbschema
+from pgmigrate import Migrator
+from profile_model import Profile
+
+pytest.importorskip("psycopg")
+
+STATE = {
+    "staff": {
+        1: {"role": "auditor", "stores": ["C001", "C002"], "current_store": "C001", "username": "aud", "name": "A",
+            "tz": "Europe/Moscow", "approved": True},
+        2: Profile.from_dict({"role": "viewer", "username": "v", "name": "V"}),
+    },
+    "subs": {2: ["C001", "C003"], 3: ["*"]},   # 3 — подписчик без профиля
+    "pending": {"r1": {"uid": 4, "role": "auditor", "store": "C002"}},
+    "runs": {},
+}
+RUNS = [{"ts": f"2026-10-0{d}T09:00:00+00:00", "store": "C001", "auditor": 1, "done": 10, "total": 12, "tpl": "base"}
+        for d in range(1, 6)]
+RUNS.append({"ts": "2026-10-06T09:00:00+00:00", "store": "C002", "done": 3, "total": 12})  # старая запись без аудитора
+
+
+def runs_since(cursor):
+    since = datetime.fromisoformat(cursor) if cursor else None
+    return [r for r in RUNS if since is None or datetime.fromisoformat(r["ts"]) >= since]
+
+
+def counts(conn) -> dict:
+    with conn.cursor() as cur:
+        out = {}
+        for table in ("stores", "users", "subscriptions", "pending_requests", "checklist_runs"):
+            cur.execute(f"SELECT count(*) FROM {table}")
+            out[table] = cur.fetchone()[0]
+        return out
+
+
+def migrate(conn, restart=False, batch=2):
+    return Migrator(conn, STATE, runs_since, {"C001": "First"}, batch=batch).run(restart)
+
+
+def test_migration_runs_against_real_postgres(pg):
+    dbschema.migrate(pg, log=lambda *a, **k: None)
+    stats = migrate(pg)
+    assert stats["users"]["rows"] == 3 and stats["runs"]["rows"] == len(RUNS)
+    first = counts(pg)
+    assert first == {"stores": 3, "users": 3, "subscriptions": 2, "pending_requests": 1, "checklist_runs": 6}
+    with pg.cursor() as cur:
+        # created_at не входит в COPY — должен прийти из DEFAULT, а не упасть на NOT NULL
+        cur.execute("SELECT user_id, role, follow_all, created_at IS NOT NULL FROM users ORDER BY user_id")
+        assert cur.fetchall() == [(1, "auditor", False, True), (2, "viewer", False, True), (3, "viewer", True, True)]
+        cur.execute("SELECT name FROM stores WHERE code = 'C001'")
+        assert cur.fetchone()[0] == "First"
+        cur.execute("SELECT count(*) FROM checklist_runs WHERE auditor_id IS NULL")
+        assert cur.fetchone()[0] == 1
+        cur.execute("SELECT flags FROM users WHERE user_id = 1")
+        assert cur.fetchone()[0] == 2                     # approved
+    pg.commit()
+
+    # докачка и перезапуск с нуля ничего не дублируют
+    assert migrate(pg)["runs"]["rows"] == 0
+    migrate(pg, restart=True)
+    assert counts(pg) == first
@@ -0,0 +1,36 @@
+from profile_model import DEFAULT_TZ, Flag, Profile
+
+FULL = {"role": "auditor", "stores": ["C001"], "current_store": "C001", "username": "u", "name": "N",
+        "tz": "Asia/Yekaterinburg", "intended_role": "auditor", "approved": True, "note": {"x": 1}}
+
+
+def test_full_profile_round_trips_exactly():
+    p = Profile.from_dict(FULL)
+    assert p.to_dict() == FULL and p == FULL
+    assert p.flags == Flag.APPROVED and p.extra == {"note": {"x": 1}}
+
+
+def test_partial_legacy_dict_gets_base_keys_with_defaults():
+    p = Profile.from_dict({"role": "viewer", "awaiting_approval": True})
+    assert p.to_dict() == {"role": "viewer", "stores": [], "current_store": None, "username": "", "name": "",
+                           "tz": DEFAULT_TZ, "awaiting_approval": True}
+    assert "intended_role" not in p and p.get("intended_role", "-") == "-"
+
+
+def test_dict_api_flags_and_extra():
+    p = Profile.from_dict({"role": "viewer", "approved": False})
+    assert p["approved"] is False and p.extra == {"approved": False}   # не-True флаг хранится как есть
+    p["approved"] = True
+    assert p.flags == Flag.APPROVED and not p.extra
+    assert p.pop("approved") is True and "approved" not in p
+    assert p.setdefault("inactive", True) is True and p.flags == Flag.INACTIVE
+    p["intended_role"] = "auditor"
+    assert p.pop("intended_role") == "auditor" and p.intended_role is None
+
+
+def test_pop_base_key_returns_value_and_resets_to_default():
+    p = Profile.from_dict(FULL)
+    assert p.pop("username", None) == "u" and p["username"] == ""
+    assert p.pop("stores") == ["C001"] and p.stores == []
+    assert p.pop("tz", "x") == "Asia/Yekaterinburg" and p.tz == DEFAULT_TZ
+    assert p.pop("missing", 0) == 0
@@ -0,0 +1,65 @@
+import gzip
+import json
+
+import pytest
+
+import runlog
+from runlog import MANIFEST, RunLog
+
+
+def rec(day: int, store: str = "C001", hour: int = 10):
+    return {"ts": f"2026-10-{day:02d}T{hour:02d}:00:00+00:00", "store": store, "auditor": 7}
+
+
+def log_(tmp_path):
+    return RunLog(tmp_path, codec="gzip", retention_days=0)
+
+
+def test_rotation_seals_and_compress_moves_to_manifest(tmp_path):
+    rl = log_(tmp_path)
+    rl.append(rec(1)); rl.append(rec(2, "C002"))
+    assert [s.file for s in rl.sealed] == ["runs-20261001-000.jsonl"] and not rl.segments
+    assert len(list(rl.read())) == 2                      # запечатанный сегмент читается и до сжатия
+    assert rl.compress_sealed() == 1
+    assert not (tmp_path / "runs-20261001-000.jsonl").exists()
+    man = json.loads((tmp_path / MANIFEST).read_text(encoding="utf-8"))
+    assert [s["file"] for s in man["segments"]] == ["runs-20261001-000.jsonl.gz"]
+    assert set(RunLog(tmp_path, codec="gzip").last_by_store()) == {"C001", "C002"}
+
+
+@pytest.mark.parametrize("crash", ["before_manifest", "before_unlink"])
+def test_crash_during_compression_keeps_every_run(tmp_path, monkeypatch, crash):
+    rl = log_(tmp_path)
+    rl.append(rec(1)); rl.append(rec(2))
+
+    def boom(*a, **kw):
+        raise OSError("crash")
+    if crash == "before_manifest":
+        monkeypatch.setattr(rl, "_write_manifest", boom)
+    else:
+        monkeypatch.setattr(runlog.Path, "unlink", boom)
+    with pytest.raises(OSError):
+        rl.compress_sealed()
+    monkeypatch.undo()
+    again = log_(tmp_path)
+    assert [r["ts"][:10] for r in again.read()] == ["2026-10-01", "2026-10-02"]
+    again.compress_sealed()
+    assert sorted(p.name for p in tmp_path.glob("runs-*")) == ["runs-20261001-000.jsonl.gz", "runs-20261002-000.jsonl"]
+    assert len(list(log_(tmp_path).read())) == 2
+
+
+def test_compressed_segment_missing_from_manifest_is_adopted(tmp_path):
+    with gzip.open(tmp_path / "runs-20261001-000.jsonl.gz", "wt", encoding="utf-8") as f:
+        f.write(json.dumps(rec(1)) + "\n")
+    rl = log_(tmp_path)
+    assert [r["store"] for r in rl.read()] == ["C001"] and rl.stats()["segments"] == 1
+
+
+def test_append_after_torn_line_is_not_lost(tmp_path):
+    rl = log_(tmp_path)
+    rl.append(rec(1, hour=9))
+    with (tmp_path / "runs-20261001-000.jsonl").open("a", encoding="utf-8") as f:
+        f.write('{"ts": "2026-10-01T09:30:00+00:00", "sto')  # падение посреди записи
+    again = log_(tmp_path)
+    again.append(rec(1, "C002", hour=10))
+    assert [r["store"] for r in log_(tmp_path).read()] == ["C001", "C002"]
@@ -0,0 +1,106 @@
+import pytest
+
+import statefile
+from profile_model import Profile
+from statestore import StateLocked, StateStore
+
+STAFF = {
+    1: {"role": "auditor", "stores": ["C001", "C002"], "current_store": "C001", "username": "a", "name": "Анна",
+        "tz": "Europe/Moscow", "approved": True},
+    2: {"role": "viewer", "stores": [], "current_store": None, "username": "", "name": "", "tz": "Europe/Moscow",
+        "intended_role": "auditor", "awaiting_approval": True, "note": [1, 2]},
+    3: {"role": "viewer", "approved": False},              # неполный профиль и не-True флаг — через XTRA
+}
+STATE = {"staff": STAFF, "pending": {"r1": {"uid": 2}}, "runs": {"C001": "2026-10-01T10:00:00+00:00"},
+         "tom": {"C001": [1]}, "seq": 17}
+
+
+def state(subs):
+    return {**STATE, "subs": subs}
+
+
+def test_round_trip_with_bitmask_subscriptions():
+    subs = {uid: ["*"] if uid == 0 else [f"C{uid % 7:03d}", f"C{7 + uid % 5:03d}"] for uid in range(200)}
+    data = statefile.dumps(state(subs))
+    assert b"SUBB" in data and b"SUBS" not in data
+    assert statefile.loads(data) == state(subs)
+
+
+def test_unsorted_subscriptions_fall_back_to_lists():
+    subs = {1: ["C002", "C001"], 2: ["C001", "C001"]}
+    data = statefile.dumps(state(subs))
+    assert b"SUBS" in data and b"SUBB" not in data
+    assert statefile.loads(data)["subs"] == subs
+
+
+def test_profiles_load_as_objects_with_same_content():
+    out = statefile.loads(statefile.dumps(state({})), profile_cls=Profile)
+    assert all(isinstance(p, Profile) for p in out["staff"].values())
+    assert out["staff"][1] == STAFF[1] and out["staff"][2] == STAFF[2]
+    assert out["staff"][3]["approved"] is False
+
+
+def test_rejects_foreign_data():
+    with pytest.raises(statefile.SnapshotError):
+        statefile.loads(b"NOTSNAP\x00")
+    with pytest.raises(statefile.SnapshotError):
+        statefile.loads(statefile.MAGIC + b"\x09\x00")
+
+
+@pytest.mark.parametrize("fmt", ["bin", "json"])
+def test_store_replays_journal_after_snapshot(tmp_path, fmt):
+    store = StateStore(tmp_path, fmt=fmt)
+    st = store.load()
+    st["staff"][1] = STAFF[1]; store.append("staff.put", 1, STAFF[1])
+    st["subs"][1] = ["C001"]; store.append("subs.put", 1, ["C001"])
+    store.compact(st)
+    store.append("staff.del", 1)
+    store.append("runs.put", "C001", "2026-10-01T10:00:00+00:00")
+    store.close()
+    again = StateStore(tmp_path, fmt=fmt).load()
+    assert again == {"staff": {}, "pending": {}, "subs": {1: ["C001"]}, "runs": {"C001": "2026-10-01T10:00:00+00:00"}}
+    assert len(list((tmp_path / "audit").iterdir())) == 1
+
+
+def test_second_writer_is_refused(tmp_path):
+    first, second = StateStore(tmp_path), StateStore(tmp_path)
+    first.append("runs.put", "C001", "x")
+    with pytest.raises(StateLocked):
+        second.append("runs.put", "C002", "y")
+    assert StateStore(tmp_path).load(compact=False)["runs"] == {"C001": "x"}   # читать можно и без замка
+    first.close()
+    second.append("runs.put", "C002", "y")
+    second.close()
+
+
+def test_append_after_torn_line_is_not_lost(tmp_path):
+    store = StateStore(tmp_path)
+    store.load()
+    store.append("subs.put", 1, ["C001"])
+    store.close()
+    with (tmp_path / "events.jsonl").open("a", encoding="utf-8") as f:
+        f.write('{"seq":2,"ts":"2026-10-01T10:00:00+00:00","op":"subs.pu')      # падение посреди записи
+    store = StateStore(tmp_path)
+    assert store.load()["subs"] == {1: ["C001"]} and store.seq == 1
+    assert store.append("subs.put", 3, ["C003"]) == 2
+    store.close()
+    again = StateStore(tmp_path)
+    assert again.load(compact=False)["subs"] == {1: ["C001"], 3: ["C003"]} and again.seq == 2
+
+
+def test_nul_in_a_string_falls_back_to_json_snapshot(tmp_path):
+    with pytest.raises(statefile.SnapshotError):
+        statefile.dumps(state({1: ["C\0X"]}))
+    store = StateStore(tmp_path)
+    st = store.load()
+    st["staff"][1] = {**STAFF[1], "name": "Ан\0на"}; store.append("staff.put", 1, st["staff"][1])
+    store.compact(st)
+    assert (tmp_path / "snapshot.json").exists() and not (tmp_path / "snapshot.bin").exists()
+    assert store.since_snapshot == 0 and not store.should_compact()
+    assert StateStore(tmp_path).load(compact=False)["staff"][1]["name"] == "Ан\0на"
+    del st["staff"][1]; store.append("staff.del", 1)
+    store.compact(st)                                       # NUL ушёл — снова бинарный
+    assert (tmp_path / "snapshot.bin").exists() and not (tmp_path / "snapshot.json").exists()
+    store.close()
+    again = StateStore(tmp_path)
+    assert again.load()["staff"] == {} and again.seq == 2
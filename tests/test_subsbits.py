@@ -0,0 +1,72 @@
+import random
+
+from subsbits import ALL, StoreIndex, Subscriptions, bits
+
+
+def test_bits_short_and_long_masks():
+    assert bits(0) == []
+    assert bits(0b1011) == [0, 1, 3]
+    big = [3, 700, 4095, 70_000] + list(range(100_000, 100_300))
+    assert bits(sum(1 << b for b in big)) == big
+
+
+def test_index_decode_sorted_even_if_codes_arrive_unsorted():
+    idx = StoreIndex(["C002", "C001"])
+    assert idx.decode(idx.mask(["C002", "C001", ALL])) == [ALL, "C001", "C002"]
+    assert idx.mask(["C999"], add=False) == 0 and idx.find("C999") is None
+
+
+def test_subscribe_unsubscribe_and_lookups():
+    s = Subscriptions(StoreIndex(["A", "B", "C"]), catalog=["A", "B", "C"])
+    assert s.subscribe(1, ["A", "B", "A"]) == (2, ["A"])
+    s.subscribe(2, ["B"])
+    s.set_all(3, True)
+    assert s.subscribe(3, ["A"]) == (0, [])
+    assert s.codes(1) == ["A", "B"] and s.codes(3) == [ALL]
+    assert s.recipients("B") == {1, 2, 3} and s.recipients("X") == {3}
+    g = s.index.mask(["A", "B"])
+    assert s.covers(1, g) and not s.covers(2, g) and s.covers(3, g)
+    assert s.covering(g) == {1}                      # "*" — не точечная подписка
+    assert s.stores(3) == s.catalog_mask
+    assert s.unsubscribe(1, ["B", "C"]) == 1 and s.codes(1) == ["A"]
+    s.remove(1); s.remove(42)
+    assert 1 not in s and s.recipients("A") == {3}
+
+
+def test_load_after_removing_everyone_does_not_reuse_taken_slots():
+    s = Subscriptions()
+    s.subscribe(1, ["A"]); s.subscribe(2, ["B"])
+    s.remove(1); s.remove(2)
+    s.load({3: ["A"], 4: ["B"]})
+    s.subscribe(5, ["C"])
+    assert s.recipients("B") == {4} and s.recipients("C") == {5} and s.recipients("A") == {3}
+
+
+def test_matches_plain_sets_under_random_changes():
+    rnd = random.Random(7)
+    codes = [f"C{i:02d}" for i in range(40)]
+    s = Subscriptions(StoreIndex(codes), catalog=codes)
+    ref: dict[int, set[str]] = {}
+    s.load({uid: sorted(rnd.sample(codes, 3)) for uid in range(50)})
+    ref.update({uid: set(s.codes(uid)) for uid in range(50)})
+    for _ in range(2000):
+        uid, op = rnd.randrange(80), rnd.random()
+        picked = rnd.sample(codes, rnd.randint(1, 4))
+        if op < 0.4:
+            s.subscribe(uid, picked)
+            if ALL not in ref.get(uid, ()):
+                ref.setdefault(uid, set()).update(picked)
+        elif op < 0.7:
+            s.unsubscribe(uid, picked); ref.get(uid, set()).difference_update(picked)
+        elif op < 0.8:
+            s.set_all(uid, True); ref.setdefault(uid, set()).add(ALL)
+        elif op < 0.9:
+            s.set_all(uid, False); ref.get(uid, set()).discard(ALL)
+        else:
+            s.remove(uid); ref.pop(uid, None)
+    for uid in ref:
+        assert s.codes(uid) == sorted(ref[uid])
+    for code in codes:
+        assert s.recipients(code) == {u for u, c in ref.items() if code in c or ALL in c}
+    g = s.index.mask(codes[:2])
+    assert s.covering(g) == {u for u, c in ref.items() if ALL not in c and set(codes[:2]) <= c}
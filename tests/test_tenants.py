@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+
+from tenants import DEFAULT, Tenant, TenantError, TenantRegistry
+
+
+def registry(tmp_path):
+    return TenantRegistry(Tenant(DEFAULT, "0:main", data_dir=tmp_path / "main"))
+
+
+def test_from_dict_defaults_and_token_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("URBAN_BOT_TOKEN", " 1:urban ")
+    t = Tenant.from_dict({"slug": "urban", "token_env": "URBAN_BOT_TOKEN", "admin_id": "42"}, tmp_path)
+    assert (t.token, t.admin_id, t.data_dir, t.catalog) == ("1:urban", 42, tmp_path / "urban", None)
+    assert t.webhook_path == "/t/urban" and not t.is_default
+
+
+@pytest.mark.parametrize("d", [
+    {"slug": "Urban", "token": "1:x"},
+    {"slug": DEFAULT, "token": "1:x"},
+    {"slug": "urban"},
+    {"slug": "urban", "token": "1:x", "catalog": ["C022"]},
+])
+def test_from_dict_rejects_bad_entries(tmp_path, d):
+    with pytest.raises(TenantError):
+        Tenant.from_dict(d, tmp_path)
+
+
+def test_registry_refuses_shared_slug_token_or_data_dir(tmp_path):
+    reg = registry(tmp_path)
+    with pytest.raises(TenantError):
+        TenantRegistry(Tenant("urban", "1:x"))
+    reg.add(Tenant("urban", "1:urban", data_dir=tmp_path / "urban"))
+    for bad in (Tenant("urban", "2:other", data_dir=tmp_path / "x"),
+                Tenant("sport", "1:urban", data_dir=tmp_path / "sport"),
+                Tenant("sport", "2:sport", data_dir=tmp_path / "main")):
+        with pytest.raises(TenantError):
+            reg.add(bad)
+    assert [t.slug for t in reg] == [DEFAULT, "urban"] and reg.get("sport") is None
+
+
+def test_read_file(tmp_path):
+    p = tmp_path / "tenants.json"
+    p.write_text(json.dumps([{"slug": "urban", "token": "1:u", "data_dir": str(tmp_path / "u")}]), encoding="utf-8")
+    assert [t.data_dir for t in TenantRegistry.read_file(p, tmp_path)] == [tmp_path / "u"]
+    p.write_text("{}", encoding="utf-8")
+    with pytest.raises(TenantError):
+        TenantRegistry.read_file(p, tmp_path)
+
+
+def test_local_follows_current_tenant(tmp_path):
+    reg = registry(tmp_path)
+    urban = Tenant("urban", "1:u", data_dir=tmp_path / "urban")
+    reg.add(urban)
+    made = []
+    staff = reg.local("staff", lambda t: made.append(t.slug) or {})
+    staff["a"] = 1
+    with reg.scoped(urban):
+        assert "a" not in staff and len(staff) == 0 and not staff
+        staff["b"] = 2
+    assert dict(staff) == {"a": 1} and list(staff) == ["a"]
+    assert staff.of(urban) == {"b": 2} and made == [DEFAULT, "urban"]
+    assert reg.local("other", dict).of(urban, create=False) is None
+
+
+def test_current_tenant_is_inherited_by_child_tasks(tmp_path):
+    reg = registry(tmp_path)
+    urban = Tenant("urban", "1:u", data_dir=tmp_path / "urban")
+    reg.add(urban)
+
+    async def main():
+        token = reg.use(urban)
+        try:
+            return await asyncio.create_task(_slug())
+        finally:
+            reg.reset(token)
+
+    async def _slug():
+        return reg.current().slug
+
+    assert asyncio.run(main()) == "urban" and reg.current().slug == DEFAULT
@@ -0,0 +1,51 @@
+## tools/bench_profiles.py — память на одного пользователя: dict-профиль (как раньше) против Profile
+#
+#   python tools/bench_profiles.py                 # 10k и 100k пользователей
+#   python tools/bench_profiles.py --users 50000
+#
+# Профили проходят через json (как при чтении staff.json / журнала), поэтому строки в dict-варианте
+# не разделяются — ровно так они и лежали в STAFF.
+import sys
+import json
+import argparse
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tools"))
+
+from profile_model import Profile  # noqa: E402
+from bench_snapshot import synth  # noqa: E402
+
+
+def measure(build) -> tuple[int, object]:
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return used, obj
+
+
+def run(n: int):
+    raw = json.dumps({str(k): v for k, v in synth(n)["staff"].items()}, ensure_ascii=False)
+    as_dict, staff_d = measure(lambda: {int(k): v for k, v in json.loads(raw).items()})
+    parsed = {int(k): v for k, v in json.loads(raw).items()}
+    # json.loads считается в обоих вариантах: в Profile-варианте исходные dict сразу освобождаются
+    as_prof, staff_p = measure(lambda: {int(k): Profile.from_dict(p) for k, p in json.loads(raw).items()})
+    assert all(staff_p[uid] == parsed[uid] for uid in parsed)
+    print(f"{n:>7} users | dict: {as_dict / n:6.0f} B/user, {as_dict / 1e6:6.1f} MB | "
+          f"Profile: {as_prof / n:6.0f} B/user, {as_prof / 1e6:6.1f} MB | x{as_dict / as_prof:.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, nargs="*", default=[10_000, 100_000])
+    a = ap.parse_args()
+    for n in a.users:
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+## tools/bench_snapshot.py — время загрузки и память: JSON-файлы (как раньше) против statefile
+#
+#   python tools/bench_snapshot.py                 # 10k и 100k пользователей
+#   python tools/bench_snapshot.py --users 50000
+#
+# Каждый вариант грузится в отдельном процессе, чтобы RSS одного не влиял на другой. statefile.loads сам
+# выключает циклический GC на время разбора; чтобы сравнивать форматы, а не настройки GC, оба загрузчика
+# идут с одинаковым GC (по умолчанию — выключен, --gc on — включён; для bin он тогда выключится только внутри loads).
+import gc
+import sys
+import json
+import random
+import argparse
+import resource
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import statefile  # noqa: E402
+
+CODES = ["C00X", "C0RG", "C082", "C0JP", "C03F", "C09Z", "C0JN", "C0BW", "C0SL", "C0LU", "C0VT", "C0TY",
+         "C0VY", "C0OI", "C024", "C0GN", "C0GJ", "C0VU", "C022", "C0WD", "C25Q", "C0TQ", "C0NJ", "C047"]
+TZS = ["Europe/Moscow"] * 8 + ["Asia/Yekaterinburg", "Asia/Novosibirsk", "Europe/Samara"]
+
+
+def synth(n: int, seed: int = 1) -> dict:
+    rnd = random.Random(seed)
+    staff, subs = {}, {}
+    for i in range(n):
+        uid = 100_000_000 + i * 7
+        auditor = rnd.random() < 0.6
+        store = rnd.choice(CODES)
+        p = {"role": "auditor" if auditor else "viewer", "stores": [store] if auditor else [],
+             "current_store": store, "username": f"user{i}", "name": f"Имя{i} Фамилия{i % 997}",
+             "tz": rnd.choice(TZS)}
+        if rnd.random() < 0.9: p["approved"] = True
+        if rnd.random() < 0.05: p["intended_role"] = p["role"]
+        staff[uid] = p
+        if not auditor:
+            subs[uid] = ["*"] if rnd.random() < 0.1 else sorted(rnd.sample(CODES, rnd.randint(1, 16)))
+    return {"staff": staff, "subs": subs, "pending": {}, "runs": {c: "2026-10-01T09:00:00+00:00" for c in CODES}}
+
+
+def write_json_files(state: dict, d: Path):
+    (d / "staff.json").write_text(json.dumps({str(k): v for k, v in state["staff"].items()}, ensure_ascii=False, indent=2), encoding="utf-8")
+    user_subs = {str(u): ("*" if "*" in c else c) for u, c in state["subs"].items()}
+    store_subs = {}
+    for u, codes in state["subs"].items():
+        for c in codes:
+            if c != "*": store_subs.setdefault(c, []).append(u)
+    (d / "subs.json").write_text(json.dumps({"USER_SUBS": user_subs, "STORE_SUBS": store_subs}, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def load_json(d: Path):
+    # то, что делал app.py до снапшотов: json + int(k) + множества
+    staff = {int(k): v for k, v in json.loads((d / "staff.json").read_text(encoding="utf-8")).items()}
+    raw = json.loads((d / "subs.json").read_text(encoding="utf-8"))
+    user_subs = {}
+    for k, v in raw.get("USER_SUBS", {}).items():
+        user_subs[int(k)] = {"*"} if v == "*" else set(v or [])
+    store_subs = {code: set(map(int, lst)) for code, lst in raw.get("STORE_SUBS", {}).items()}
+    return staff, user_subs, store_subs
+
+
+def load_bin(d: Path):
+    state = statefile.load(d / "snapshot.bin")
+    user_subs = {uid: set(codes) for uid, codes in state["subs"].items()}
+    store_subs = {}
+    for uid, codes in user_subs.items():
+        for c in codes:
+            if c != "*": store_subs.setdefault(c, set()).add(uid)
+    return state["staff"], user_subs, store_subs
+
+
+def _mem_kb() -> tuple[int, int]:
+    # (текущий RSS, пиковый RSS). ru_maxrss наследуется через fork/exec от родителя,
+    # поэтому на Linux берём VmRSS/VmHWM своего процесса
+    try:
+        vals = {}
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                k, v = line.split(":", 1); vals[k] = int(v.split()[0])
+        return vals["VmRSS"], vals["VmHWM"]
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak, peak
+
+
+def child(kind: str, d: str, gc_mode: str):
+    if gc_mode == "off":
+        gc.disable()
+    base, _ = _mem_kb()
+    t0 = time.perf_counter()
+    data = (load_json if kind == "json" else load_bin)(Path(d))
+    dt = time.perf_counter() - t0
+    rss, peak = _mem_kb()
+    print(json.dumps({"seconds": dt, "rss_kb": rss - base, "peak_kb": peak - base, "staff": len(data[0])}))
+
+
+def run(n: int, gc_mode: str):
+    state = synth(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        d = Path(tmp)
+        write_json_files(state, d)
+        statefile.dump(state, d / "snapshot.bin")
+        sizes = {"json": (d / "staff.json").stat().st_size + (d / "subs.json").stat().st_size,
+                 "bin": (d / "snapshot.bin").stat().st_size}
+        res = {}
+        for kind in ("json", "bin"):
+            best = None
+            for _ in range(3):
+                out = subprocess.run([sys.executable, __file__, "--child", kind, str(d), "--gc", gc_mode], capture_output=True, text=True, check=True)
+                r = json.loads(out.stdout)
+                best = r if best is None or r["seconds"] < best["seconds"] else best
+            res[kind] = best
+        print(f"{n:>7} users, gc {gc_mode:<3} | json: {res['json']['seconds']*1000:8.1f} ms, {sizes['json']/1e6:6.1f} MB on disk, "
+              f"+{res['json']['rss_kb']/1024:.1f} MB RSS (peak +{res['json']['peak_kb']/1024:.1f}) | "
+              f"bin: {res['bin']['seconds']*1000:8.1f} ms, {sizes['bin']/1e6:6.1f} MB on disk, "
+              f"+{res['bin']['rss_kb']/1024:.1f} MB RSS (peak +{res['bin']['peak_kb']/1024:.1f})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, nargs="*", default=[10_000, 100_000])
+    ap.add_argument("--gc", choices=("off", "on"), default="off", help="циклический GC на время загрузки (оба варианта)")
+    ap.add_argument("--child", nargs=2, metavar=("KIND", "DIR"))
+    a = ap.parse_args()
+    if a.child:
+        child(*a.child, a.gc); return
+    for n in a.users:
+        run(n, a.gc)
+
+
+if __name__ == "__main__":
+    main()
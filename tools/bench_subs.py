@@ -0,0 +1,133 @@
+## tools/bench_subs.py — подписки: множества строк (как раньше) против битовых масок subsbits
+#
+#   python tools/bench_subs.py                          # 10k и 100k пользователей, 300 магазинов, 20 ТОМ-групп
+#   python tools/bench_subs.py --users 50000 --stores 40 --groups 5
+#
+# Операции — те, что бот делает на каждом рендере /tom, на каждом завершённом чек-листе и в каждом тике
+# сводок: покрытие ТОМ-групп (_kb_tom), получатели по магазину, наблюдатели ТОМ-группы (эскалация),
+# «пройдено / не пройдено» по подпискам (дневная сводка). Ответы обоих вариантов сверяются, затем —
+# размер секции подписок в снапшоте (statefile: SUBS против SUBB).
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import statefile  # noqa: E402
+from subsbits import StoreIndex, Subscriptions  # noqa: E402
+
+
+def synth(users: int, stores: int, groups: int, seed: int = 1):
+    rnd = random.Random(seed)
+    codes = [f"C{i:03X}" for i in range(stores)]
+    tom = [sorted(rnd.sample(codes, rnd.randint(4, 16))) for _ in range(groups)]
+    subs = {}
+    for uid in range(1, users + 1):
+        r = rnd.random()
+        if r < 0.05:
+            subs[uid] = ["*"]
+        elif r < 0.35:  # подписан на свою ТОМ-группу целиком (кнопка /tom) и пару соседних магазинов
+            subs[uid] = sorted(set(rnd.choice(tom)) | set(rnd.sample(codes, 2)))
+        else:
+            subs[uid] = sorted(rnd.sample(codes, rnd.randint(1, 8)))
+    recent = set(rnd.sample(codes, stores // 2))
+    return codes, tom, subs, recent
+
+
+# ── как было в app.py: USER_SUBS uid -> set, STORE_SUBS code -> set(uid) ──────
+class SetSubs:
+    def __init__(self, raw, catalog):
+        self.user = {uid: set(v) for uid, v in raw.items()}
+        self.store: dict[str, set[int]] = {}
+        for uid, s in self.user.items():
+            for c in s - {"*"}:
+                self.store.setdefault(c, set()).add(uid)
+        self.catalog = catalog
+
+    def covers(self, uid, codes):
+        subs = self.user.get(uid, set())
+        return "*" in subs or all(c in subs for c in codes)
+
+    def recipients(self, code):
+        return set(self.store.get(code, set())) | {uid for uid, s in self.user.items() if s and "*" in s}
+
+    def covering(self, codes):
+        return {uid for uid, s in self.user.items() if "*" not in s and all(c in s for c in codes)}
+
+    def daily(self, uid, recent):
+        subs = self.user.get(uid, set())
+        stores = set(self.catalog) if "*" in subs else set(subs)
+        return sorted(s for s in stores if s in recent), sorted(s for s in stores if s not in recent)
+
+
+def timed(fn, repeat: int) -> float:
+    """Лучшее из трёх, мкс на вызов."""
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, time.perf_counter() - t0)
+    return best / repeat * 1e6
+
+
+def run(users: int, stores: int, groups: int):
+    codes, tom, raw, recent = synth(users, stores, groups)
+    t0 = time.perf_counter(); old = SetSubs(raw, codes); load_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = Subscriptions(StoreIndex(sorted(codes)), catalog=codes); new.load(raw)
+    load_new = time.perf_counter() - t0
+    gmasks = [new.index.mask(g) for g in tom]
+    rmask = new.index.mask(recent, add=False)
+    sample = random.Random(2).sample(list(raw), min(1000, users))
+
+    # ответы совпадают
+    for uid in sample:
+        assert [old.covers(uid, g) for g in tom] == [new.covers(uid, m) for m in gmasks]
+        s = new.stores(uid)
+        assert old.daily(uid, recent) == (new.index.decode(s & rmask), new.index.decode(s & ~rmask))
+    for code in codes[:10]:
+        assert old.recipients(code) == new.recipients(code)
+    for g, m in zip(tom[:5], gmasks):
+        assert old.covering(g) == new.covering(m)
+
+    rows = [
+        ("kb_tom: all groups", lambda: [old.covers(u, g) for u in sample for g in tom],
+         lambda: [new.covers(u, m) for u in sample for m in gmasks], len(sample), 3),
+        ("daily diff", lambda: [old.daily(u, recent) for u in sample],
+         lambda: [(new.index.decode(new.stores(u) & rmask), new.index.decode(new.stores(u) & ~rmask)) for u in sample],
+         len(sample), 3),
+        ("recipients(store)", lambda: old.recipients(codes[0]), lambda: new.recipients(codes[0]), 1, 5),
+        ("tom viewers(group)", lambda: old.covering(tom[0]), lambda: new.covering(gmasks[0]), 1, 5),
+    ]  # (название, как было, маски, операций за вызов, повторов)
+    print(f"{users:>7} users, {stores} stores, {groups} groups | load: sets {load_old * 1000:.0f} ms, "
+          f"bits {load_new * 1000:.0f} ms")
+    for name, f_old, f_new, per, rep in rows:
+        a, b = timed(f_old, rep) / per, timed(f_new, rep) / per
+        print(f"  {name:<20} sets {a:10.2f} µs   bits {b:10.2f} µs   x{a / b:6.1f}")
+
+    state = {"staff": {}, "pending": {}, "runs": {}, "subs": raw}
+    S = statefile._Strings()
+    total = sum(len(v) for v in raw.values())
+    subs_list = 8 * len(raw) + 4 * (len(raw) + 1) + 4 * total + 12  # SUBS: uid[q], offsets[I], codes[I]
+    subb = statefile._subs_bits(raw, S)
+    print(f"  snapshot subs        SUBS {subs_list / 1024:8.0f} KiB   SUBB "
+          + (f"{len(subb) / 1024:8.0f} KiB" if subb is not None else "   (SUBS is smaller)")
+          + f"   file {len(statefile.dumps(state)) / 1024:.0f} KiB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, nargs="*", default=[10_000, 100_000])
+    ap.add_argument("--stores", type=int, default=300)
+    ap.add_argument("--groups", type=int, default=20)
+    a = ap.parse_args()
+    for n in a.users:
+        run(n, a.stores, a.groups)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+## tools/check_plans.py — миграции схемы + проверка планов горячих запросов (EXPLAIN) на реальной базе
+#
+#   python tools/check_plans.py              # накатить миграции, проверить планы; код выхода 1 — план «уплыл»
+#   python tools/check_plans.py --verbose    # плюс узлы каждого плана
+#
+# Нужен только DATABASE_URL (бот не импортируется): годится для CI со сервисным Postgres.
+# Те же проверки гоняет pytest (tests/test_dbschema.py), если задан DATABASE_URL.
+import os
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import psycopg  # noqa: E402
+
+import dbschema  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dsn", default=os.getenv("DATABASE_URL", ""))
+    ap.add_argument("--verbose", action="store_true")
+    a = ap.parse_args()
+    if not a.dsn:
+        sys.exit("DATABASE_URL is required")
+    with psycopg.connect(a.dsn) as conn:
+        dbschema.migrate(conn)
+        dbschema.ensure_item_partitions(conn)
+        res = dbschema.check_plans(conn)
+    for r in res:
+        print(f"{'ok ' if r['ok'] else 'BAD'} {r['query']}"
+              + (f"  missing={r['missing']}" if r["missing"] else "")
+              + (f"  forbidden={r['forbidden']}" if r["forbidden"] else ""))
+        if a.verbose or not r["ok"]:
+            for n in r["nodes"]:
+                print(f"      {n}")
+    sys.exit(0 if all(r["ok"] for r in res) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+## tools/fake_botapi.py — локальный «Telegram Bot API» для нагрузочных прогонов
+#
+#   python tools/fake_botapi.py --port 8081 --latency-ms 40 --jitter-ms 20 --rate-429 0.01
+#   TG_API_BASE=http://127.0.0.1:8081 gunicorn app:app ...
+#
+# Отвечает правдоподобными объектами (Message с растущим message_id, True для прочего), записывает каждый
+# вызов (метод, chat_id, параметры, время) и умеет добавлять задержку и 429 с retry_after.
+# getFile + GET /file/bot<token>/<path> отдают синтетический файл (file_bytes байт) — для фотофиксации.
+# tools/loadgen.py поднимает его у себя в процессе и ждёт по записанным вызовам ответы бота.
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "Checklist", "username": "checklist_load_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+# методы, в ответ на которые Telegram возвращает Message
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendPhoto", "sendDocument",
+                   "editMessageCaption", "editMessageMedia", "copyMessage", "forwardMessage"}
+
+
+class Call:
+    __slots__ = ("method", "chat_id", "params", "t", "status", "msg_id")
+
+    def __init__(self, method, chat_id, params, t, status, msg_id=None):
+        self.method, self.chat_id, self.params, self.t, self.status = method, chat_id, params, t, status
+        self.msg_id = msg_id  # message_id в ответе (для send* — новый, для edit* — из параметров)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return  # клиент закрыл keep-alive соединение (остановка бота) — не шум
+        super().handle_error(request, client_address)
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+                 rate_429: float = 0.0, retry_after: int = 1, seed: int = 1, keep_calls: bool = True,
+                 file_bytes: int = 64 << 10):
+        self.latency = latency_ms / 1000; self.jitter = jitter_ms / 1000
+        self.rate_429 = rate_429; self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.keep_calls = keep_calls
+        self.file_bytes = file_bytes
+        self.calls: list[Call] = []
+        self.counts: dict[str, int] = {}
+        self.throttled = 0
+        self.listeners = []  # fn(call) — вызываются из потоков сервера
+        self._lock = threading.Lock()
+        self._msg_id = 1000
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у httpx-пула бота
+
+            def log_message(self, *a):
+                pass
+
+            def do_GET(self):
+                if urlsplit(self.path).path.startswith("/file/"):
+                    return self._file()
+                self._serve(dict(parse_qsl(urlsplit(self.path).query)))
+
+            def _file(self):
+                data = api._download()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._serve(api._parse_body(self.headers.get("Content-Type", ""), body))
+
+            def _serve(self, params):
+                path = urlsplit(self.path).path
+                method = path.rsplit("/", 1)[-1]
+                status, payload = api._handle(method, params)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = _Server((host, port), Handler)
+        self.host, self.port = self.server.server_address[:2]
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    # ── разбор запроса ────────────────────────────────────────────────────────
+    @staticmethod
+    def _value(v: str):
+        # PTB шлёт не-строковые параметры JSON-строками (reply_markup, chat_id, entities…)
+        try:
+            return json.loads(v)
+        except ValueError:
+            return v
+
+    def _parse_body(self, ctype: str, body: bytes) -> dict:
+        if ctype.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if ctype.startswith("multipart/form-data"):
+            msg = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + body)
+            out = {}
+            for part in msg.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename():
+                    out[name] = f"<file {part.get_filename()}>"
+                else:
+                    out[name] = self._value(part.get_content())
+            return out
+        return {k: self._value(v) for k, v in parse_qsl(body.decode("utf-8"), keep_blank_values=True)}
+
+    # ── ответ ─────────────────────────────────────────────────────────────────
+    def _handle(self, method: str, params: dict) -> tuple[int, dict]:
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.rnd.uniform(-self.jitter, self.jitter)))
+        with self._lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+            throttle = self.rate_429 and method not in ("getMe", "getWebhookInfo") and self.rnd.random() < self.rate_429
+            if throttle:
+                self.throttled += 1
+            else:
+                self._msg_id += 1
+            msg_id = self._msg_id
+        chat_id = params.get("chat_id")
+        call = Call(method, chat_id, params, time.monotonic(), 429 if throttle else 200,
+                    params.get("message_id") or msg_id)
+        if self.keep_calls:
+            with self._lock:
+                self.calls.append(call)
+        for fn in list(self.listeners):
+            fn(call)
+        if throttle:
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+        return 200, {"ok": True, "result": self._result(method, params, msg_id)}
+
+    def _download(self) -> bytes:
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.rnd.uniform(-self.jitter, self.jitter)))
+        with self._lock:
+            self.counts["<download>"] = self.counts.get("<download>", 0) + 1
+        return b"\xff\xd8" + b"\0" * max(0, self.file_bytes - 4) + b"\xff\xd9"
+
+    def _result(self, method: str, params: dict, msg_id: int):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getMyCommands":
+            return []
+        if method == "getFile":
+            fid = str(params.get("file_id"))
+            return {"file_id": fid, "file_unique_id": "u" + fid[-16:], "file_size": self.file_bytes,
+                    "file_path": f"photos/{fid}.jpg"}
+        if method in MESSAGE_METHODS:
+            chat_id = params.get("chat_id") or 0
+            msg = {"message_id": params.get("message_id") or msg_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+            if "text" in params: msg["text"] = str(params["text"])
+            if "caption" in params: msg["caption"] = str(params["caption"])
+            if isinstance(params.get("reply_markup"), dict): msg["reply_markup"] = params["reply_markup"]
+            if method == "sendPhoto":
+                msg["photo"] = [{"file_id": f"photo{msg_id}", "file_unique_id": f"u{msg_id}", "width": 1, "height": 1}]
+            return msg
+        if method == "sendMediaGroup":
+            media = params.get("media") or []
+            return [{"message_id": msg_id * 100 + i, "date": int(time.time()),
+                     "chat": {"id": params.get("chat_id") or 0, "type": "private"},
+                     "photo": [{"file_id": f"photo{msg_id}_{i}", "file_unique_id": f"u{msg_id}_{i}",
+                                "width": 1, "height": 1}]} for i in range(len(media))]
+        return True
+
+    # ── жизненный цикл ────────────────────────────────────────────────────────
+    def start(self) -> "FakeBotAPI":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-botapi", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown(); self.server.server_close()
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"calls": sum(self.counts.values()), "by_method": dict(sorted(self.counts.items())),
+                    "throttled_429": self.throttled}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency-ms", type=float, default=0)
+    ap.add_argument("--jitter-ms", type=float, default=0)
+    ap.add_argument("--rate-429", type=float, default=0.0, help="доля вызовов, получающих 429")
+    ap.add_argument("--retry-after", type=int, default=1)
+    a = ap.parse_args()
+    api = FakeBotAPI(a.host, a.port, a.latency_ms, a.jitter_ms, a.rate_429, a.retry_after, keep_calls=False)
+    api.listeners.append(lambda c: print(f"{c.status} {c.method} chat={c.chat_id}", flush=True))
+    print(f"fake Bot API on {api.base_url}  (TG_API_BASE={api.base_url})", file=sys.stderr)
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(api.summary(), ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
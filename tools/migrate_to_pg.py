@@ -0,0 +1,50 @@
+## tools/migrate_to_pg.py — разовый перенос DATA_DIR (staff / subs / pending / лог прогонов) в Postgres
+#
+#   python tools/migrate_to_pg.py                # перенос / докачка с последнего курсора
+#   python tools/migrate_to_pg.py --restart      # забыть прогресс и пройти всё заново (дублей не будет)
+#   python tools/migrate_to_pg.py --batch 100000
+#   python tools/migrate_to_pg.py --tenant urban # арендатор из TENANTS_FILE (по умолчанию — основной бот)
+#
+# Окружение — как у бота (.env: BOT_TOKEN, DATABASE_URL, DATA_DIR). Бот при импорте не стартует.
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("PTB_EAGER_START", "0")
+
+import app as bot  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--restart", action="store_true", help="сбросить migration_progress")
+    ap.add_argument("--batch", type=int, default=bot.MIGRATE_BATCH, help="записей лога прогонов на транзакцию")
+    ap.add_argument("--tenant", default=bot.DEFAULT_TENANT, help="slug арендатора")
+    a = ap.parse_args()
+    bot.MIGRATE_BATCH = a.batch
+    tenant = bot._tenants.get(a.tenant)
+    if tenant is None:
+        ap.error(f"unknown tenant {a.tenant!r}")
+
+    t0 = time.monotonic()
+
+    def progress(step: str, n: int):
+        print(f"\r{step:<14} {n:>10}  {time.monotonic() - t0:7.1f}s", end="", flush=True)
+        if step != "runs":
+            print()
+
+    try:
+        stats = bot.migrate_to_pg(restart=a.restart, progress=progress, tenant=tenant)
+    except bot.MigrationBusy as e:
+        print(f"\n{e}", file=sys.stderr); sys.exit(2)
+    print()
+    for step, st in stats.items():
+        print(f"{step:<14} rows={st['rows']:<10} {st['seconds']}s")
+    print(f"total {time.monotonic() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
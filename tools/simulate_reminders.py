@@ -0,0 +1,363 @@
+## tools/simulate_reminders.py — неделя (месяц) напоминаний за секунды: виртуальные часы + синтетические пользователи
+#
+#   python tools/simulate_reminders.py                            # 8 дней с воскресенья перехода ЕС (и США) на зимнее время
+#   python tools/simulate_reminders.py --days 30 --viewers 2000 --auditors 800 --stores 300
+#   python tools/simulate_reminders.py --drift-s 15 --jitter-s 90  # тики опаздывают: копится / случайно на каждом тике
+#   python tools/simulate_reminders.py --start 2027-03-22 --json
+#
+# Часы бота (app.set_clock) переводятся на время очередного тика расписания REMINDER_JOBS, и job-функции
+# выполняются как есть — с контекстом, чей bot только записывает send_message. Прогоны чек-листа случайные:
+# --run-rate в день на магазин, в местные 9–20 часов. Журнал напоминаний пишется во временный DATA_DIR.
+# Отчёт:
+#   messages  — сообщений в час: пик, среднее, самые загруженные часы (UTC);
+#   cpu       — процессорное время одного тика по заданиям (p50/p95/max, мс);
+#   windows   — окна по поясам: сколько было, сколько пропущено (ни один тик не попал в местный час окна
+#               или наблюдатель в окне ничего не получил) и дубли (повтор в периоде одноразового напоминания,
+#               повтор раньше repeat_h). Отдельно — те, что пришлись на сутки перехода на летнее/зимнее
+#               время в поясе пользователя;
+#   escalation  — эскалации по (аудитор, день): сколько было и дубли (вторая за день, хоть одному наблюдателю).
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone, date
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# бот не стартует и ничего не пишет в настоящий DATA_DIR; БД и Bot API не трогаются
+os.environ["PTB_EAGER_START"] = "0"
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="remsim-")
+os.environ["TENANTS_FILE"] = ""
+os.environ.setdefault("BOT_TOKEN", "0:simulation")
+os.environ.setdefault("DATABASE_URL", "postgresql://sim@127.0.0.1:1/sim")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import app as bot  # noqa: E402
+from profile_model import Profile  # noqa: E402
+
+# пояс → доля пользователей: без перехода (Москва, Азия), с переходом (ЕС, США), нецелые смещения
+TZ_WEIGHTS = {"Europe/Moscow": 0.45, "Asia/Yekaterinburg": 0.12, "Asia/Novosibirsk": 0.08, "Asia/Vladivostok": 0.05,
+              "Europe/Berlin": 0.1, "Europe/London": 0.05, "America/New_York": 0.05, "Asia/Kolkata": 0.05,
+              "Asia/Kathmandu": 0.05}
+
+# kind → (задание, окно по местному времени, период); окна повторяют условия в job-функциях app.py
+WINDOWS = {
+    "viewer_weekly": ("job_viewers_weekly", lambda l: l.weekday() == 0 and l.hour == 10, bot._period_week),
+    "viewer_daily": ("job_viewers_daily", lambda l: l.hour == 21, bot._period_day),
+    "auditor_weekly": ("job_auditors_weekly", lambda l: l.weekday() == 0 and l.hour == 10, bot._period_week),
+    "auditor_overdue": ("job_auditors_hourly_overdue", lambda l: not (22 <= l.hour or l.hour < 8), bot._period_day),
+}
+STEP = timedelta(minutes=15)  # все смещения поясов кратны 15 минутам
+
+
+def default_start() -> date:
+    """Последнее воскресенье октября (переход ЕС); через неделю — переход США, между ними — понедельник."""
+    y = date.today().year
+    return max(date(y, 10, d) for d in range(25, 32) if date(y, 10, d).weekday() == 6)
+
+
+class RecordingBot:
+    """Вместо Bot API: запоминает (виртуальное время, chat_id, текст); эскалации — ещё и с аудитором."""
+    def __init__(self, now):
+        self.now = now
+        self.sent: list[tuple[datetime, int, str]] = []
+        self.escalating: int | None = None   # аудитор, по которому сейчас идёт app._escalate_overdue
+        self.escalations: list[tuple[datetime, int]] = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((self.now(), int(chat_id), text))
+        if self.escalating is not None:
+            self.escalations.append((self.now(), self.escalating))
+        return SimpleNamespace(message_id=len(self.sent), chat_id=chat_id)
+
+
+def populate(viewers: int, auditors: int, stores: int, rng: random.Random):
+    codes = list(bot.STORE_CATALOG)
+    for i in range(len(codes), stores):
+        code = f"S{i:04d}"
+        bot.STORE_CATALOG[code] = f"SIM_{code}"; codes.append(code)
+    codes = codes[:stores]
+    tzs, weights = list(TZ_WEIGHTS), list(TZ_WEIGHTS.values())
+    uid = 10_000
+    for _ in range(auditors):
+        uid += 1
+        store = rng.choice(codes)
+        bot.STAFF[uid] = Profile(role="auditor", stores=[store], current_store=store, name=f"a{uid}",
+                                 tz=rng.choices(tzs, weights)[0])
+    for _ in range(viewers):
+        uid += 1
+        bot.STAFF[uid] = Profile(role="viewer", name=f"v{uid}", tz=rng.choices(tzs, weights)[0])
+        subs = ["*"] if rng.random() < 0.05 else rng.sample(codes, rng.randint(1, min(8, len(codes))))
+        bot._subs.load({uid: subs})
+    return codes
+
+
+def plan_runs(codes, start: datetime, end: datetime, rate: float, rng: random.Random) -> list[tuple[datetime, str]]:
+    """Случайные завершённые прогоны: с вероятностью rate в день на магазин, местные 9–20 (пояс аудитора)."""
+    tz_of = {}
+    for prof in bot.STAFF.values():
+        if prof.get("role") == "auditor":
+            tz_of.setdefault(prof["current_store"], ZoneInfo(prof["tz"]))
+    out = []
+    day = start.date() - timedelta(days=1)
+    while day <= end.date():
+        for code in codes:
+            if rng.random() < rate:
+                z = tz_of.get(code, ZoneInfo("Europe/Moscow"))
+                local = datetime(day.year, day.month, day.day, rng.randint(9, 20), rng.randint(0, 59), tzinfo=z)
+                ts = local.astimezone(timezone.utc)
+                if start - timedelta(days=7) <= ts < end:
+                    out.append((ts, code))
+        day += timedelta(days=1)
+    return sorted(out)
+
+
+def schedule(start: datetime, end: datetime, drift_s: float, jitter_s: float, rng: random.Random):
+    """Тики всех заданий по времени: k-й тик = first + k·interval + k·drift + U(0, jitter)."""
+    ticks = []
+    for fn, first, interval in bot.REMINDER_JOBS:
+        k = 0
+        while True:
+            t = start + timedelta(seconds=first + k * (interval + drift_s) + rng.uniform(0, jitter_s))
+            if t >= end:
+                break
+            ticks.append((t, fn)); k += 1
+    return sorted(ticks, key=lambda x: x[0])
+
+
+def _pct(values: list[float], q: float) -> float:
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(len(s) * q))], 2) if s else 0.0
+
+
+def _dst_day(z: ZoneInfo, d: date) -> bool:
+    a = datetime(d.year, d.month, d.day, tzinfo=z).utcoffset()
+    nd = d + timedelta(days=1)
+    return a != datetime(nd.year, nd.month, nd.day, tzinfo=z).utcoffset()
+
+
+def _period_has_dst(z: ZoneInfo, kind: str, local: datetime) -> bool:
+    if WINDOWS[kind][2] is bot._period_day:
+        return _dst_day(z, local.date())
+    monday = local.date() - timedelta(days=local.weekday())
+    return any(_dst_day(z, monday + timedelta(days=i)) for i in range(7))
+
+
+def windows_for(z: ZoneInfo, kind: str, start: datetime, end: datetime) -> dict[str, tuple[datetime, datetime]]:
+    """Окна kind в поясе z, целиком лежащие в [start, end): период → (начало, конец) в UTC."""
+    inside, period_of = WINDOWS[kind][1], WINDOWS[kind][2]
+    out: dict[str, list] = {}
+    t = start
+    while t < end:
+        local = t.astimezone(z)
+        if inside(local):
+            p = period_of(local)
+            w = out.setdefault(p, [t, t])
+            w[1] = t + STEP
+        t += STEP
+    # окно, начатое до старта (или не закрытое к концу), считать нечестно — его часть вне симуляции
+    return {p: (a, b) for p, (a, b) in out.items()
+            if a > start and b < end and not inside((a - STEP).astimezone(z))}
+
+
+def analyse(sent_by_kind, escalations, ticks, start, end):
+    users_by_tz: dict[str, dict[str, list[int]]] = {}
+    for uid, prof in bot.STAFF.items():
+        role = prof.get("role")
+        group = "auditor" if role == "auditor" and prof.get("current_store") else \
+                "viewer" if uid in bot._subs and role != "auditor" else None
+        if group:
+            users_by_tz.setdefault(prof["tz"], {}).setdefault(group, []).append(uid)
+    tick_times: dict[str, list[datetime]] = {}
+    for t, fn in ticks:
+        tick_times.setdefault(fn.__name__, []).append(t)
+    repeat = {k: bot.REMINDER_POLICIES[k].get("repeat_h") for k in WINDOWS}
+
+    report, examples = {}, []
+    for kind, (job, inside, period_of) in WINDOWS.items():
+        group = kind.split("_")[0]
+        r = {"windows": 0, "uncovered": 0, "unsent": 0, "duplicates": 0, "sent": 0, "dst_missed": 0, "dst_duplicates": 0}
+        sends: dict[tuple[int, str], list[datetime]] = {}
+        for t, uid in sent_by_kind.get(kind, []):
+            z = ZoneInfo(bot.STAFF[uid]["tz"])
+            sends.setdefault((uid, period_of(t.astimezone(z))), []).append(t)
+            r["sent"] += 1
+        for tz, groups in users_by_tz.items():
+            uids = groups.get(group, [])
+            if not uids:
+                continue
+            z = ZoneInfo(tz)
+            wins = windows_for(z, kind, start, end)
+            covered = {period_of(t.astimezone(z)) for t in tick_times.get(job, [])
+                       if inside(t.astimezone(z))}
+            for p, (a, _) in wins.items():
+                dst = _period_has_dst(z, kind, a.astimezone(z))
+                r["windows"] += len(uids)
+                if p not in covered:
+                    r["uncovered"] += len(uids); r["dst_missed"] += len(uids) if dst else 0
+                    examples.append({"kind": kind, "tz": tz, "period": p, "users": len(uids), "dst": dst,
+                                     "problem": "no tick inside the window"})
+                elif group == "viewer":  # наблюдателю сообщение уходит всегда, если тик попал в окно
+                    lost = [u for u in uids if (u, p) not in sends]
+                    if lost:
+                        r["unsent"] += len(lost); r["dst_missed"] += len(lost) if dst else 0
+                        examples.append({"kind": kind, "tz": tz, "period": p, "users": len(lost), "dst": dst,
+                                         "problem": "window covered, nothing sent"})
+        for (uid, p), times in sends.items():
+            times.sort()
+            if repeat[kind]:
+                gap = timedelta(hours=repeat[kind]) - bot.REMINDER_DRIFT
+                dup = sum(1 for a, b in zip(times, times[1:]) if b - a < gap)
+            else:
+                dup = len(times) - 1
+            if dup:
+                z = ZoneInfo(bot.STAFF[uid]["tz"])
+                dst = _period_has_dst(z, kind, times[0].astimezone(z))
+                r["duplicates"] += dup; r["dst_duplicates"] += dup if dst else 0
+                examples.append({"kind": kind, "tz": bot.STAFF[uid]["tz"], "period": p, "users": 1, "dst": dst,
+                                 "problem": f"{len(times)} sends in period"})
+        report[kind] = r
+    report["escalation"] = _analyse_escalations(escalations, examples)
+    return report, examples
+
+
+def _analyse_escalations(escalations, examples) -> dict:
+    """Эскалация — одна на (аудитор, местный день): несколько тиков с ней в одном дне — дубль."""
+    ticks: dict[tuple[int, str], set[datetime]] = {}
+    for t, auditor in escalations:
+        z = ZoneInfo(bot.STAFF[auditor]["tz"])
+        ticks.setdefault((auditor, bot._period_day(t.astimezone(z))), set()).add(t)
+    r = {"escalations": len(ticks), "messages": len(escalations), "duplicates": 0, "dst_duplicates": 0}
+    for (auditor, p), times in ticks.items():
+        dup = len(times) - 1
+        if dup:
+            z = ZoneInfo(bot.STAFF[auditor]["tz"])
+            dst = _dst_day(z, date.fromisoformat(p))
+            r["duplicates"] += dup; r["dst_duplicates"] += dup if dst else 0
+            examples.append({"kind": "escalation", "tz": bot.STAFF[auditor]["tz"], "period": p, "users": 1,
+                             "dst": dst, "problem": f"escalated in {len(times)} ticks"})
+    return r
+
+
+async def simulate(a) -> dict:
+    rng = random.Random(a.seed)
+    start = datetime.combine(a.start, datetime.min.time(), tzinfo=timezone.utc)
+    end = start + timedelta(days=a.days)
+    codes = populate(a.viewers, a.auditors, a.stores, rng)
+    runs = plan_runs(codes, start, end, a.run_rate, rng)
+    ticks = schedule(start, end, a.drift_s, a.jitter_s, rng)
+
+    now = [start]
+    bot.set_clock(lambda: now[0])
+    rec = RecordingBot(lambda: now[0])
+    escalate = bot._escalate_overdue
+
+    async def tagged_escalate(context, auditor_id, *args):
+        rec.escalating = auditor_id
+        try:
+            return await escalate(context, auditor_id, *args)
+        finally:
+            rec.escalating = None
+    bot._escalate_overdue = tagged_escalate
+    ctx = SimpleNamespace(bot=rec, application=None, job=None)
+    cpu: dict[str, list[float]] = {}
+    sent_by_kind: dict[str, list[tuple[datetime, int]]] = {}
+    kind_of = {fn: k for k, (fn, _, _) in WINDOWS.items()}
+    ri = 0
+    wall0 = time.perf_counter()
+    try:
+        for t, fn in ticks:
+            now[0] = t
+            while ri < len(runs) and runs[ri][0] <= t:
+                ts, code = runs[ri]; ri += 1
+                bot.LAST_RUNS[code] = ts.isoformat(timespec="seconds")
+            n0 = len(rec.sent)
+            c0 = time.process_time()
+            await fn(ctx)
+            cpu.setdefault(fn.__name__, []).append((time.process_time() - c0) * 1000)
+            for _, uid, text in rec.sent[n0:]:
+                kind = "escalation" if text.startswith("⚠️") else kind_of[fn.__name__]
+                sent_by_kind.setdefault(kind, []).append((t, uid))
+    finally:
+        bot.set_clock()
+        bot._escalate_overdue = escalate
+    wall = time.perf_counter() - wall0
+
+    per_hour: dict[datetime, int] = {}
+    for t, _, _ in rec.sent:
+        h = t.replace(minute=0, second=0, microsecond=0)
+        per_hour[h] = per_hour.get(h, 0) + 1
+    hours = a.days * 24
+    busiest = sorted(per_hour.items(), key=lambda x: -x[1])[:a.top]
+    windows, examples = analyse(sent_by_kind, rec.escalations, ticks, start, end)
+    return {
+        "span": {"start": start.isoformat(), "days": a.days, "ticks": len(ticks), "runs": len(runs),
+                 "drift_s": a.drift_s, "jitter_s": a.jitter_s, "wall_s": round(wall, 2),
+                 "simulated_x": round(a.days * 86400 / max(wall, 1e-9))},
+        "population": {"viewers": a.viewers, "auditors": a.auditors, "stores": len(codes)},
+        "messages": {"total": len(rec.sent), "peak_per_hour": max(per_hour.values(), default=0),
+                     "mean_per_hour": round(len(rec.sent) / hours, 1),
+                     "busiest_hours": [{"hour": h.isoformat(), "messages": n} for h, n in busiest],
+                     "by_kind": {k: len(v) for k, v in sorted(sent_by_kind.items())}},
+        "cpu_ms_per_tick": {job: {"p50": _pct(v, 0.5), "p95": _pct(v, 0.95), "max": round(max(v), 2),
+                                  "total_s": round(sum(v) / 1000, 2)} for job, v in cpu.items()},
+        "windows": windows,
+        "problems": examples[:a.examples],
+        "problems_total": len(examples),
+        "data_dir": os.environ["DATA_DIR"],
+    }
+
+
+def _print(res: dict):
+    s, m = res["span"], res["messages"]
+    print(f"{s['days']} days from {s['start']}: {s['ticks']} ticks, {s['runs']} runs, "
+          f"drift {s['drift_s']}s/tick, jitter {s['jitter_s']}s — {s['wall_s']}s wall (x{s['simulated_x']})")
+    print(f"population: {res['population']}")
+    print(f"messages: {m['total']} total, peak {m['peak_per_hour']}/h, mean {m['mean_per_hour']}/h  {m['by_kind']}")
+    for h in m["busiest_hours"]:
+        print(f"  {h['hour']}  {h['messages']}")
+    print("cpu per tick, ms:")
+    for job, st in res["cpu_ms_per_tick"].items():
+        print(f"  {job:<28} p50 {st['p50']:>8}  p95 {st['p95']:>8}  max {st['max']:>8}  total {st['total_s']}s")
+    print("windows (user × period):")
+    for kind, w in res["windows"].items():
+        print(f"  {kind:<16} " + "  ".join(f"{k}={v}" for k, v in w.items()))
+    for p in res["problems"]:
+        print(f"  ! {p['kind']:<16} {p['tz']:<20} {p['period']:<10} users={p['users']:<5} "
+              f"{'DST ' if p['dst'] else ''}{p['problem']}")
+    if res["problems_total"] > len(res["problems"]):
+        print(f"  … {res['problems_total'] - len(res['problems'])} more")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--start", type=date.fromisoformat, default=default_start(), help="дата начала (00:00 UTC)")
+    ap.add_argument("--days", type=int, default=8)
+    ap.add_argument("--viewers", type=int, default=300)
+    ap.add_argument("--auditors", type=int, default=100)
+    ap.add_argument("--stores", type=int, default=39)
+    ap.add_argument("--run-rate", type=float, default=0.6, help="вероятность прогона магазина за день")
+    ap.add_argument("--drift-s", type=float, default=0.0, help="копящееся опоздание каждого следующего тика, с")
+    ap.add_argument("--jitter-s", type=float, default=0.0, help="случайное опоздание тика 0…N с")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--top", type=int, default=5, help="самых загруженных часов в отчёте")
+    ap.add_argument("--examples", type=int, default=20, help="сколько проблемных окон показать")
+    ap.add_argument("--json", action="store_true")
+    a = ap.parse_args()
+    res = asyncio.run(simulate(a))
+    if a.json:
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+    else:
+        _print(res)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+## tools/snapshot_tool.py — конвертация состояния между JSON-файлами и бинарным снапшотом (statefile)
+#
+#   python tools/snapshot_tool.py to-bin  --data-dir data [--out data/snapshot.bin]
+#   python tools/snapshot_tool.py to-json --snapshot data/snapshot.bin --out-dir export/
+#   python tools/snapshot_tool.py verify  --data-dir data        # JSON → bin → JSON без потерь
+#   python tools/snapshot_tool.py info    --snapshot data/snapshot.bin
+import sys
+import json
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import statefile  # noqa: E402
+from statestore import read_legacy, write_legacy  # noqa: E402
+
+
+def _state_from_json(data_dir: Path) -> dict:
+    state = read_legacy(data_dir)
+    tom = data_dir / "tom_groups.json"
+    if tom.exists():
+        state["tom"] = json.loads(tom.read_text(encoding="utf-8"))
+    runs = data_dir / "check_runs.jsonl"
+    if runs.exists():
+        last: dict[str, str] = {}
+        with runs.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue
+                if r.get("store") and r.get("ts") and r["ts"] > last.get(r["store"], ""):
+                    last[r["store"]] = r["ts"]
+        state["runs"] = last
+    return state
+
+
+def cmd_to_bin(a):
+    data_dir = Path(a.data_dir)
+    out = Path(a.out) if a.out else data_dir / "snapshot.bin"
+    state = _state_from_json(data_dir)
+    statefile.dump(state, out)
+    print(f"{out}: {out.stat().st_size} bytes, staff={len(state['staff'])} subs={len(state['subs'])} runs={len(state['runs'])}")
+
+
+def cmd_to_json(a):
+    state = statefile.load(a.snapshot)
+    out = Path(a.out_dir)
+    write_legacy(state, out)
+    if "tom" in state:
+        (out / "tom_groups.json").write_text(json.dumps(state["tom"], ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"{out}: staff={len(state['staff'])} subs={len(state['subs'])} pending={len(state['pending'])}")
+
+
+def cmd_verify(a):
+    state = _state_from_json(Path(a.data_dir))
+    back = statefile.loads(statefile.dumps(state))
+    ok = all(back.get(k) == state.get(k) for k in ("staff", "pending", "subs", "runs", "tom") if k in state)
+    print("OK" if ok else "MISMATCH")
+    sys.exit(0 if ok else 1)
+
+
+def cmd_info(a):
+    data = Path(a.snapshot).read_bytes()
+    state = statefile.loads(data)
+    print(json.dumps({"bytes": len(data), "seq": state["seq"], "staff": len(state["staff"]),
+                      "subs": len(state["subs"]), "pending": len(state["pending"]), "runs": len(state["runs"])}))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("to-bin"); p.add_argument("--data-dir", default="data"); p.add_argument("--out"); p.set_defaults(fn=cmd_to_bin)
+    p = sub.add_parser("to-json"); p.add_argument("--snapshot", required=True); p.add_argument("--out-dir", required=True); p.set_defaults(fn=cmd_to_json)
+    p = sub.add_parser("verify"); p.add_argument("--data-dir", default="data"); p.set_defaults(fn=cmd_verify)
+    p = sub.add_parser("info"); p.add_argument("--snapshot", required=True); p.set_defaults(fn=cmd_info)
+    a = ap.parse_args()
+    a.fn(a)
+
+
+if __name__ == "__main__":
+    main()